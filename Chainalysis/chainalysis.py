@@ -7,10 +7,11 @@ E.g.
 
     uvicorn main:app --host 192.168.2.25
 """
+import asyncio
 import os
 import uuid
 
-from vcf import create_relationship
+from vcf import create_relationship, deadline_error, deadline_exceeded, deadline_timeout
 
 import requests
 
@@ -62,10 +63,14 @@ async def get_chainalysis(query: str, max_results=100):
     # address one by one, and append to the search results.
     search_results = []
     for queried_wallet_count, wallet_address in enumerate(wallet_addresses):
+        if deadline_exceeded():
+            # Out of time, so return the wallets queried so far
+            return {'searchResults': search_results, 'errors': [deadline_error()]}
         try:
-            response = api.get(
+            response = await asyncio.to_thread(
+                api.get,
                 CHAINALYSIS_API_SANCTIONS_ENDPOINT.format(**{'wallet_address': wallet_address}),
-                timeout=CHAINALYSIS_API_CALL_TIMEOUT,
+                timeout=deadline_timeout(CHAINALYSIS_API_CALL_TIMEOUT),
             )
             data: dict = response.json()
         except requests.RequestException:
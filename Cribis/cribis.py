@@ -7,10 +7,13 @@ E.g.
 
     uvicorn main:app --host 192.168.2.25
 """
+import asyncio
+import operator
 import os
 import uuid
 
-from vcf import create_relationship
+from vcf import (EntityMapping, Related, ResultMapping, call, const, deadline_timeout, field, get_logger, join,
+                 log_payload, new_uuid, text, uuid_of)
 
 import zeep
 
@@ -22,13 +25,120 @@ CRIBIS_API_CALL_TIMEOUT = 15.0  # NOTE: API seems to be very slow. Set a suffici
 CRIBIS_API_WSDL_URL = 'https://dis.cribis.com/Search/2012-04-20/?singleWsdl'
 ITALY_COUNTRY_CODE = 'IT'
 
+logger = get_logger('cribis')
+
+
+def cribis_date(value):
+    try:
+        return value.strftime('%d/%m/%Y')
+    except Exception:
+        return '-'
+
+
+def cribis_description(activity_description):
+    description = (activity_description or '').replace('\r', '').replace('\n', '\r\n')
+    if len(description) > 150:
+        description = f'{description[:150].strip()}...'
+    return description
+
+
+def cribis_company_subtitle(unit_type_code, crif_number):
+    if unit_type_code == 'S':
+        return f'Company Headquarters - {crif_number}'
+    return f'Company Branch - {crif_number}'
+
+
+def cribis_company_url(duns_number):
+    if duns_number:
+        return f'https://www2.cribisx.com/#Purchase/CompanyByDUNS/{duns_number}'
+    return 'https://www2.cribisx.com'
+
+
+CRIBIS_COMPANY_RESULT = ResultMapping(
+    EntityMapping('EntityBusiness', uuid_of('CrifNumber'), {
+        'Name': field('CompanyName', default=''),
+        'LocalName': field('CompanyName', default=''),
+        'CompanyNumber': field('CrifNumber', default=''),
+        'VatNumber': field('VATCode', default=''),
+        'Status': field('ActivityStatusCodeDescription', default=''),
+        'Duns': field('DunsNumber', default=''),
+        'RegistrationState': field('Region', default=''),
+        'RegistrationCountry': const(ITALY_COUNTRY_CODE or ''),
+        'Liquidated': call(operator.is_, 'FlagOutOfBusiness', True),
+        'TradeDescription': call(cribis_description, 'ActivityDescription'),
+        'StatusSince': call(cribis_date, 'LastBalanceDate'),
+    }, strict=True),
+    related=[
+        Related(None, EntityMapping('EntityWebPage', uuid_of('WebSite'), {
+            'Url': 'WebSite',
+        }, strict=True), title='Company Website', where='WebSite'),
+    ],
+    key=call(str.upper, new_uuid()),
+    title='CompanyName',
+    subTitle=call(cribis_company_subtitle, 'UnitTypeCode', 'CrifNumber'),
+    summary=text(
+        'Crif Number: {} | VAT Number: {} | Province: {} | Status: {} | Last Balance Date: {} | Description: {} | '
+        'Website: {}',
+        field('CrifNumber', default='-'),
+        field('VATCode', default='-'),
+        field('ProvinceCode', default='-'),
+        field('ActivityStatusCodeDescription', default='-'),
+        call(cribis_date, 'LastBalanceDate'),
+        call(cribis_description, 'ActivityDescription', default='-'),
+        field('WebSite', default='-'),
+    ),
+    source=const('CRIBIS API'),
+    url=call(cribis_company_url, 'DunsNumber'),
+    strict=True,
+)
+
+CRIBIS_FULL_ADDRESS = join(', ', 'Address', 'Village', 'Town', 'Province', 'Zip')
+
+CRIBIS_PERSON_RESULT = ResultMapping(
+    # Use a random string in case TAXCode is not present. If we just used a blank string, then if there are multiple
+    # records present without TAXCode, then the person's uuid would be the same for all of them - which is something we
+    # do not want - as the whole purpose of uuid is to provide a unique id, and this will generate duplicates.
+    EntityMapping('EntityOfficerRecord', uuid_of(field('TAXCode', default=new_uuid())), {
+        'FirstName': field('Name', default=''),
+        'LastName': field('Surname', default=''),
+        'Dob': call(cribis_date, 'BirthDate'),
+        'Gender': field('Gender', default=''),
+        'Nationality': field('Country', default=''),
+    }, strict=True),
+    related=[
+        Related(None, EntityMapping('EntityAddress', uuid_of(CRIBIS_FULL_ADDRESS), {
+            'Street1': field('Address', default=''),
+            'Street2': field('Village', default=''),
+            'Street3': field('Town', default=''),
+            'Region': field('Province', default=''),
+            'Postcode': field('Zip', default=''),
+        }, strict=True), title='Person Address', where=CRIBIS_FULL_ADDRESS),
+    ],
+    key=call(str.upper, new_uuid()),
+    title=call(str.strip, text('{} {}', 'Name', 'Surname')),
+    subTitle=text('Person ({}) DOB: {}. Birth Town: {}.',
+                  field('Gender', default='-'), call(cribis_date, 'BirthDate'), field('BirthTown', default='-')),
+    summary=text('Address: {}.\nIs Soletrader: {}. Is Shareholder: {}. TAX Code: {}.',
+                 join(', ', 'Address', 'Village', 'Town', 'Province', 'Zip', default='-'),
+                 'IsSoletrader', 'IsShareholder', field('TAXCode', default='-')),
+    source=const('CRIBIS API'),
+    url=const('https://www2.cribisx.com/Search/Person'),
+    strict=True,
+)
+
+
+def cribis_client():
+    """Creates the CRIBIS SOAP client, with timeouts that respect the current search's deadline."""
+    timeout = deadline_timeout()
+    return zeep.Client(CRIBIS_API_WSDL_URL, transport=zeep.Transport(timeout=timeout, operation_timeout=timeout))
+
 
 async def get_cribis_company(query: str, max_results: int = 100):
-    client = zeep.Client(CRIBIS_API_WSDL_URL)
-    search_results = []
+    client = await asyncio.to_thread(cribis_client)
     try:
         app_transaction_id = str(uuid.uuid4())
-        response = client.service.CompanySearch(
+        response = await asyncio.to_thread(
+            client.service.CompanySearch,
             Username=CRIBIS_USERNAME,
             Password=CRIBIS_PASSWORD,
             ApplicationTransactionID=app_transaction_id,
@@ -40,14 +150,15 @@ async def get_cribis_company(query: str, max_results: int = 100):
                 'CompanyName': query,
             }
         )
-    except:
+    except Exception:
         return {'error': [{'message': 'Error querying the CRIBIS API.'}]}
 
     try:
         if response.TransactionResponse.Details.ApplicationTransactionID != app_transaction_id:
             return {'error': [{'message': 'Received an illegal response from the CRIBIS API. %s' % response}]}
     except AttributeError:
-        print(response)
+        logger.warning('Incomplete response from the CRIBIS API')
+        log_payload(logger, 'CRIBIS response', response)
         return {'error': [{'message': 'Received an incomplete response from the CRIBIS API. %s' % response}]}
 
     try:
@@ -59,97 +170,28 @@ async def get_cribis_company(query: str, max_results: int = 100):
             '''
             return {'error': [{'message': 'Received an error response from the CRIBIS API. %s' % response}]}
     except AttributeError:
-        print(response)
+        logger.warning('Incomplete response from the CRIBIS API')
+        log_payload(logger, 'CRIBIS response', response)
         return {'error': [{'message': 'Received an incomplete result from the CRIBIS API. %s' % response}]}
 
     try:
         company_list = (response.CompanyList.CompanyItem or []) if response.CompanyList else []
     except AttributeError:
-        print(response)
+        logger.warning('Incomplete response from the CRIBIS API')
+        log_payload(logger, 'CRIBIS response', response)
         return {'error': [{'message': 'Received an incomplete company list from the CRIBIS API. %s' % response}]}
-    for company in company_list:
-        company_uuid = str(uuid.uuid3(uuid.NAMESPACE_DNS, company['CrifNumber']))
-        try:
-            last_balance_data_str = company['LastBalanceDate'].strftime('%d/%m/%Y')
-        except:
-            last_balance_data_str = '-'
-
-        description = (company['ActivityDescription'] or '').replace('\r', '').replace('\n', '\r\n')
-        if len(description) > 150:
-            description = f'{description[:150].strip()}...'
-
-        # Create search result
-        subtitle = f'Company Branch - {company["CrifNumber"]}'
-        if company['UnitTypeCode'] == 'S':
-            subtitle = f'Company Headquarters - {company["CrifNumber"]}'
-
-        result = {
-            'key': str(uuid.uuid4()).upper(),
-            'title': company['CompanyName'],
-            'subTitle': subtitle,
-            'summary': (
-                f'Crif Number: {company["CrifNumber"] or "-"} | '
-                f'VAT Number: {company["VATCode"] or "-"} | '
-                f'Province: {company["ProvinceCode"] or "-"} | '
-                f'Status: {company["ActivityStatusCodeDescription"] or "-"} | '
-                f'Last Balance Date: {last_balance_data_str or "-"} | '
-                f'Description: {description or "-"} | '
-                f'Website: {company["WebSite"] or "-"}'
-            ),
-            'source': 'CRIBIS API',
-            'url': (
-                f'https://www2.cribisx.com/#Purchase/CompanyByDUNS/{company["DunsNumber"]}'
-                if company['DunsNumber'] else 'https://www2.cribisx.com'
-            ),
-            'entities': [
-                {
-                    'id': company_uuid,
-                    'type': 'EntityBusiness',
-                    'attributes': {
-                        'Name': company['CompanyName'] or '',
-                        'LocalName': company['CompanyName'] or '',
-                        'CompanyNumber': company['CrifNumber'] or '',
-                        'VatNumber': company['VATCode'] or '',
-                        'Status': company["ActivityStatusCodeDescription"] or '',
-                        'Duns': company['DunsNumber'] or '',
-                        'RegistrationState': company['Region'] or '',
-                        'RegistrationCountry': ITALY_COUNTRY_CODE or '',
-                        'Liquidated': company['FlagOutOfBusiness'] is True,
-                        'TradeDescription': description or '',
-                        'StatusSince': last_balance_data_str or '',
-                    },
-                },
-            ],
-        }
-
-        if company['WebSite']:
-            webpage_uuid = str(uuid.uuid3(uuid.NAMESPACE_DNS, company['WebSite']))
-            result['entities'].append({
-                'id': webpage_uuid,
-                'type': 'EntityWebPage',
-                'attributes': {
-                    'Url': company['WebSite'],
-                },
-            })
-            result['entities'].append(create_relationship(company_uuid, webpage_uuid, 'Company Website'))
-
-        search_results.append(result)
-
-        if len(search_results) >= max_results:
-            break
-
-    return {'searchResults': search_results}
+    return {'searchResults': CRIBIS_COMPANY_RESULT.many(company_list, max_results)}
 
 
 async def get_cribis_people(query: str, max_results: int = 100):
-    client = zeep.Client(CRIBIS_API_WSDL_URL)
-    search_results = []
+    client = await asyncio.to_thread(cribis_client)
     person_name_words = (query or '').split(' ')
     person_name = person_name_words[0]
     person_surname = ' '.join(person_name_words[1:])
     try:
         app_transaction_id = str(uuid.uuid4())
-        response = client.service.PersonSearch(
+        response = await asyncio.to_thread(
+            client.service.PersonSearch,
             Username=CRIBIS_USERNAME,
             Password=CRIBIS_PASSWORD,
             ApplicationTransactionID=app_transaction_id,
@@ -160,14 +202,15 @@ async def get_cribis_people(query: str, max_results: int = 100):
                 'MaximumHits': max_results,
             }
         )
-    except:
+    except Exception:
         return {'error': [{'message': 'Error querying the CRIBIS API.'}]}
 
     try:
         if response.TransactionResponse.Details.ApplicationTransactionID != app_transaction_id:
             return {'error': [{'message': 'Received an illegal response from the CRIBIS API. %s' % response}]}
     except AttributeError:
-        print(response)
+        logger.warning('Incomplete response from the CRIBIS API')
+        log_payload(logger, 'CRIBIS response', response)
         return {'error': [{'message': 'Received an incomplete response from the CRIBIS API. %s' % response}]}
 
     try:
@@ -181,85 +224,15 @@ async def get_cribis_people(query: str, max_results: int = 100):
             '''
             return {'error': [{'message': 'Received an error response from the CRIBIS API. %s' % response}]}
     except AttributeError:
-        print(response)
+        logger.warning('Incomplete response from the CRIBIS API')
+        log_payload(logger, 'CRIBIS response', response)
         return {'error': [{'message': 'Received an incomplete result from the CRIBIS API. %s' % response}]}
 
     try:
         people_list = (response.PersonList.PersonItem or []) if response.PersonList else []
     except AttributeError:
-        print(response)
+        logger.warning('Incomplete response from the CRIBIS API')
+        log_payload(logger, 'CRIBIS response', response)
         return {'error': [{'message': 'Received an incomplete people list from the CRIBIS API. %s' % response}]}
 
-    for person in people_list:
-        # Use a random string in case TAXCode is not present. If we just used a blank string, then if there are multiple
-        # records present without TAXCode, then `person_uuid` would be the same for all of them - which is something we
-        # do not want - as the whole purpose of uuid is to provide a unique id, and this will generate duplicates.
-        person_uuid = str(uuid.uuid3(uuid.NAMESPACE_DNS, person['TAXCode'] or str(uuid.uuid4())))
-        try:
-            birth_date = person['BirthDate'].strftime('%d/%m/%Y')
-        except:
-            birth_date = '-'
-
-        full_address = person['Address'] or ''
-        if person['Village']:
-            full_address = f'{full_address}, {person["Village"]}' if full_address else person['Village']
-        if person['Town']:
-            full_address = f'{full_address}, {person["Town"]}' if full_address else person['Town']
-        if person['Province']:
-            full_address = f'{full_address}, {person["Province"]}' if full_address else person['Province']
-        if person['Zip']:
-            full_address = f'{full_address}, {person["Zip"]}' if full_address else person['Zip']
-
-        # Create search result
-        result = {
-            'key': str(uuid.uuid4()).upper(),
-            'title': f'{person["Name"]} {person["Surname"]}'.strip(),
-            'subTitle': (
-                f'Person ({person["Gender"] or "-"}) '
-                f'DOB: {birth_date}. '
-                f'Birth Town: {person["BirthTown"] or "-"}.'
-            ),
-            'summary': (
-                f'Address: {full_address or "-"}.\n'
-                f'Is Soletrader: {person["IsSoletrader"]}. '
-                f'Is Shareholder: {person["IsShareholder"]}. '
-                f'TAX Code: {person["TAXCode"] or "-"}.'
-            ),
-            'source': 'CRIBIS API',
-            'url': 'https://www2.cribisx.com/Search/Person',
-            'entities': [
-                {
-                    'id': person_uuid,
-                    'type': 'EntityOfficerRecord',
-                    'attributes': {
-                        'FirstName': person['Name'] or '',
-                        'LastName': person['Surname'] or '',
-                        'Dob': birth_date,
-                        'Gender': person['Gender'] or '',
-                        'Nationality': person['Country'] or '',
-                    },
-                },
-            ],
-        }
-
-        if full_address:
-            address_uuid = str(uuid.uuid3(uuid.NAMESPACE_DNS, full_address or ''))
-            result['entities'].append({
-                'id': address_uuid,
-                'type': 'EntityAddress',
-                'attributes': {
-                    'Street1': person['Address'] or '',
-                    'Street2': person['Village'] or '',
-                    'Street3': person['Town'] or '',
-                    'Region': person['Province'] or '',
-                    'Postcode': person['Zip'] or '',
-                },
-            })
-            result['entities'].append(create_relationship(person_uuid, address_uuid, 'Person Address'))
-
-        search_results.append(result)
-
-        if len(search_results) >= max_results:
-            break
-
-    return {'searchResults': search_results}
+    return {'searchResults': CRIBIS_PERSON_RESULT.many(people_list, max_results)}
@@ -0,0 +1,70 @@
+"""
+Tests of the CRIBIS adaptor's searches, with the CRIBIS API replaced by canned responses.
+
+The golden folder holds, for canned responses, the results that the hand-written code the mappings replaced returned
+for them. Values that were random (keys, and the ids of people without a TAX code) are replaced by placeholders, which
+stand for the same value wherever it is used.
+
+Run from the Cribis folder with `python -m pytest tests`.
+"""
+import asyncio
+import datetime
+import json
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("zeep")
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+import cribis  # noqa: E402
+from vcf import results_to_json  # noqa: E402
+
+GOLDEN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "golden")
+
+
+def normalised(first, second):
+    """`first`, with the values that are different in `second` (the same search again) replaced by placeholders."""
+    placeholders = {}
+
+    def normalise(a, b):
+        if isinstance(a, dict):
+            assert a.keys() == b.keys()
+            return {name: normalise(a[name], b[name]) for name in a}
+        if isinstance(a, list):
+            assert len(a) == len(b)
+            return [normalise(x, y) for x, y in zip(a, b)]
+        if a != b:
+            return placeholders.setdefault(a, f"<random {len(placeholders) + 1}>")
+        return a
+    return normalise(first, second)
+
+
+def fake_api(monkeypatch, items: list):
+    """Replaces the CRIBIS API by one that finds the items, whichever search is made. Dates are read as zeep does."""
+    items = [{name: datetime.date.fromisoformat(value) if name.endswith("Date") and value else value
+              for name, value in item.items()} for item in items]
+
+    def search(**kwargs):
+        details = SimpleNamespace(ApplicationTransactionID=kwargs["ApplicationTransactionID"])
+        transaction = SimpleNamespace(Details=details, Result=SimpleNamespace(Code="OK"))
+        return SimpleNamespace(TransactionResponse=transaction, CompanyList=SimpleNamespace(CompanyItem=items),
+                               PersonList=SimpleNamespace(PersonItem=items))
+    client = SimpleNamespace(service=SimpleNamespace(CompanySearch=search, PersonSearch=search))
+    monkeypatch.setattr(cribis, "cribis_client", lambda: client)
+
+
+@pytest.mark.parametrize("searcher_id", ["cribis_company", "cribis_people"])
+def test_golden_results(monkeypatch, searcher_id):
+    with open(os.path.join(GOLDEN_DIR, searcher_id + ".json")) as file:
+        golden = json.load(file)
+    fake_api(monkeypatch, golden["items"])
+    search = getattr(cribis, "get_" + searcher_id)
+
+    def results():
+        return json.loads(results_to_json(asyncio.run(search(golden["query"], golden["max_results"]))))
+    assert normalised(results(), results()) == golden["expected"]
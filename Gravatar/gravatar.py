@@ -7,76 +7,92 @@ E.g.
 
     uvicorn main:app --host 192.168.2.25
 """
-import uuid
+import asyncio
 
 import requests
 from libgravatar import Gravatar
 
-from vcf import create_relationship, email_to_entity
+from vcf import (Cases, EntityMapping, Related, RelationshipRecord, ResultMapping, attribute, call, const,
+                 deadline_timeout, field, text, uuid_of)
 
 # ============================ Gravatar functions ============================
-def gravatar_account_to_entity(account):
-    """Converts gravatar JSON for social media accounts to their respective Videris entities."""
-    shortname = account["shortname"]
-
-    shortname_to_entity = {
-        "flickr": "EntityFlickrProfile",
-        "facebook": "EntityFacebookProfile",
-        "goodreads": "EntityOnlineIdentity",
-        "tumblr": "EntityOnlineIdentity",
-        "twitter": "EntityTwitterProfile",
-        "wordpress": "EntityWebPage"}
-
-    attributes = {
-        "facebook": {
-            "Url": "url",
-            "Username": "username"
-        },
-        "flickr": {
-            "Url": "url",
-            "Id": "username"
-        },
-        "goodreads": {
-            "Url": "url",
-            "Site": "domain",
-            "UserName": "userid"
-        },
-        "tumblr": {
-            "Url": "url",
-            "Site": "domain",
-            "UserName": "username",
-            "ScreenName": "display"
-        },
-        "twitter": {
-            "Url": "url",
-            "Username": "username",
-            "Verified": "verified"
-        },
-        "wordpress": {
-            "Url": "url"
-        }
-    }
-
-    if shortname not in shortname_to_entity.keys():
-        return None
-    else:
-        entity = {
-            "id": str(uuid.uuid3(uuid.NAMESPACE_DNS, account["url"])),
-            "type": shortname_to_entity[shortname],
-            "attributes": dict()
-        }
-
-        for att, src in attributes[shortname].items():
-            entity["attributes"][att] = account[src]
-
-        return entity
+def gravatar_name(name, username, part):
+    """A part of a profile's name: its username if it has no name, or blank if its name is empty."""
+    if name is None:
+        return username if part != "familyName" else ""
+    return name[part] if name else ""
+
+
+# Social media accounts, by their shortname, as their respective Videris entities
+GRAVATAR_ACCOUNTS = Cases("shortname", {
+    "facebook": EntityMapping("EntityFacebookProfile", uuid_of("url"), {
+        "Url": "url",
+        "Username": "username"
+    }, strict=True),
+    "flickr": EntityMapping("EntityFlickrProfile", uuid_of("url"), {
+        "Url": "url",
+        "Id": "username"
+    }, strict=True),
+    "goodreads": EntityMapping("EntityOnlineIdentity", uuid_of("url"), {
+        "Url": "url",
+        "Site": "domain",
+        "UserName": "userid"
+    }, strict=True),
+    "tumblr": EntityMapping("EntityOnlineIdentity", uuid_of("url"), {
+        "Url": "url",
+        "Site": "domain",
+        "UserName": "username",
+        "ScreenName": "display"
+    }, strict=True),
+    "twitter": EntityMapping("EntityTwitterProfile", uuid_of("url"), {
+        "Url": "url",
+        "Username": "username",
+        "Verified": "verified"
+    }, strict=True),
+    "wordpress": EntityMapping("EntityWebPage", uuid_of("url"), {
+        "Url": "url"
+    }, strict=True),
+})
+
+GRAVATAR_EMAIL = EntityMapping("EntityEmail", uuid_of(attribute("EmailAddress")), {
+    "EmailAddress": call(str.lower, "value")
+}, strict=True)
+
+GRAVATAR_RESULT = ResultMapping(
+    EntityMapping("EntityPerson", uuid_of("id"), {
+        "FirstName": call(gravatar_name, field("name", strict=False), "preferredUsername", const("givenName")),
+        "LastName": call(gravatar_name, field("name", strict=False), "preferredUsername", const("familyName"))
+    }, strict=True),
+    related=[
+        # TODO Learn how to create Image entities
+        # EntityMapping("EntityImage", uuid_of("thumbnailUrl"), {
+        #     "Imageuri": gravatar_url,
+        #     "Uri": "thumbnailUrl",
+        #     "Data": "thumbnailUrl"
+        # })
+        Related(None, EntityMapping("EntityWebPage", uuid_of("profileUrl"), {
+            "Url": "profileUrl"
+        }, strict=True)),
+        # If the profile has info about online accounts then capture that
+        Related(field("accounts", strict=False), GRAVATAR_ACCOUNTS),
+    ],
+    title="displayName",
+    subTitle=call(gravatar_name, field("name", strict=False), "preferredUsername", const("formatted")),
+    summary=text("Id: {} | Username: {}", "id", "preferredUsername"),
+    source=const("Gravatar"),
+    url="profileUrl",
+    strict=True,
+)
 
 
 async def get_gravatar(query: str, max_results=100):
     g = Gravatar(query)
     # gravatar_url = g.get_image(160, "mp", False, "r")   TODO: Learn how to create Image entities
     gravatar_profile = g.get_profile(data_format="json")
-    r = requests.get(gravatar_profile)
+    try:
+        r = await asyncio.to_thread(requests.get, gravatar_profile, timeout=deadline_timeout())
+    except requests.RequestException as e:
+        return {"errors": [{"message": str(e)}]}
     output = dict()
     if r.status_code != 200:
         return {"errors": [{"message": r.json()}]}
@@ -86,80 +102,19 @@ async def get_gravatar(query: str, max_results=100):
 
         search_results = []
         for entry in data["entry"]:
-            person_uuid = str(uuid.uuid3(uuid.NAMESPACE_DNS, entry['id']))
-
-            # Get names
-            formatted_name, first_name, last_name = ("", "", "")  # Blank names by default
-
-            # Check if the response contains name info
-            if "name" not in entry:
-                # If not, use the username
-                formatted_name = entry["preferredUsername"]
-                first_name = entry["preferredUsername"]
-            elif entry["name"] != []:
-                # If there is non-empty name object, then use that
-                formatted_name = entry["name"]["formatted"]
-                first_name = entry["name"]["givenName"]
-                last_name = entry["name"]["familyName"]
-
-            # Create search result
-            result = {
-                "key": str(uuid.uuid4()),
-                "title": entry["displayName"],
-                "subTitle": formatted_name,
-                "summary": f"Id: {entry['id']} | Username: {entry['preferredUsername']}",
-                "source": "Gravatar",
-                "entities": [
-                    # TODO Learn how to create Image entities
-                    # {
-                    #     "id": str(uuid.uuid3(uuid.NAMESPACE_DNS, entry["thumbnailUrl"])),
-                    #     "type": "EntityImage",
-                    #     "attributes": {
-                    #         "Imageuri": gravatar_url,
-                    #         "Uri": entry["thumbnailUrl"],
-                    #         "Data": entry["thumbnailUrl"]
-                    #     }
-                    # },
-                    {
-                        "id": person_uuid,
-                        "type": "EntityPerson",
-                        "attributes": {
-                            "FirstName": first_name,
-                            "LastName": last_name
-                        }
-                    },
-                    {
-                        "id": str(uuid.uuid3(uuid.NAMESPACE_DNS, entry["profileUrl"])),
-                        "type": "EntityWebPage",
-                        "attributes": {
-                            "Url": entry["profileUrl"]
-                        }
-                    }
-                ],
-                "url": entry["profileUrl"]
-            }
-
-            # If the profile has info about online accounts then capture that
-            if "accounts" in entry:
-                for account in entry["accounts"]:
-                    entity = gravatar_account_to_entity(account)
-                    if entity is not None:
-                        result["entities"].append(entity)
-
-            entity: dict = email_to_entity(query.lower())
-            result["entities"].append(entity)
-
-            if "emails" in entry:
-                for email in entry["emails"]:
-                    if email["value"].lower() != query.lower():
-                        entity = email_to_entity(email["value"].lower())
-                        result["entities"].append(entity)
-
-            for entity in result["entities"].copy():
-                if entity["id"] != person_uuid:
-                    relationship: dict = create_relationship(person_uuid, entity["id"])
-                    result["entities"].append(relationship)
-
+            result = GRAVATAR_RESULT(entry)
+            person_uuid = result.entities[0].id
+
+            # The searched email, and any others on the profile
+            emails = [{"value": query}] + [email for email in entry.get("emails", [])
+                                           if email["value"].lower() != query.lower()]
+            for email in emails:
+                entity = GRAVATAR_EMAIL(email)
+                result.entities.append(entity)
+                result.entities.append(RelationshipRecord(person_uuid, entity.id))
+
+            # The relationships go after all of the entities, in the same order
+            result.entities.sort(key=lambda entity: entity.type == "RelationshipRelationship")
             search_results.append(result)
 
         output["searchResults"] = search_results
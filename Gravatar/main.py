@@ -8,47 +8,90 @@ E.g.
     uvicorn main:app --host 192.168.2.25
 """
 
-import yaml
-from fastapi import FastAPI, status
+from fastapi import FastAPI, Header, Request, status
 
 from vcf import *
 from gravatar import *
 
 app = FastAPI()
+# Compresses responses as set in config.yml's compression section
+app.add_middleware(CompressionMiddleware)
+logger = get_logger("main")
 
 
+def resolve_handler(searcher: Mapping):
+    """Returns the function carrying out a searcher's searches, or None if the searcher is redirected elsewhere."""
+    if "redirect" in searcher:
+        return None
+    return globals()["get_" + searcher["id"]]
 
 
-@app.get("/searchers/", response_model=List[Searcher], response_model_exclude_none=True)
-def get_searchers():
-    with open('config.yml', 'r') as file:
-        CONFIG = yaml.safe_load(file)
-    searchers = []
+@app.on_event("startup")
+async def startup():
+    # config.yml is only read here, and again whenever it changes, rather than on every request
+    app.state.config_watcher = start_registry(resolve_handler)
+    # Records the stack of any code blocking the event loop for longer than watchdog.threshold_ms
+    app.state.loop_watchdog = start_watchdog()
+
 
-    for searcher in CONFIG["searchers"].values():
-        if searcher["enabled"]:
-            searcher.pop("enabled", None)
-            searcher.pop("redirect", None)
-            searchers.append(searcher)
+@app.on_event("shutdown")
+async def shutdown():
+    app.state.config_watcher.cancel()
+    app.state.loop_watchdog.stop()
 
-    return searchers
+
+@app.get("/searchers/", response_model=List[Searcher], response_model_exclude_none=True)
+def get_searchers():
+    return get_registry().searchers
 
 
 @app.get("/searchers/{searcher_id}/results", response_model=SearchResults, response_model_exclude_none=True,
          status_code=status.HTTP_200_OK)
-async def get_results(searcher_id, query: str, maxResults=50):
-    with open('config.yml', 'r') as file:
-        CONFIG = yaml.safe_load(file)
+async def get_results(searcher_id, query: str, request: Request, maxResults=50,
+                      x_vcf_time_limit: Optional[float] = Header(None), cache_control: Optional[str] = Header(None)):
+    # Deadline of the search, which the VCF router sends with every search it redirects
+    set_deadline(x_vcf_time_limit)
+    # Cache-Control: no-cache skips cached results
+    set_cache_bypass(cache_control)
+    # Messages logged during the search are filtered (and sampled) by its searcher's logging settings
+    set_log_searcher(searcher_id)
+    registry = get_registry()
+    CONFIG = registry.config
     if searcher_id in CONFIG["searchers"]:
         if CONFIG["searchers"][searcher_id]["enabled"]:
             if "redirect" in CONFIG["searchers"][searcher_id].keys():
                 redirect = CONFIG["searchers"][searcher_id]["redirect"] + f"?query={query}&maxResults={str(maxResults)}"
-                print(redirect)
+                logger.debug("Redirecting to %s", redirect)
                 return requests.get(redirect).json()
             else:
-                return await globals()["get_" + searcher_id](query, maxResults)
+                # Results are cached for the searcher's cache_ttl, identical searches already in progress share their
+                # result instead of querying the API again, and searches are cancelled if the client (e.g. the VCF
+                # router) disconnects. They are sent as JSON without being checked against SearchResults, unless
+                # validate_responses is on
+                return results_response(await cancel_on_disconnect(request, cached_search(
+                    searcher_id, query, maxResults, CONFIG["searchers"][searcher_id].get("cache_ttl"),
+                    lambda: registry.handlers[searcher_id](query, maxResults))))
 
         else:
             return {"errors": [{"message": "Searcher not enabled."}]}
     else:
         return {"errors": [{"message": "Unrecognised searcher"}]}
+
+
+@app.get("/cache/")
+def get_cache_stats():
+    """Hit and miss counts, and the size, of the response cache and shared cache."""
+    return cache_stats()
+
+
+@app.delete("/cache/")
+async def clear_cache(searcher_id: Optional[str] = None):
+    """Removes every cached result, or only those of `searcher_id`, including from the shared cache."""
+    await clear_caches(searcher_id)
+    return cache_stats()
+
+
+@app.get("/debug/loop/")
+async def get_loop_stats():
+    """Lag of the event loop, and the stacks of the code found blocking it (see watchdog in config.yml)."""
+    return loop_stats()
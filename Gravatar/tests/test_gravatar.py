@@ -0,0 +1,69 @@
+"""
+Tests of the Gravatar adaptor's searches, with Gravatar replaced by canned responses.
+
+The golden folder holds, for canned responses, the results that the hand-written code the mappings replaced returned
+for them. Values that were random (the keys) are replaced by placeholders.
+
+Run from the Gravatar folder with `python -m pytest tests`.
+"""
+import asyncio
+import json
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("libgravatar")
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+import gravatar  # noqa: E402
+from vcf import results_to_json  # noqa: E402
+
+GOLDEN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "golden")
+
+
+class FakeResponse:
+    def __init__(self, status_code: int, body=None):
+        self.status_code = status_code
+        self.body = body
+
+    def json(self):
+        return self.body
+
+
+class FakeGravatar:
+    def __init__(self, email: str):
+        self.email = email
+
+    def get_profile(self, data_format: str = "") -> str:
+        return f"https://en.gravatar.com/{self.email}.{data_format}"
+
+
+def normalised(first, second):
+    """`first`, with the values that are different in `second` (the same search again) replaced by placeholders."""
+    placeholders = {}
+
+    def normalise(a, b):
+        if isinstance(a, dict):
+            assert a.keys() == b.keys()
+            return {name: normalise(a[name], b[name]) for name in a}
+        if isinstance(a, list):
+            assert len(a) == len(b)
+            return [normalise(x, y) for x, y in zip(a, b)]
+        if a != b:
+            return placeholders.setdefault(a, f"<random {len(placeholders) + 1}>")
+        return a
+    return normalise(first, second)
+
+
+def test_golden_results(monkeypatch):
+    with open(os.path.join(GOLDEN_DIR, "gravatar.json")) as file:
+        golden = json.load(file)
+    monkeypatch.setattr(gravatar, "Gravatar", FakeGravatar)
+    monkeypatch.setattr(gravatar.requests, "get", lambda url, **kwargs: FakeResponse(200, golden["response"]))
+
+    def results():
+        return json.loads(results_to_json(asyncio.run(gravatar.get_gravatar(golden["query"], golden["max_results"]))))
+    assert normalised(results(), results()) == golden["expected"]
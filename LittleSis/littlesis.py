@@ -7,71 +7,51 @@ E.g.
 
     uvicorn main:app --host 192.168.2.25
 """
+import asyncio
 import uuid
 
 import requests
 
-from vcf import create_relationship
+from vcf import (Cases, EntityMapping, ErrorRecord, Related, RelationshipRecord, ResultMapping, ResultRecord,
+                 attribute, collect_results, deadline_error, deadline_exceeded, deadline_timeout, field, get_logger,
+                 rank_order, uuid_of)
 
 
 # ============================ Little Sis functions ============================
-def littlesis_build_entity(data):
-    # print(data["attributes"].keys())
-    ent_type = data["attributes"]["primary_ext"]  # Little Sis entity type
-    v_entity_type = "Entity" + ent_type.replace("Org", "Organisation")  # Videris entity type
-    attributes = {
-        "EntityPerson": {
-            "Dob": "start_date",
-            "DateOfDeath": "end_date"
-
-        },
-        "EntityOrganisation": {
-            "Name": "name",
-            "Description": "blurb"
-        }
-    }
-
-    extensions = {
-        "EntityPerson": {
-            "FirstName": "name_first",
-            "LastName": "name_last",
-            "OtherNames": "name_middle",
-            "Salutation": "name_prefix",
-            "Gender": "gender_id"
-        }
-        # ,
-        # "EntityOrganisation": {
-        #
-        # }
-    }
-
-    entity = {
-        "id": str(uuid.uuid3(uuid.NAMESPACE_DNS, str(data["id"]))),
-        "type": v_entity_type,
-        "attributes": dict()
-    }
-
-    for att, src in attributes[v_entity_type].items():
-        entity["attributes"][att] = data["attributes"][src]
+LITTLESIS_TIME_RESERVE = 5.0  # Seconds before the deadline at which optional lookups stop, to return results in time
+
+logger = get_logger("littlesis")
+
+
+# Little Sis entity types (primary_ext) and what they map to
+LITTLESIS_ENTITIES = ResultMapping(
+    Cases('attributes.primary_ext', {
+        'Person': EntityMapping('EntityPerson', uuid_of('id'), {
+            'Dob': 'attributes.start_date',
+            'DateOfDeath': 'attributes.end_date',
+            'FirstName': field('attributes.extensions.Person.name_first', strict=False),
+            'LastName': field('attributes.extensions.Person.name_last', strict=False),
+            'OtherNames': field('attributes.extensions.Person.name_middle', strict=False),
+            'Salutation': field('attributes.extensions.Person.name_prefix', strict=False),
+            'Gender': field('attributes.extensions.Person.gender_id', strict=False),
+        }, strict=True),
+        'Org': EntityMapping('EntityOrganisation', uuid_of('id'), {
+            'Name': 'attributes.name',
+            'Description': 'attributes.blurb',
+        }, strict=True),
+    }),
+    related=[
+        Related(None, EntityMapping('EntityWebPage', uuid_of(attribute('Url')), {
+            'Url': 'attributes.website',
+        }, strict=True), where='attributes.website'),
+    ],
+    strict=True,
+)
 
-    try:
-        for att, src in extensions[v_entity_type].items():
-            entity["attributes"][att] = data["attributes"]["extensions"][ent_type][src]
-    except KeyError:
-        pass
-
-    if data["attributes"]["website"]:
-        webpage = {
-            "id": str(uuid.uuid3(uuid.NAMESPACE_DNS, data["attributes"]["website"])),
-            "type": "EntityWebPage",
-            "attributes": {
-                "Url": data["attributes"]["website"]
-            }
-        }
-        relationship = create_relationship(entity["id"], webpage["id"])
-        return [entity, webpage, relationship]
-    else:
-        return [entity]
+
+def littlesis_build_entity(data):
+    """Maps a Little Sis entity to its Videris entity, and its web page if it has one."""
+    return LITTLESIS_ENTITIES.entities(data) or []
 
 
 def get_littlesis_endpoint(endpoint_name, entity_id=None, query=None, category_id=None, page=None):
@@ -103,8 +83,8 @@ def get_littlesis_endpoint(endpoint_name, entity_id=None, query=None, category_i
             endpoint += "?page=" + str(page)
             params_used = True
 
-    r = requests.get(endpoint)
-    print(endpoint + " : " + str(r.status_code))
+    r = requests.get(endpoint, timeout=deadline_timeout())
+    logger.debug("%s : %s", endpoint, r.status_code)
     if r.status_code != 200:
         raise Exception(endpoint + " - Bad API response: " + str(r.status_code))
     else:
@@ -113,7 +93,7 @@ def get_littlesis_endpoint(endpoint_name, entity_id=None, query=None, category_i
         return meta, data
 
 
-def get_littlesis_network(entity_id: int):
+async def get_littlesis_network(entity_id: int):
     """
     Queries Little Sis endpoints for connections and relationships to/from the specified entity id.
 
@@ -130,7 +110,7 @@ def get_littlesis_network(entity_id: int):
     # for category_id in categories:
     page = 1
     try:
-        meta, data = get_littlesis_endpoint("connections", entity_id=entity_id, page=page)
+        meta, data = await asyncio.to_thread(get_littlesis_endpoint, "connections", entity_id=entity_id, page=page)
         connections_data += data
 
         # while data and page <= 3:
@@ -138,7 +118,7 @@ def get_littlesis_network(entity_id: int):
         #     meta, data = get_littlesis_endpoint("connections", entity_id, page=page)
         #     connections_data += data
     except Exception as e:
-        print(e)
+        logger.warning("Unable to fetch the connections of %s: %s", entity_id, e)
 
     if not connections_data:
         return []
@@ -150,13 +130,15 @@ def get_littlesis_network(entity_id: int):
     relationships_data = []
     # for category_id in categories:
     try:
-        meta, data = get_littlesis_endpoint("relationships", entity_id=entity_id)
+        meta, data = await asyncio.to_thread(get_littlesis_endpoint, "relationships", entity_id=entity_id)
         relationships_data += data
-        while meta["currentPage"] < meta["pageCount"] and meta["currentPage"] < 3:
-            meta, data = get_littlesis_endpoint("relationships", entity_id=entity_id, page=meta["currentPage"] + 1)
+        while meta["currentPage"] < meta["pageCount"] and meta["currentPage"] < 3 and \
+                not deadline_exceeded(LITTLESIS_TIME_RESERVE):
+            meta, data = await asyncio.to_thread(get_littlesis_endpoint, "relationships", entity_id=entity_id,
+                                                 page=meta["currentPage"] + 1)
             relationships_data += data
     except Exception as e:
-        print(e)
+        logger.warning("Unable to fetch the relationships of %s: %s", entity_id, e)
 
     source_entity_id = str(uuid.uuid3(uuid.NAMESPACE_DNS, str(entity_id)))
 
@@ -164,8 +146,8 @@ def get_littlesis_network(entity_id: int):
     entity_ids = []
     for item in entities:
         # We don't want to create relationships to relationships so exclude those.
-        if item["type"] != "RelationshipRelationship":
-            entity_ids.append(item["id"])
+        if item.type != "RelationshipRelationship":
+            entity_ids.append(item.id)
 
     for relationship in relationships_data:
 
@@ -175,7 +157,7 @@ def get_littlesis_network(entity_id: int):
                 to_entity_id == source_entity_id and from_entity_id in entity_ids):
 
             description = relationship["attributes"]["description1"]
-            entities.append(create_relationship(from_entity_id, to_entity_id, description))
+            entities.append(RelationshipRecord(from_entity_id, to_entity_id, description))
 
             if from_entity_id == source_entity_id:
                 entity_ids.remove(to_entity_id)
@@ -185,54 +167,78 @@ def get_littlesis_network(entity_id: int):
     # All entities now have detailed relationship info where available
     # Need to remove webpage entities which have already been linked to their associates entities
     for e in entities:
-        if e["type"] not in ["EntityPerson", "EntityOrganisation"] and e["id"] in entity_ids:
-            entity_ids.remove(e["id"])
+        if e.type not in ["EntityPerson", "EntityOrganisation"] and e.id in entity_ids:
+            entity_ids.remove(e.id)
 
     # Build relationships to the source entity for all that is left
     for remaining_entity_id in entity_ids:
-        entities.append(create_relationship(source_entity_id, remaining_entity_id))
+        entities.append(RelationshipRecord(source_entity_id, remaining_entity_id))
 
     return entities
 
 
-async def get_littlesis(query: str, max_results: int):
-    """Searches Little Sis API. Auto-enriches top 10 results to fetch connections of the found entity."""
+async def get_littlesis(query: str, max_results: int, rank: bool = False):
+    """
+    Searches Little Sis API. Auto-enriches top 10 results to fetch connections of the found entity. With `rank`, the
+    results are first sorted by how closely their names match the query, and only the best `max_results` are kept.
+    """
+    return await collect_results(stream_littlesis(query, max_results, rank))
+
+
+async def stream_littlesis(query: str, max_results: int, rank: bool = False):
+    """As get_littlesis(), but yields each result (and an ErrorRecord for each error) as soon as it is ready."""
     max_results = int(max_results)
-    output = dict()
-    output["errors"] = []
+    out_of_time = False
     try:
-        meta, data = get_littlesis_endpoint("search", query=query)
+        meta, data = await asyncio.to_thread(get_littlesis_endpoint, "search", query=query)
     except Exception as e:
-        return {"errors": [{"message": str(e)}]}
+        yield ErrorRecord(str(e))
+        return
 
     while meta["currentPage"] < meta["pageCount"] and len(data) < max_results:
+        if deadline_exceeded(LITTLESIS_TIME_RESERVE):
+            out_of_time = True
+            yield ErrorRecord(deadline_error()["message"])
+            break
         try:
-            meta, search_data = get_littlesis_endpoint("search", query=query, page=meta["currentPage"] + 1)
+            meta, search_data = await asyncio.to_thread(get_littlesis_endpoint, "search", query=query,
+                                                        page=meta["currentPage"] + 1)
             data += search_data
         except Exception:
-            output["errors"].append({"message": "Unable to fetch some results from Little Sis. Please try again."})
+            yield ErrorRecord("Unable to fetch some results from Little Sis. Please try again.")
+            break
+
+    if rank:
+        # Pages are fetched whole, so there may be more than max_results
+        data = [data[i] for i in rank_order([query], [entry["attributes"]["name"] for entry in data],
+                                            [entry["attributes"]["blurb"] for entry in data], max_results)]
 
-    search_results = []
     for i, entry in enumerate(data):
         # entity_uuid = str(uuid.uuid3(uuid.NAMESPACE_DNS, str(entry["id"])))
 
-        result = {
-            "key": str(uuid.uuid3(uuid.NAMESPACE_DNS, query + str(i))),
-            "title": entry["attributes"]["name"],
-            "subTitle": entry["attributes"]["blurb"],
-            "summary": entry["attributes"]["summary"],
-            "source": "Little Sis",
-            "entities": [],
-            "url": entry["links"]["self"]
-        }
+        result = ResultRecord(
+            key=str(uuid.uuid3(uuid.NAMESPACE_DNS, query + str(i))),
+            title=entry["attributes"]["name"],
+            subTitle=entry["attributes"]["blurb"],
+            summary=entry["attributes"]["summary"],
+            source="Little Sis",
+            entities=[],
+            url=entry["links"]["self"]
+        )
 
         # Add the entity/entities from the search results
-        result["entities"] += littlesis_build_entity(entry)
+        result.entities += littlesis_build_entity(entry)
 
         # For the top 10 results
         if i < 10:
-            # Query their network and return related entities
-            result["entities"] += get_littlesis_network(entry["id"])
+            if deadline_exceeded(LITTLESIS_TIME_RESERVE):
+                # Out of time, so return the remaining results without their networks
+                if not out_of_time:
+                    out_of_time = True
+                    yield ErrorRecord(deadline_error()["message"])
+            else:
+                # Query their network and return related entities
+                result.entities += await get_littlesis_network(entry["id"])
 
         # for entity in result["entities"].copy():
         #     if str(entity["id"]) != entity_uuid and entity["type"] not in ["EntityWebPage",
@@ -241,8 +247,4 @@ async def get_littlesis(query: str, max_results: int):
         #         relationship: dict = create_relationship(entity_uuid, str(entity["id"]))
         #         result["entities"].append(relationship)
 
-        search_results.append(result)
-
-    output["searchResults"] = search_results
-    # print(json.dumps(output))
-    return output
+        yield result
@@ -0,0 +1,38 @@
+"""
+Tests of the Little Sis adaptor's searches, with the Little Sis API replaced by canned responses.
+
+The golden folder holds, for canned responses, the results that the hand-written code the mappings replaced returned
+for them.
+
+Run from the LittleSis folder with `python -m pytest tests`.
+"""
+import asyncio
+import json
+import os
+import sys
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+import littlesis  # noqa: E402
+from vcf import results_to_json  # noqa: E402
+
+GOLDEN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "golden")
+
+
+def fake_api(monkeypatch, responses: dict):
+    """Replaces the Little Sis API by the responses, by "<entity id>/<endpoint>?page=<page>"."""
+    def get_littlesis_endpoint(endpoint_name, entity_id=None, query=None, category_id=None, page=None):
+        endpoint = f"{entity_id or ''}/{endpoint_name}?page={page or 1}"
+        if endpoint not in responses:
+            raise Exception(endpoint + " - Bad API response: 404")
+        return responses[endpoint]["meta"], responses[endpoint]["data"]
+    monkeypatch.setattr(littlesis, "get_littlesis_endpoint", get_littlesis_endpoint)
+
+
+def test_golden_results(monkeypatch):
+    with open(os.path.join(GOLDEN_DIR, "littlesis.json")) as file:
+        golden = json.load(file)
+    fake_api(monkeypatch, golden["responses"])
+    results = asyncio.run(littlesis.get_littlesis(golden["query"], golden["max_results"], rank=True))
+    assert json.loads(results_to_json(results)) == golden["expected"]
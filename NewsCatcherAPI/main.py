@@ -7,37 +7,57 @@ E.g.
 
 """
 
-import yaml
-from fastapi import FastAPI, status
+import requests
+from fastapi import FastAPI, Header, status
 from vcf import *
-from newscatcher import *
 from auth import *
 
 api_key = api_key
 
 app = FastAPI()
+# Compresses responses as set in config.yml's compression section
+app.add_middleware(CompressionMiddleware)
+
+
+@app.on_event("startup")
+async def startup():
+    # config.yml is only read here, and again whenever it changes, rather than on every request. The only searcher is
+    # handled by get_news(), so there are no handlers to resolve.
+    app.state.config_watcher = start_registry(lambda searcher: None)
+    # Records the stack of any code blocking the event loop for longer than watchdog.threshold_ms
+    app.state.loop_watchdog = start_watchdog()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    app.state.config_watcher.cancel()
+    app.state.loop_watchdog.stop()
+
 
 @app.get("/searchers/", response_model=List[Searcher], response_model_exclude_none=True)
 def get_searchers():
-    with open('config.yml', 'r') as file:
-        CONFIG = yaml.safe_load(file)
-    searchers = []
-    for searcher in CONFIG["searchers"].values():
-        if searcher["enabled"]:
-            searcher.pop("enabled", None)
-            searcher.pop("redirect", None)
-            searchers.append(searcher)
-    return searchers
+    return get_registry().searchers
 
 @app.get("/searchers/newscatcher/results", response_model=SearchResults, response_model_exclude_none=True,
          status_code=status.HTTP_200_OK)
-def get_news(query: str, maxResults = 10):
+def get_news(query: str, maxResults = 10, x_vcf_time_limit: Optional[float] = Header(None),
+             cache_control: Optional[str] = Header(None)):
+    set_deadline(x_vcf_time_limit)
+    set_cache_bypass(cache_control)
+    # Messages logged during the search are filtered (and sampled) by its searcher's logging settings
+    set_log_searcher("newscatcher")
+    ttl = get_registry().config["searchers"]["newscatcher"].get("cache_ttl")
+    key = search_key("newscatcher", query, maxResults)
+    if ttl and not cache_bypassed():
+        cached = response_cache.get(key)
+        if cached is not None:
+            return results_response(cached)
     url = "https://api.newscatcherapi.com/v2/search"
     headers = {
     "x-api-key": api_key
     }
     querystring = {"q":query,"lang":"en","sort_by":"relevancy","page":"1","page_size":maxResults}
-    response = requests.request("GET", url, headers=headers, params=querystring)
+    response = requests.request("GET", url, headers=headers, params=querystring, timeout=deadline_timeout())
     blob = response.json()
     if blob['status'] == "ok":
         search_results = []
@@ -60,8 +80,29 @@ def get_news(query: str, maxResults = 10):
                 'url': x['link']
             }
             search_results.append(result)
-        return {'searchResults': search_results}
+        if ttl:
+            response_cache.put(key, {'searchResults': search_results}, ttl)
+        return results_response({'searchResults': search_results})
     else:
         return {"errors":[{
             "message": blob["message"]
             }]}
+
+
+@app.get("/cache/")
+def get_cache_stats():
+    """Hit and miss counts, and the size, of the response cache."""
+    return response_cache.stats()
+
+
+@app.delete("/cache/")
+def clear_cache(searcher_id: Optional[str] = None):
+    """Removes every cached result, or only those of `searcher_id`."""
+    response_cache.clear(searcher_id)
+    return response_cache.stats()
+
+
+@app.get("/debug/loop/")
+async def get_loop_stats():
+    """Lag of the event loop, and the stacks of the code found blocking it (see watchdog in config.yml)."""
+    return loop_stats()
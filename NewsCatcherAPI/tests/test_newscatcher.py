@@ -0,0 +1,78 @@
+"""
+Smoke tests of the NewsCatcher adaptor's endpoints, with the NewsCatcher API replaced by canned responses.
+
+Run from the NewsCatcherAPI folder with `python -m pytest tests`.
+"""
+import os
+import sys
+
+import pytest
+from fastapi.testclient import TestClient
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+import main  # noqa: E402
+
+ARTICLE = {
+    "title": "Acme Ltd opens new office",
+    "clean_url": "example.com",
+    "topic": "business",
+    "author": "A. Writer",
+    "published_date": "2023-01-31 09:00:00",
+    "summary": "Acme Ltd has opened a new office.",
+    "link": "https://example.com/acme",
+}
+
+
+class FakeResponse:
+    def __init__(self, body: dict):
+        self.body = body
+
+    def json(self):
+        return self.body
+
+
+@pytest.fixture
+def client(monkeypatch):
+    # config.yml is read from the current folder
+    monkeypatch.chdir(APP_DIR)
+    with TestClient(main.app) as client:
+        yield client
+
+
+def fake_api(monkeypatch, body: dict):
+    requests = []
+
+    def request(method, url, **kwargs):
+        requests.append(kwargs["params"])
+        return FakeResponse(body)
+
+    monkeypatch.setattr(main.requests, "request", request)
+    return requests
+
+
+def test_searchers(client):
+    response = client.get("/searchers/")
+    assert response.status_code == 200
+    assert [searcher["id"] for searcher in response.json()] == ["newscatcher"]
+
+
+def test_results(client, monkeypatch):
+    requests = fake_api(monkeypatch, {"status": "ok", "articles": [ARTICLE]})
+    response = client.get("/searchers/newscatcher/results", params={"query": "acme", "maxResults": 5},
+                          headers={"Cache-Control": "no-cache"})
+    assert response.status_code == 200
+    assert requests[0]["q"] == "acme"
+    results = response.json()["searchResults"]
+    assert len(results) == 1
+    assert results[0]["title"] == ARTICLE["title"]
+    assert results[0]["entities"][0]["attributes"]["Url"] == ARTICLE["link"]
+
+
+def test_api_error(client, monkeypatch):
+    fake_api(monkeypatch, {"status": "error", "message": "Invalid API key"})
+    response = client.get("/searchers/newscatcher/results", params={"query": "acme"},
+                          headers={"Cache-Control": "no-cache"})
+    assert response.status_code == 200
+    assert response.json() == {"errors": [{"message": "Invalid API key"}]}
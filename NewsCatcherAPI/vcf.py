@@ -1,3 +1,5 @@
+import os
+import sys
 import uuid
 from typing import List, Optional
 
@@ -131,4 +133,16 @@ def email_to_entity(email: str):
         }
     }
 
-    return entity
\ No newline at end of file
+    return entity
+
+
+# ============================ Shared module ============================
+# Everything else the router and the adaptors share (caching, logging, the searcher registry and so on) is in
+# VCF_Shared/vcf_shared.py, in the folder next to this app's folder
+VCF_SHARED_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "VCF_Shared")
+if VCF_SHARED_PATH not in sys.path:
+    sys.path.append(VCF_SHARED_PATH)
+
+from vcf_shared import *  # noqa: E402,F403
+
+use_models(Searcher, Attribute, Result, SearchResults)
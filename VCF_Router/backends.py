@@ -0,0 +1,467 @@
+"""
+Connection handling for the adaptors the router redirects searches to.
+
+Each backend (scheme, host and port of a redirect URL) gets its own long-lived httpx client, so that redirected
+searches reuse keep-alive connections and never block the event loop while waiting on a slow adaptor.
+
+A searcher's `redirect` can list several replicas of the same adaptor. Replicas are health-checked in the background
+and each search is sent to the healthy replica with the fewest searches in flight (or the lowest average latency).
+
+Every replica also has a circuit breaker, which stops searches being sent to a replica that keeps failing until a
+probe search shows it has recovered.
+
+Replicas and clients are kept for the current generation of config.yml: when it is reloaded, sync_backends() carries
+over those still in use and lets go of the rest, closing their clients once their last search has finished.
+
+Searchers with a `hedge` section send a duplicate of a slow search to a second replica, and use whichever answers first.
+
+Adaptors running on the same host as the router can be reached over a Unix domain socket instead of TCP, by giving a
+`unix://` URL such as unix:///run/vcf/littlesis.sock (optionally followed by the path of the adaptor's results endpoint).
+"""
+import asyncio
+import time
+from collections import deque
+from typing import List, Mapping, Optional, Tuple
+from urllib.parse import urlsplit
+
+import httpx
+
+from vcf import DEADLINE_HEADER, deadline_timeout, get_logger, time_remaining
+
+# Defaults for the `http` section of config.yml. Each searcher can override any of these with its own `http` section.
+HTTP_DEFAULTS = {
+    "max_connections": 20,  # Maximum number of open connections to a single backend
+    "max_keepalive_connections": 10,  # Idle connections kept open for reuse
+    "keepalive_expiry": 30.0,  # Seconds before an idle connection is closed
+    "connect_timeout": 5.0,
+    "read_timeout": 60.0,
+    "write_timeout": 60.0,  # Seconds allowed for sending each part of a request
+    "pool_timeout": 10.0,  # Seconds to wait for a free connection when the pool is exhausted
+}
+
+# Defaults for the `health_check` section of config.yml
+HEALTH_CHECK_DEFAULTS = {
+    "interval": 10.0,  # Seconds between health checks of each replica
+    "timeout": 2.0,
+}
+
+# Defaults for the `circuit_breaker` section of config.yml. Each searcher can override these with its own section.
+CIRCUIT_BREAKER_DEFAULTS = {
+    "failures": 5,  # Consecutive failures or timeouts that trip the breaker
+    "reset_timeout": 30.0,  # Seconds the breaker stays open before letting a probe search through
+    "half_open_probes": 1,  # Probe searches allowed through at once while testing for recovery
+}
+
+# Defaults for a searcher's `hedge` section
+HEDGE_DEFAULTS = {
+    "percentile": 95,  # Hedge once a search has taken longer than this percentile of the replica's recent latencies
+    "budget": 0.05,  # Maximum number of hedged searches, as a fraction of all searches
+}
+HEDGE_BURST = 10  # Hedges that can be saved up by a quiet searcher and spent at once
+LATENCY_SAMPLES = 200  # Recent latencies kept per replica to calculate percentiles
+MIN_LATENCY_SAMPLES = 20  # Replicas with fewer samples than this are not hedged
+
+# Seconds of a search's time limit kept back by the router when passing the limit on to an adaptor, to leave time for
+# the adaptor's response to reach the router and be returned to Videris.
+DEADLINE_MARGIN = 1.0
+
+# Weight of the latest call in a replica's average latency. Higher values react faster to changes in latency.
+EWMA_ALPHA = 0.3
+
+# Suffix ending the socket path of a unix:// redirect. Anything after it is the HTTP path of the results endpoint.
+SOCKET_SUFFIX = ".sock"
+
+# Seconds between checks of whether the searches sent to a backend that is no longer used have finished
+STALE_CLIENT_CHECK_INTERVAL = 1.0
+
+logger = get_logger("backends")
+
+_clients = {}
+_replicas = {}
+_hedge_budgets = {}
+
+
+def http_settings(config: dict, searcher: dict) -> dict:
+    """
+    Merges the pool and timeout settings for a searcher: defaults < top-level `http` section < searcher `http` section.
+
+    :param config: Parsed config.yml
+    :type config: dict
+    :param searcher: Searcher section of config.yml
+    :type searcher: dict
+    :return: Connection settings for the searcher's backend
+    :rtype: dict
+    """
+    return {**HTTP_DEFAULTS, **(config.get("http") or {}), **(searcher.get("http") or {})}
+
+
+def split_unix_url(url: str) -> Tuple[str, str]:
+    """
+    Splits a unix:// URL into the path of the socket and the HTTP path requested over it.
+
+    :param url: E.g. unix:///run/vcf/littlesis.sock/searchers/littlesis/results
+    :type url: str
+    :return: E.g. ("/run/vcf/littlesis.sock", "/searchers/littlesis/results")
+    :rtype: tuple
+    """
+    address = url[len("unix://"):]
+    socket_end = address.find(SOCKET_SUFFIX)
+    if socket_end == -1:
+        return address, ""
+    socket_end += len(SOCKET_SUFFIX)
+    return address[:socket_end], address[socket_end:]
+
+
+def request_url(url: str) -> str:
+    """Returns the URL to request for a redirect. unix:// URLs are requested as http://localhost over their socket."""
+    if url.startswith("unix://"):
+        return "http://localhost" + split_unix_url(url)[1]
+    return url
+
+
+def backend_key(url: str) -> str:
+    """
+    Returns the scheme, host and port of a URL (or the socket of a unix:// URL), which identifies the backend (and
+    connection pool) serving it.
+    """
+    if url.startswith("unix://"):
+        return "unix://" + split_unix_url(url)[0]
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def get_client(url: str, settings: dict) -> httpx.AsyncClient:
+    """
+    Returns the pooled client for the backend serving `url`, creating it on first use.
+
+    The pool limits of a backend are fixed when its client is created. Timeouts are applied per request, so changes to
+    those in config.yml take effect immediately.
+
+    :param url: Redirect URL, including unix:// URLs
+    :type url: str
+    :param settings: Connection settings, see http_settings()
+    :type settings: dict
+    :return: Client for the backend
+    :rtype: httpx.AsyncClient
+    """
+    key = backend_key(url)
+    client = _clients.get(key)
+    if client is None or client.is_closed:
+        limits = httpx.Limits(
+            max_connections=settings["max_connections"],
+            max_keepalive_connections=settings["max_keepalive_connections"],
+            keepalive_expiry=settings["keepalive_expiry"],
+        )
+        if url.startswith("unix://"):
+            transport = httpx.AsyncHTTPTransport(uds=split_unix_url(url)[0], limits=limits)
+            client = httpx.AsyncClient(transport=transport)
+        else:
+            client = httpx.AsyncClient(limits=limits)
+        _clients[key] = client
+    return client
+
+
+def get_timeout(settings: dict) -> httpx.Timeout:
+    """Builds the httpx timeout for a request from the connection settings, shortened to the search's deadline."""
+    return httpx.Timeout(
+        connect=deadline_timeout(settings["connect_timeout"]),
+        read=deadline_timeout(settings["read_timeout"]),
+        write=deadline_timeout(settings["write_timeout"]),
+        pool=deadline_timeout(settings["pool_timeout"]),
+    )
+
+
+def deadline_headers() -> dict:
+    """Request headers passing the current search's remaining time on to an adaptor."""
+    remaining = time_remaining()
+    if remaining is None:
+        return {}
+    return {DEADLINE_HEADER: f"{max(remaining - DEADLINE_MARGIN, 0.0):.3f}"}
+
+
+async def close_clients():
+    """Closes every backend client. Called when the router shuts down."""
+    for client in _clients.values():
+        await client.aclose()
+    _clients.clear()
+
+
+# ============================ Circuit breaker ============================
+class CircuitBreaker:
+    """
+    Tracks consecutive failures of a backend. Once `failures` is reached the breaker opens and requests are refused
+    without being sent. After `reset_timeout` seconds it becomes half-open and lets up to `half_open_probes` requests
+    through: a success closes the breaker again, a failure re-opens it.
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self):
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probes = 0
+        self.settings = CIRCUIT_BREAKER_DEFAULTS
+
+    def allow_request(self) -> bool:
+        """Returns whether a request may be sent. A True result in the half-open state uses up a probe."""
+        if self.state == self.OPEN:
+            if time.monotonic() - self.opened_at < self.settings["reset_timeout"]:
+                return False
+            self.state = self.HALF_OPEN
+            self.probes = 0
+
+        if self.state == self.HALF_OPEN:
+            if self.probes >= self.settings["half_open_probes"]:
+                return False
+            self.probes += 1
+
+        return True
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self.failures = 0
+
+    def record_abandoned(self):
+        """Called when a request is cancelled before completing, so that it tells us nothing about the backend."""
+        if self.state == self.HALF_OPEN and self.probes:
+            self.probes -= 1
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.settings["failures"]:
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+
+def breaker_settings(config: dict, searcher: dict) -> dict:
+    """Merges the circuit breaker settings for a searcher, in the same way as http_settings()."""
+    return {**CIRCUIT_BREAKER_DEFAULTS, **(config.get("circuit_breaker") or {}),
+            **(searcher.get("circuit_breaker") or {})}
+
+
+# ============================ Replicas ============================
+class Replica:
+    """A single instance of an adaptor, along with the load and health information used to route searches to it."""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.request_url = request_url(url)
+        self.healthy = True
+        self.in_flight = 0
+        self.ewma_latency = 0.0  # Seconds, weighted towards recent calls
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+        self.breaker = CircuitBreaker()
+
+    def start(self) -> float:
+        """Marks a search as sent to this replica. Returns the start time to pass to finish()."""
+        self.in_flight += 1
+        return time.monotonic()
+
+    def finish(self, started: float, success: Optional[bool]):
+        """
+        Marks a search sent to this replica as complete, updating the replica's average latency and circuit breaker.
+
+        :param started: Value returned by start()
+        :type started: float
+        :param success: False if the search failed, timed out or got a server error from the replica, None if it was
+            cancelled before completing
+        :type success: bool
+        """
+        self.in_flight -= 1
+        if success is None:
+            self.breaker.record_abandoned()
+            return
+        if not success:
+            self.breaker.record_failure()
+            return
+        self.breaker.record_success()
+
+        latency = time.monotonic() - started
+        self.latencies.append(latency)
+        if self.ewma_latency:
+            self.ewma_latency = EWMA_ALPHA * latency + (1 - EWMA_ALPHA) * self.ewma_latency
+        else:
+            self.ewma_latency = latency
+
+    def latency_percentile(self, percentile: float) -> Optional[float]:
+        """Returns the given percentile of the replica's recent latencies, or None if there are too few of them."""
+        if len(self.latencies) < MIN_LATENCY_SAMPLES:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * percentile / 100))]
+
+    @property
+    def health_url(self) -> str:
+        """The adaptor's /searchers/ endpoint, which every adaptor serves, is used to check it is up."""
+        base, separator, _ = self.request_url.rpartition("/searchers/")
+        return base + "/searchers/" if separator else self.request_url
+
+
+def replica_urls(searcher: dict) -> List[str]:
+    """
+    Returns the replica URLs of a searcher, whose `redirect` can either be a single URL or a list of them. unix:// URLs
+    without an HTTP path are given the path of the searcher's results endpoint.
+    """
+    redirect = searcher["redirect"]
+    urls = [redirect] if isinstance(redirect, str) else list(redirect)
+    return [url + f"/searchers/{searcher['id']}/results"
+            if url.startswith("unix://") and not split_unix_url(url)[1] else url
+            for url in urls]
+
+
+def get_replica(url: str) -> Replica:
+    """Returns the Replica tracking `url`, creating it (with the default circuit breaker settings) on first use."""
+    replica = _replicas.get(url)
+    if replica is None:
+        replica = _replicas[url] = Replica(url)
+    return replica
+
+
+def choose_replica(searcher: dict, exclude: Replica = None) -> Optional[Replica]:
+    """
+    Picks the replica to send a search to. Only healthy replicas are considered, unless none of them are healthy, in
+    which case all of them are. By default the replica with the fewest searches in flight is chosen (ties going to the
+    fastest), or with `balance: latency` the replica with the lowest average latency. Replicas whose circuit breaker
+    refuses the search are skipped.
+
+    :param searcher: Searcher section of config.yml
+    :type searcher: dict
+    :param exclude: Replica not to choose, e.g. the one already running a search that is being hedged OPTIONAL
+    :type exclude: Replica
+    :return: Replica to use, or None if every replica's circuit breaker is open
+    :rtype: Replica
+    """
+    replicas = [replica for replica in map(get_replica, replica_urls(searcher)) if replica is not exclude]
+    candidates = [replica for replica in replicas if replica.healthy] or replicas
+
+    if searcher.get("balance") == "latency":
+        candidates.sort(key=lambda replica: (replica.ewma_latency, replica.in_flight))
+    else:
+        candidates.sort(key=lambda replica: (replica.in_flight, replica.ewma_latency))
+
+    for replica in candidates:
+        if replica.breaker.allow_request():
+            return replica
+    return None
+
+
+def sync_backends(config: Mapping):
+    """
+    Makes the replicas, clients and hedge budgets match a newly loaded config.yml. Replicas of enabled redirect
+    searchers are kept (with their health, latencies and circuit breaker) if they were already in use, and given the
+    searcher's current circuit breaker settings. Replicas no longer listed are dropped, and the clients of backends no
+    longer used are closed once the searches already sent to them have finished. Called whenever config.yml is loaded.
+
+    :param config: Parsed config.yml
+    :type config: Mapping
+    """
+    replicas = {}
+    searcher_ids = set()
+    for searcher in config["searchers"].values():
+        if searcher.get("enabled") and "redirect" in searcher:
+            searcher_ids.add(searcher["id"])
+            settings = breaker_settings(config, searcher)
+            for url in replica_urls(searcher):
+                replica = replicas[url] = _replicas.get(url) or Replica(url)
+                replica.breaker.settings = settings
+    stale = [replica for url, replica in _replicas.items() if url not in replicas]
+    _replicas.clear()
+    _replicas.update(replicas)
+
+    backends = {backend_key(url) for url in replicas}
+    for key in [key for key in _clients if key not in backends]:
+        client = _clients.pop(key)
+        searches = [replica for replica in stale if backend_key(replica.url) == key]
+        try:
+            asyncio.get_running_loop().create_task(close_when_idle(client, searches))
+        except RuntimeError:
+            pass  # No event loop, so no searches or connections to wait for
+    for searcher_id in [searcher_id for searcher_id in _hedge_budgets if searcher_id not in searcher_ids]:
+        del _hedge_budgets[searcher_id]
+
+
+async def close_when_idle(client: httpx.AsyncClient, replicas: List[Replica]):
+    """Closes the client of a backend that is no longer used, once none of its replicas have searches in flight."""
+    while any(replica.in_flight for replica in replicas):
+        await asyncio.sleep(STALE_CLIENT_CHECK_INTERVAL)
+    await client.aclose()
+
+
+# ============================ Hedging ============================
+class HedgeBudget:
+    """
+    Limits hedged searches to a fraction of all searches. Every search adds `budget` to the balance (up to
+    HEDGE_BURST) and every hedge spends 1, so with a budget of 0.05 there is at most one hedge per 20 searches.
+    """
+
+    def __init__(self):
+        self.balance = 0.0
+
+    def deposit(self, budget: float):
+        self.balance = min(self.balance + budget, HEDGE_BURST)
+
+    def withdraw(self) -> bool:
+        if self.balance < 1:
+            return False
+        self.balance -= 1
+        return True
+
+
+def hedge_settings(searcher: dict) -> dict:
+    """Returns the hedging settings of a searcher, or an empty dict if it does not hedge."""
+    if not searcher.get("hedge"):
+        return {}
+    return {**HEDGE_DEFAULTS, **(searcher["hedge"] if isinstance(searcher["hedge"], Mapping) else {})}
+
+
+def get_hedge_budget(searcher_id: str) -> HedgeBudget:
+    """Returns the hedge budget of a searcher, creating it on first use."""
+    budget = _hedge_budgets.get(searcher_id)
+    if budget is None:
+        budget = _hedge_budgets[searcher_id] = HedgeBudget()
+    return budget
+
+
+async def check_replica(replica: Replica, settings: dict, timeout: float):
+    """
+    Requests a replica's health URL and marks the replica healthy if it responds successfully. Anything else, including
+    an unexpected error while checking it, marks it unhealthy.
+    """
+    try:
+        response = await get_client(replica.url, settings).get(replica.health_url, timeout=timeout)
+        replica.healthy = response.is_success
+    except httpx.HTTPError:
+        replica.healthy = False
+    except Exception:
+        logger.exception("Health check of %s failed", replica.url)
+        replica.healthy = False
+
+
+async def check_replicas(load_config):
+    """
+    Health-checks the replicas of every enabled redirect searcher, forever. Runs as a background task of the router.
+
+    :param load_config: Function returning the current parsed config.yml, re-read on every round of checks so that
+        added or removed replicas are picked up.
+    :type load_config: Callable[[], dict]
+    """
+    health_settings = HEALTH_CHECK_DEFAULTS
+    while True:
+        try:
+            config = load_config()
+            health_settings = {**HEALTH_CHECK_DEFAULTS, **(config.get("health_check") or {})}
+
+            checks = []
+            for searcher in config["searchers"].values():
+                if searcher.get("enabled") and "redirect" in searcher:
+                    settings = http_settings(config, searcher)
+                    for url in replica_urls(searcher):
+                        checks.append(check_replica(get_replica(url), settings, health_settings["timeout"]))
+            await asyncio.gather(*checks)
+        except Exception:
+            # e.g. an invalid config.yml: the replicas keep their last known health until the next round
+            logger.exception("Health checks failed")
+
+        await asyncio.sleep(health_settings["interval"])
@@ -0,0 +1,85 @@
+"""
+Measures how long ranking merged search results takes, with rank_results() scoring every result in one batch and
+with a loop scoring the results one at a time, for comparison.
+
+Needs rapidfuzz and numpy. From the VCF_Router folder, run:
+
+    python benchmarks/ranking.py [--results 100 1000 5000] [--repeat 50]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rapidfuzz import fuzz, utils  # noqa: E402
+
+from vcf import RANK_SUBTITLE_WEIGHT, rank_results  # noqa: E402
+
+FIRST_NAMES = ["Jon", "John", "Jane", "Maria", "Ahmed", "Li", "Olga", "Pierre", "Ana", "Kwame", "Sofia", "Ivan"]
+LAST_NAMES = ["Doe", "Smith", "Garcia", "Khan", "Wang", "Petrova", "Dubois", "Silva", "Mensah", "Rossi", "Novak"]
+COMPANY_WORDS = ["Acme", "Global", "Holdings", "Trading", "Capital", "Widgets", "Logistics", "Partners", "Group"]
+SUFFIXES = ["Ltd", "LLC", "S.p.A.", "GmbH", "Inc", "SA"]
+
+
+# ============================ Stand-in results ============================
+def make_results(count: int, seed: int = 1) -> dict:
+    """Results as merged from several sources: a mix of people and companies, in no particular order."""
+    rng = random.Random(seed)
+    search_results = []
+    for i in range(count):
+        if rng.random() < 0.5:
+            title = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+            sub_title = f"Director of {rng.choice(COMPANY_WORDS)} {rng.choice(SUFFIXES)}"
+        else:
+            title = f"{rng.choice(COMPANY_WORDS)} {rng.choice(COMPANY_WORDS)} {rng.choice(SUFFIXES)}"
+            sub_title = f"Registered in {rng.choice(['Italy', 'United Kingdom', 'Ghana', 'France'])}"
+        search_results.append({"key": str(i), "title": title, "subTitle": sub_title, "source": "Benchmark"})
+    return {"searchResults": search_results}
+
+
+# ============================ Benchmark ============================
+def rank_one_at_a_time(results: dict, queries: list, max_results: int) -> dict:
+    """The straightforward approach: score each result in a Python loop, then sort."""
+    def score(result):
+        title = max(fuzz.token_sort_ratio(query, result.get("title") or "", processor=utils.default_process)
+                    for query in queries)
+        sub_title = max(fuzz.token_sort_ratio(query, result.get("subTitle") or "", processor=utils.default_process)
+                        for query in queries)
+        return max(title, sub_title * RANK_SUBTITLE_WEIGHT)
+
+    results["searchResults"] = sorted(results["searchResults"], key=score, reverse=True)[:max_results]
+    return results
+
+
+def time_ms(rank, count: int, queries: list, max_results: int, repeat: int) -> list:
+    rank(make_results(count), queries, max_results)  # Warm up (e.g. rapidfuzz's first import)
+    timings = []
+    for i in range(repeat):
+        results = make_results(count, seed=i)
+        started = time.perf_counter()
+        rank(results, queries, max_results)
+        timings.append((time.perf_counter() - started) * 1000)
+    return sorted(timings)
+
+
+def main(args):
+    queries = args.query
+    print(f"Query {' OR '.join(queries)!r}, keeping the best {args.max_results}, {args.repeat} runs each")
+    for count in args.results:
+        for name, rank in [("batched", rank_results), ("one at a time", rank_one_at_a_time)]:
+            timings = time_ms(rank, count, queries, args.max_results, args.repeat)
+            print(f"{count:>6} results, {name:>13}: mean {statistics.mean(timings):8.3f} ms  "
+                  f"p50 {timings[len(timings) // 2]:8.3f} ms  max {timings[-1]:8.3f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--results", type=int, nargs="+", default=[100, 1000, 5000], help="Results to rank")
+    parser.add_argument("--query", nargs="+", default=["jon doe"], help="Query, or each term of an OR query")
+    parser.add_argument("--max-results", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=50)
+    main(parser.parse_args())
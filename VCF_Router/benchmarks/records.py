@@ -0,0 +1,135 @@
+"""
+Measures the memory taken by large search results built as dicts and as records (EntityRecord, RelationshipRecord and
+ResultRecord), and how long encode_results() takes to convert each of them to JSON.
+
+Results are built the way the Grid and Little Sis adaptors build them: Grid results from the sample results in
+grid/samples, and Little Sis results from a person, their web page and a network of connections with a relationship to
+each. From the VCF_Router folder, run:
+
+    python benchmarks/records.py [--results 50] [--repeat 20]
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from vcf import EntityRecord, RelationshipRecord, ResultRecord, create_relationship, encode_results  # noqa: E402
+
+GRID_SAMPLES = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "grid",
+                            "samples")
+
+
+# ============================ Stand-in results ============================
+def load_grid_samples() -> list:
+    samples = []
+    for name in ["company-search-results.json", "person-search-results.json"]:
+        with open(os.path.join(GRID_SAMPLES, name)) as file:
+            samples += json.load(file)["searchResults"]
+    return samples
+
+
+def grid_results(samples: list, count: int, records: bool) -> dict:
+    """Results made up of the Grid samples in turn, built one entity at a time as grid.py does."""
+    search_results = []
+    for i in range(count):
+        sample = samples[i % len(samples)]
+        entities = []
+        for entity in sample["entities"]:
+            attributes = entity["attributes"]
+            if entity["type"] == "RelationshipRelationship":
+                make = RelationshipRecord if records else create_relationship
+                entities.append(make(attributes["FromId"], attributes["ToId"], attributes.get("Title")))
+            elif records:
+                entities.append(EntityRecord(entity["id"], entity["type"], dict(attributes)))
+            else:
+                entities.append({"id": entity["id"], "type": entity["type"], "attributes": dict(attributes)})
+        fields = {"key": str(uuid.uuid4()), "title": sample["title"], "subTitle": sample.get("subTitle"),
+                  "summary": sample.get("summary"), "source": sample["source"], "url": sample.get("url"),
+                  "entities": entities}
+        search_results.append(ResultRecord(**fields) if records else fields)
+    return {"searchResults": search_results}
+
+
+def littlesis_results(count: int, records: bool, connections: int = 40) -> dict:
+    """Results shaped like littlesis.py's: the found entity and web page, then its network for the top 10."""
+    def person(n: int) -> list:
+        entity_id = str(uuid.uuid3(uuid.NAMESPACE_DNS, str(n)))
+        webpage_id = str(uuid.uuid3(uuid.NAMESPACE_DNS, f"https://example.com/{n}"))
+        attributes = {"Dob": "1960-01-01", "DateOfDeath": None, "FirstName": f"First{n}", "LastName": f"Last{n}",
+                      "OtherNames": None, "Salutation": None, "Gender": 1}
+        webpage = {"Url": f"https://example.com/{n}"}
+        if records:
+            return [EntityRecord(entity_id, "EntityPerson", attributes),
+                    EntityRecord(webpage_id, "EntityWebPage", webpage), RelationshipRecord(entity_id, webpage_id)]
+        return [{"id": entity_id, "type": "EntityPerson", "attributes": attributes},
+                {"id": webpage_id, "type": "EntityWebPage", "attributes": webpage},
+                create_relationship(entity_id, webpage_id)]
+
+    search_results = []
+    for i in range(count):
+        entities = person(i)
+        if i < 10:
+            for n in range(connections):
+                network = person(count + i * connections + n)
+                relationship = RelationshipRecord if records else create_relationship
+                entities += network + [relationship(entities[0]["id"], network[0]["id"], "Board member")]
+        fields = {"key": str(uuid.uuid4()), "title": f"First{i} Last{i}", "subTitle": "Board member",
+                  "summary": "Summary " * 20, "source": "Little Sis", "entities": entities,
+                  "url": f"https://littlesis.org/person/{i}"}
+        search_results.append(ResultRecord(**fields) if records else fields)
+    return {"searchResults": search_results}
+
+
+# ============================ Benchmark ============================
+def measure(build) -> tuple:
+    """Returns the peak memory taken while building results, and the memory and memory blocks kept by them."""
+    tracemalloc.start()
+    blocks = sys.getallocatedblocks()
+    results = build()
+    kept_blocks = sys.getallocatedblocks() - blocks
+    kept, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return results, peak, kept, kept_blocks
+
+
+def time_ms(results: dict, repeat: int) -> list:
+    encode_results(results)  # Warm up
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        encode_results(results)
+        timings.append((time.perf_counter() - started) * 1000)
+    return sorted(timings)
+
+
+def main(args):
+    samples = load_grid_samples()
+    for name, build in [("Grid", lambda records: grid_results(samples, args.results, records)),
+                        ("Little Sis", lambda records: littlesis_results(args.results, records))]:
+        bodies = []
+        for kind, records in [("dicts", False), ("records", True)]:
+            results, peak, kept, kept_blocks = measure(lambda: build(records))
+            entities = sum(len(result["entities"]) for result in results["searchResults"])
+            timings = time_ms(results, args.repeat)
+            bodies.append(json.loads(encode_results(results)))
+            print(f"{name:>10}, {args.results} results, {entities} entities, {kind:>7}: peak {peak / 1024:9,.0f} KiB  "
+                  f"kept {kept / 1024:9,.0f} KiB in {kept_blocks:7,} blocks  encoded in "
+                  f"{statistics.mean(timings):7.2f} ms")
+        for body in bodies:
+            for result in body["searchResults"]:
+                result.pop("key")  # Random
+        if bodies[0] != bodies[1]:
+            sys.exit(f"{name} results are encoded differently as dicts and as records")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--results", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=20)
+    main(parser.parse_args())
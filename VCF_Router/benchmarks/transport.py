@@ -0,0 +1,134 @@
+"""
+Compares redirecting searches to a co-located adaptor over loopback TCP and over a Unix domain socket.
+
+Starts a stand-in adaptor twice (once on a TCP port, once on a socket) and requests its results endpoint through the
+router's own pooled clients. From the VCF_Router folder, run:
+
+    python benchmarks/transport.py [--requests 2000] [--concurrency 20] [--results 10]
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backends import HTTP_DEFAULTS, close_clients, get_client, get_timeout, request_url  # noqa: E402
+
+
+# ============================ Stand-in adaptor ============================
+def make_results(count: int) -> dict:
+    return {"searchResults": [{
+        "key": str(i),
+        "title": f"Result {i}",
+        "source": "Benchmark",
+        "entities": [{"id": str(i), "type": "EntityPerson", "attributes": {"FirstName": "Jon", "LastName": "Doe"}}],
+    } for i in range(count)]}
+
+
+async def app(scope, receive, send):
+    """Minimal ASGI adaptor returning a fixed set of search results, so the benchmark measures the transport."""
+    if scope["type"] != "http":
+        return
+    await send({"type": "http.response.start", "status": 200,
+                "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(BODY)).encode())]})
+    await send({"type": "http.response.body", "body": BODY})
+
+
+BODY = json.dumps(make_results(int(os.getenv("BENCHMARK_RESULTS", "10")))).encode()
+
+
+# ============================ Benchmark ============================
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_adaptor(*bind_args, results: int) -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "transport:app", "--app-dir", os.path.dirname(os.path.abspath(__file__)),
+         "--log-level", "warning", *bind_args],
+        env={**os.environ, "BENCHMARK_RESULTS": str(results)})
+
+
+async def wait_until_up(url: str):
+    client = get_client(url, HTTP_DEFAULTS)
+    for _ in range(100):
+        try:
+            await client.get(request_url(url))
+            return
+        except Exception:
+            await asyncio.sleep(0.1)
+    raise RuntimeError(f"Stand-in adaptor at {url} did not start")
+
+
+async def run(url: str, requests: int, concurrency: int) -> dict:
+    settings = {**HTTP_DEFAULTS, "max_connections": concurrency, "max_keepalive_connections": concurrency}
+    client = get_client(url, settings)
+    target = request_url(url)
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            started = time.perf_counter()
+            response = await client.get(target, params={"query": "jon doe", "maxResults": "50"},
+                                        timeout=get_timeout(settings))
+            response.read()
+            latencies.append(time.perf_counter() - started)
+
+    await asyncio.gather(*[one() for _ in range(concurrency)])  # Warm up the connection pool
+    latencies.clear()
+    started = time.perf_counter()
+    await asyncio.gather(*[one() for _ in range(requests)])
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "req/s": requests / elapsed,
+        "mean ms": statistics.mean(latencies) * 1000,
+        "p50 ms": latencies[len(latencies) // 2] * 1000,
+        "p99 ms": latencies[int(len(latencies) * 0.99)] * 1000,
+    }
+
+
+async def main(args):
+    socket_path = os.path.join(tempfile.mkdtemp(), "adaptor.sock")
+    port = free_port()
+    adaptors = [
+        start_adaptor("--host", "127.0.0.1", "--port", str(port), results=args.results),
+        start_adaptor("--uds", socket_path, results=args.results),
+    ]
+    urls = {
+        "tcp loopback": f"http://127.0.0.1:{port}/searchers/benchmark/results",
+        "unix socket": f"unix://{socket_path}/searchers/benchmark/results",
+    }
+    try:
+        for url in urls.values():
+            await wait_until_up(url)
+        await close_clients()
+
+        print(f"{args.requests} requests, concurrency {args.concurrency}, {args.results} results per response")
+        for name, url in urls.items():
+            stats = await run(url, args.requests, args.concurrency)
+            print(f"{name:>13}: " + "  ".join(f"{key} {value:8.2f}" for key, value in stats.items()))
+    finally:
+        await close_clients()
+        for adaptor in adaptors:
+            adaptor.terminate()
+            adaptor.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--results", type=int, default=10, help="Search results in each response")
+    asyncio.run(main(parser.parse_args()))
@@ -7,48 +7,442 @@ E.g.
 
     uvicorn main:app --host 192.168.2.25
 """
-import requests
-import yaml
-from fastapi import FastAPI, status
+import asyncio
+import functools
+import importlib
+import os
+import re
+import sys
+
+import httpx
+from fastapi import FastAPI, Header, Request, status
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
 
 from vcf import *
+from backends import (Replica, check_replicas, choose_replica, close_clients, deadline_headers, get_client,
+                      get_hedge_budget, get_timeout, hedge_settings, http_settings, sync_backends)
 
 app = FastAPI()
+# Compresses responses as set in config.yml's compression section
+app.add_middleware(CompressionMiddleware)
+
+# Response headers copied from the adaptor when a searcher is passed through
+PASSTHROUGH_HEADERS = ("content-type", "content-encoding")
+
+# Sub-searches run at once for an OR query, unless the searcher sets `or_concurrency`
+DEFAULT_OR_CONCURRENCY = 4
+
+_plugins = {}
+
+# Replicas and clients no longer used by config.yml are let go of whenever it is reloaded
+on_registry_loaded(lambda registry: sync_backends(registry.config))
+
+
+def resolve_handler(searcher: Mapping):
+    """
+    Returns the function carrying out a searcher's searches, which is called with the registry, the searcher's section
+    of config.yml, the query and the maximum number of results. Plugins are imported here, so that a plugin that cannot
+    be imported is reported when config.yml is loaded.
+    """
+    if "aggregate" in searcher:
+        return aggregate_results
+    if "redirect" in searcher:
+        return redirect_results
+    if "module" in searcher:
+        return functools.partial(plugin_results, load_plugin(searcher))
+    function = globals()["get_" + searcher["id"]]
+    return lambda registry, searcher, query, max_results: function(query, max_results)
+
+
+@app.on_event("startup")
+async def startup():
+    # config.yml is only read here, and again whenever it changes, rather than on every request
+    app.state.config_watcher = start_registry(resolve_handler)
+    # Records the stack of any code blocking the event loop for longer than watchdog.threshold_ms
+    app.state.loop_watchdog = start_watchdog()
+    app.state.health_checks = asyncio.create_task(check_replicas(lambda: get_registry().config))
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    app.state.config_watcher.cancel()
+    app.state.loop_watchdog.stop()
+    app.state.health_checks.cancel()
+    await close_clients()
 
 
 @app.get("/searchers/", response_model=List[Searcher], response_model_exclude_none=True)
 def get_searchers():
-    searchers = []
+    return get_registry().searchers
+
 
-    with open('config.yml', 'r') as file:
-        CONFIG = yaml.safe_load(file)
+@app.get("/cache/")
+def get_cache_stats():
+    """Hit and miss counts, and the size, of the response cache and shared cache."""
+    return cache_stats()
 
-    for searcher in CONFIG["searchers"].values():
-        if searcher["enabled"]:
-            searcher.pop("enabled", None)
-            searcher.pop("redirect", None)
-            searchers.append(searcher)
 
-    return searchers
+@app.delete("/cache/")
+async def clear_cache(searcher_id: Optional[str] = None):
+    """Removes every cached result, or only those of `searcher_id`, including from the shared cache."""
+    await clear_caches(searcher_id)
+    return cache_stats()
+
+
+@app.get("/debug/loop/")
+async def get_loop_stats():
+    """Lag of the event loop, and the stacks of the code found blocking it (see watchdog in config.yml)."""
+    return loop_stats()
 
 
 @app.get("/searchers/{searcher_id}/results", response_model=SearchResults, response_model_exclude_none=True,
          status_code=status.HTTP_200_OK)
-async def get_results(searcher_id, query: str, maxResults=50):
-    with open('config.yml', 'r') as file:
-        CONFIG = yaml.safe_load(file)
+async def get_results(searcher_id, query: str, request: Request, maxResults: int = 50,
+                      x_vcf_time_limit: Optional[float] = Header(None), cache_control: Optional[str] = Header(None)):
+    # Deadline of the search, which is passed on to the adaptors it is redirected to
+    set_deadline(x_vcf_time_limit)
+    # Cache-Control: no-cache skips cached results, here and in the adaptors the search is sent to
+    set_cache_bypass(cache_control)
+    # Messages logged during the search are filtered (and sampled) by its searcher's logging settings
+    set_log_searcher(searcher_id)
 
+    registry = get_registry()
+    CONFIG = registry.config
     if searcher_id in CONFIG["searchers"]:
         if CONFIG["searchers"][searcher_id]["enabled"]:
-            if "redirect" in CONFIG["searchers"][searcher_id].keys():
-                redirect = CONFIG["searchers"][searcher_id]["redirect"] + \
-                    f"?query={query}&maxResults={str(maxResults)}"
-                # print(redirect)
-                return requests.get(redirect).json()
-            else:
-                return await globals()["get_" + searcher_id](query, maxResults)
+            terms = split_or_query(query) if CONFIG["searchers"][searcher_id].get("split_or") else [query]
+            ttl = CONFIG["searchers"][searcher_id].get("cache_ttl")
+            # Searches are cancelled, along with the redirects they are waiting on, if the client disconnects. Results
+            # are sent as JSON without being checked against SearchResults, unless validate_responses is on
+            if len(terms) > 1:
+                return results_response(await cancel_on_disconnect(request, cached_search(
+                    searcher_id, query, maxResults, ttl, lambda: or_results(registry, searcher_id, terms, maxResults))))
+            if CONFIG["searchers"][searcher_id].get("passthrough") and "redirect" in CONFIG["searchers"][searcher_id]:
+                return await cancel_on_disconnect(request, passthrough_results(
+                    CONFIG, CONFIG["searchers"][searcher_id], query, maxResults,
+                    request.headers.get("accept-encoding", "identity")))
+            # Results are cached for the searcher's cache_ttl, and identical searches already in progress share their
+            # result instead of querying the adaptor again
+            return results_response(await cancel_on_disconnect(request, cached_search(
+                searcher_id, query, maxResults, ttl, lambda: run_searcher(registry, searcher_id, query, maxResults))))
 
         else:
             return {"errors": [{"message": "Searcher not enabled."}]}
     else:
         return {"errors": [{"message": "Unrecognised searcher"}]}
+
+
+async def run_searcher(registry: Registry, searcher_id: str, query: str, max_results: int):
+    """Runs a searcher with its handler."""
+    searcher = registry.config["searchers"][searcher_id]
+    return await registry.handlers[searcher_id](registry, searcher, query, max_results)
+
+
+def split_or_query(query: str) -> List[str]:
+    """
+    Splits a query of the form `A OR B OR "C D"` into its terms. Double-quoted phrases are kept together (so an OR
+    inside quotes does not split the query) and have their quotes removed when they make up a whole term. Repeated
+    terms are only returned once.
+
+    :param query: Query entered by the analyst
+    :type query: str
+    :return: Terms of the query, or just the query if it has no OR
+    :rtype: list(str)
+    """
+    terms = []
+    words = []
+    for word in re.findall(r'"[^"]*"|\S+', query) + ["OR"]:
+        if word != "OR":
+            words.append(word)
+            continue
+        term = " ".join(words)
+        words = []
+        if len(term) > 1 and term.startswith('"') and term.endswith('"') and term.count('"') == 2:
+            term = term[1:-1]
+        term = term.strip()
+        if term and term.lower() not in [existing.lower() for existing in terms]:
+            terms.append(term)
+    return terms or [query]
+
+
+async def or_results(registry: Registry, searcher_id: str, terms: List[str], max_results: int):
+    """
+    Runs a searcher once for each term of an OR query, at most `or_concurrency` at a time, and merges the results.
+    Results whose main (first) entity was already returned for an earlier term are dropped, and only the first (or,
+    with `rank`, the best) `max_results` are kept.
+    """
+    config = registry.config
+    semaphore = asyncio.Semaphore(config["searchers"][searcher_id].get("or_concurrency", DEFAULT_OR_CONCURRENCY))
+    ttl = config["searchers"][searcher_id].get("cache_ttl")
+
+    async def search_term(term):
+        async with semaphore:
+            return await cached_search(searcher_id, term, max_results, ttl,
+                                       lambda: run_searcher(registry, searcher_id, term, max_results))
+
+    responses = await asyncio.gather(*[search_term(term) for term in terms], return_exceptions=True)
+
+    search_results = []
+    errors = []
+    seen_ids = set()
+    for term, response in zip(terms, responses):
+        if isinstance(response, Exception):
+            errors.append({"message": f'"{term}": {response}'})
+            continue
+        for result in response.get("searchResults") or []:
+            entity_id = result["entities"][0]["id"] if result.get("entities") else result.get("key")
+            if entity_id in seen_ids:
+                continue
+            seen_ids.add(entity_id)
+            search_results.append(result)
+        for error in response.get("errors") or []:
+            errors.append({"message": f'"{term}": {error.get("message")}'})
+
+    output = {"searchResults": search_results}
+    if errors:
+        output["errors"] = errors
+    if config["searchers"][searcher_id].get("rank"):
+        rank_results(output, terms, max_results)
+    # Each term returns up to max_results, so the merged results can hold several times as many
+    output["searchResults"] = output["searchResults"][:max_results]
+    return output
+
+
+async def redirect_results(registry: Registry, searcher: Mapping, query: str, max_results: int):
+    """Runs a searcher by redirecting the search to its adaptor."""
+    config = registry.config
+    params = {"query": query, "maxResults": max_results}
+    try:
+        if hedge_settings(searcher):
+            return await hedged_redirect(config, searcher, params)
+
+        replica = choose_replica(searcher)
+        if replica is None:
+            return unavailable_error(searcher)
+        return await redirect(config, searcher, replica, params)
+    except httpx.HTTPStatusError as e:
+        return status_error(searcher, e.response)
+    except httpx.HTTPError as e:
+        return {"errors": [{"message": f"Error querying {searcher.get('name', searcher['id'])}: {e!r}"}]}
+    except ValueError:
+        return {"errors": [{"message": f"Error querying {searcher.get('name', searcher['id'])}: the adaptor's "
+                                       f"response is not valid JSON search results."}]}
+
+
+def load_plugin(searcher: dict):
+    """
+    Imports the adaptor module named by a searcher's `module` key (from the folder given by `path`, if any) and returns
+    its search function named by `function`. Modules are only imported once.
+
+    Adaptor modules import their helpers with `from vcf import ...`, which resolves to the router's own vcf.py. Every
+    app's vcf.py takes its helpers from the same VCF_Shared/vcf_shared.py, so this works for any adaptor in this
+    repository.
+    """
+    key = (searcher.get("path"), searcher["module"], searcher["function"])
+    function = _plugins.get(key)
+    if function is None:
+        if searcher.get("path"):
+            path = os.path.abspath(searcher["path"])
+            if path not in sys.path:
+                # Appended, so that the router's own modules (e.g. vcf.py) take precedence over the adaptor's copies
+                sys.path.append(path)
+        function = _plugins[key] = getattr(importlib.import_module(searcher["module"]), searcher["function"])
+    return function
+
+
+async def plugin_results(function, registry: Registry, searcher: Mapping, query: str, max_results: int) -> dict:
+    """Runs an adaptor's search function (from load_plugin()) in the router's own process, rather than over HTTP."""
+    results = await function(query, max_results)
+    if "error" in results:
+        # Adaptors report failures under `error`, which their own apps turn into an HTTP error. Return them to Videris
+        # as errors instead.
+        return {"errors": results["error"]}
+    return results
+
+
+async def redirect(config: dict, searcher: dict, replica: Replica, params: dict) -> dict:
+    """
+    Sends a search to one replica of a searcher's adaptor, recording the outcome against the replica. A response with
+    an error status, or that is not JSON search results, counts as a failure of the replica.
+
+    :raises httpx.HTTPStatusError: If the adaptor responded with an error status
+    :raises httpx.HTTPError: If the adaptor could not be reached or timed out
+    :raises ValueError: If the response is not JSON search results
+    """
+    settings = http_settings(config, searcher)
+    started = replica.start()
+    try:
+        response = await get_client(replica.url, settings).get(replica.request_url, params=params,
+                                                               headers={**deadline_headers(), **cache_headers()},
+                                                               timeout=get_timeout(settings))
+        response.raise_for_status()
+        results = response.json()
+        if not isinstance(results, dict):
+            raise ValueError(f"Expected search results, got {type(results).__name__}")
+    except (httpx.HTTPError, ValueError):
+        replica.finish(started, False)
+        raise
+    except BaseException:
+        replica.finish(started, None)
+        raise
+    replica.finish(started, True)
+    return results
+
+
+async def hedged_redirect(config: dict, searcher: dict, params: dict) -> dict:
+    """
+    Sends a search to the best replica and, if it has not answered within the configured percentile of its recent
+    latencies, sends a duplicate to another replica (when the searcher's hedge budget allows). The first successful
+    response is used and the other search is cancelled.
+    """
+    settings = hedge_settings(searcher)
+    budget = get_hedge_budget(searcher["id"])
+    budget.deposit(settings["budget"])
+
+    replica = choose_replica(searcher)
+    if replica is None:
+        return unavailable_error(searcher)
+    delay = replica.latency_percentile(settings["percentile"])
+    if delay is None:
+        return await redirect(config, searcher, replica, params)
+
+    tasks = [asyncio.ensure_future(redirect(config, searcher, replica, params))]
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if done:
+            return tasks[0].result()
+
+        if not budget.withdraw():
+            return await tasks[0]
+        other_replica = choose_replica(searcher, exclude=replica)
+        if other_replica is None:
+            budget.deposit(1)  # Nothing to hedge to, so give back the hedge
+            return await tasks[0]
+        tasks.append(asyncio.ensure_future(redirect(config, searcher, other_replica, params)))
+
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                # Use the first response, unless it failed and the other search may still succeed
+                if task.exception() is None or not pending:
+                    return task.result()
+    finally:
+        # Cancel the slower search (or both, if this search was itself cancelled)
+        for task in tasks:
+            task.cancel()
+
+
+def status_error(searcher: dict, response: httpx.Response) -> dict:
+    """
+    Response for a searcher whose adaptor responded with an error status. Adaptors report a search that failed outright
+    with a 422 whose detail holds the errors under `error`, which are returned as they are.
+    """
+    try:
+        errors = response.json()["detail"]["error"]
+    except (ValueError, KeyError, TypeError):
+        errors = None
+    if isinstance(errors, list) and errors:
+        return {"errors": errors}
+    return {"errors": [{"message": f"Error querying {searcher.get('name', searcher['id'])}: the adaptor responded "
+                                   f"with HTTP {response.status_code}."}]}
+
+
+def unavailable_error(searcher: dict) -> dict:
+    """Response for a searcher whose every replica has an open circuit breaker."""
+    return {"errors": [{"message": f"{searcher.get('name', searcher['id'])} is currently unavailable. "
+                                   f"Please try again later."}]}
+
+
+async def passthrough_results(config: dict, searcher: dict, query: str, max_results: int, accept_encoding: str):
+    """
+    Streams the adaptor's response straight back to Videris without parsing or validating it. The body is forwarded
+    exactly as received (still compressed, if the adaptor compressed it), along with the adaptor's status code.
+    """
+    settings = http_settings(config, searcher)
+    replica = choose_replica(searcher)
+    if replica is None:
+        return unavailable_error(searcher)
+
+    client = get_client(replica.url, settings)
+    upstream_request = client.build_request("GET", replica.request_url,
+                                            params={"query": query, "maxResults": max_results},
+                                            headers={"Accept-Encoding": accept_encoding, **deadline_headers(),
+                                                     **cache_headers()},
+                                            timeout=get_timeout(settings))
+    started = replica.start()
+    try:
+        upstream = await client.send(upstream_request, stream=True)
+    except httpx.HTTPError as e:
+        replica.finish(started, False)
+        return {"errors": [{"message": f"Error querying {searcher.get('name', searcher['id'])}: {e!r}"}]}
+    except BaseException:
+        replica.finish(started, None)
+        raise
+
+    async def close_upstream():
+        await upstream.aclose()
+        replica.finish(started, upstream.status_code < 500)
+
+    headers = {name: upstream.headers[name] for name in PASSTHROUGH_HEADERS if name in upstream.headers}
+    return StreamingResponse(upstream.aiter_raw(), status_code=upstream.status_code, headers=headers,
+                             background=BackgroundTask(close_upstream))
+
+
+async def aggregate_results(registry: Registry, searcher: Mapping, query: str, max_results: int):
+    """
+    Runs every searcher listed under an aggregate searcher's `aggregate` key concurrently and merges their
+    responses into a single set of search results. Errors are prefixed with the name of the searcher that raised them,
+    and a failing searcher does not prevent the results of the others from being returned. Only the first (or, with
+    `rank`, the best) `max_results` are kept.
+    """
+    config = registry.config
+    searcher_id = searcher["id"]
+    members = []
+    errors = []
+    for member_id in searcher["aggregate"]:
+        member = config["searchers"].get(member_id)
+        if member is None or member_id == searcher_id or "aggregate" in member.keys():
+            errors.append({"message": f"{member_id}: Unrecognised searcher"})
+        elif not member["enabled"]:
+            errors.append({"message": f"{member.get('name', member_id)}: Searcher not enabled."})
+        else:
+            members.append(member)
+
+    tasks = [asyncio.ensure_future(cached_search(member["id"], query, max_results, member.get("cache_ttl"),
+                                                 lambda member=member: registry.handlers[member["id"]](
+                                                     registry, member, query, max_results)))
+             for member in members]
+    if tasks:
+        try:
+            # Searchers that have not answered by the deadline are left out, so the others' results still get returned
+            await asyncio.wait(tasks, timeout=time_remaining())
+        finally:
+            # Also cancels every member search if the aggregate search is itself cancelled
+            for task in tasks:
+                task.cancel()
+
+    search_results = []
+    for member, task in zip(members, tasks):
+        name = member.get("name", member["id"])
+        if task.cancelled() or not task.done():
+            errors.append({"message": f"{name}: {deadline_error()['message']}"})
+            continue
+        if task.exception() is not None:
+            errors.append({"message": f"{name}: {task.exception()}"})
+            continue
+        response = task.result()
+        search_results += response.get("searchResults") or []
+        for error in response.get("errors") or []:
+            errors.append({"message": f"{name}: {error.get('message')}"})
+
+    output = {"searchResults": search_results}
+    if errors:
+        output["errors"] = errors
+    if config["searchers"][searcher_id].get("rank"):
+        # Otherwise the results are in the order of the searchers, which puts the best matches of later searchers last
+        rank_results(output, [query], max_results)
+    # Each searcher returns up to max_results, so the merged results can hold several times as many
+    output["searchResults"] = output["searchResults"][:max_results]
+    return output
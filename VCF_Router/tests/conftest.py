@@ -0,0 +1,39 @@
+import os
+import sys
+
+import pytest
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+from vcf import Registry, response_cache  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def clear_response_cache():
+    yield
+    response_cache.clear()
+
+
+def make_registry(searchers: dict, handlers: dict) -> Registry:
+    """A registry of the given searchers (by id, as in config.yml) and the functions carrying out their searches."""
+    searchers = {searcher_id: {"id": searcher_id, "name": searcher_id, "enabled": True, **searcher}
+                 for searcher_id, searcher in searchers.items()}
+    return Registry({"searchers": searchers}, (), handlers, 0)
+
+
+def fake_searcher(titles: list = None, error: str = None, calls: list = None):
+    """
+    A searcher handler returning a result for each title (or, by default, max_results results titled after the query),
+    and an error if one is given.
+    """
+    async def handler(registry, searcher, query, max_results):
+        if calls is not None:
+            calls.append(query)
+        found = titles if titles is not None else [f"{query} {i}" for i in range(max_results)]
+        results = {"searchResults": [{"key": f"{searcher['id']}-{i}", "title": title, "source": searcher["id"]}
+                                     for i, title in enumerate(found)]}
+        if error:
+            results["errors"] = [{"message": error}]
+        return results
+    return handler
@@ -0,0 +1,57 @@
+"""
+Tests of aggregate searchers, which query several searchers at once and merge their results.
+
+Run from the VCF_Router folder with `python -m pytest tests`.
+"""
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from conftest import APP_DIR, fake_searcher, make_registry
+
+
+def aggregate(rank: bool = False, **handlers):
+    searchers = {searcher_id: {} for searcher_id in handlers}
+    searchers["all"] = {"aggregate": list(handlers), "rank": rank}
+    return make_registry(searchers, handlers)
+
+
+def search(registry, query: str, max_results: int) -> dict:
+    return asyncio.run(main.aggregate_results(registry, registry.config["searchers"]["all"], query, max_results))
+
+
+@pytest.mark.parametrize("rank", [False, True])
+def test_results_are_cut_down_to_max_results(rank):
+    registry = aggregate(rank, first=fake_searcher(), second=fake_searcher())
+    results = search(registry, "acme", 3)
+    assert len(results["searchResults"]) == 3
+    assert "errors" not in results
+
+
+def test_results_are_in_searcher_order():
+    registry = aggregate(first=fake_searcher(["Widgets"]), second=fake_searcher(["Acme Ltd"]))
+    assert [result["title"] for result in search(registry, "acme", 5)["searchResults"]] == ["Widgets", "Acme Ltd"]
+
+
+def test_ranked_results_are_best_first():
+    pytest.importorskip("rapidfuzz")
+    registry = aggregate(True, first=fake_searcher(["Widgets", "Acme Holdings"]), second=fake_searcher(["Acme"]))
+    assert [result["title"] for result in search(registry, "acme", 2)["searchResults"]] == ["Acme", "Acme Holdings"]
+
+
+def test_errors_are_prefixed_with_searcher():
+    registry = aggregate(first=fake_searcher(["Acme"]), second=fake_searcher([], error="Upstream is down."))
+    results = search(registry, "acme", 5)
+    assert [result["title"] for result in results["searchResults"]] == ["Acme"]
+    assert results["errors"] == [{"message": "second: Upstream is down."}]
+
+
+def test_invalid_max_results(monkeypatch):
+    # config.yml is read from the current folder
+    monkeypatch.chdir(APP_DIR)
+    with TestClient(main.app) as client:
+        response = client.get("/searchers/everything/results", params={"query": "acme", "maxResults": "abc"})
+    assert response.status_code == 422
+    assert response.json()["detail"][0]["loc"] == ["query", "maxResults"]
@@ -0,0 +1,168 @@
+"""
+Tests of the router's connections to its backends: timeouts, replicas, circuit breakers and hedging.
+
+Run from the VCF_Router folder with `python -m pytest tests`.
+"""
+import asyncio
+
+import pytest
+
+import backends
+
+
+def test_timeouts():
+    settings = backends.http_settings({"http": {"connect_timeout": 2, "read_timeout": 30}},
+                                      {"http": {"write_timeout": 45}})
+    timeout = backends.get_timeout(settings)
+    assert (timeout.connect, timeout.read, timeout.write, timeout.pool) == (2, 30, 45, 10)
+
+
+def redirect_config(*urls, failures: int = 5) -> dict:
+    return {"circuit_breaker": {"failures": failures},
+            "searchers": {"database": {"id": "database", "enabled": True, "redirect": list(urls)}}}
+
+
+@pytest.fixture(autouse=True)
+def clear_backends():
+    yield
+    backends._replicas.clear()
+    backends._clients.clear()
+    backends._hedge_budgets.clear()
+
+
+def test_sync_backends_keeps_replicas_in_use():
+    backends.sync_backends(redirect_config("http://one:1/searchers/database/results",
+                                           "http://two:2/searchers/database/results"))
+    one = backends.get_replica("http://one:1/searchers/database/results")
+    one.healthy = False
+    backends.sync_backends(redirect_config("http://one:1/searchers/database/results", failures=2))
+    assert list(backends._replicas) == ["http://one:1/searchers/database/results"]
+    assert backends.get_replica("http://one:1/searchers/database/results") is one
+    assert not one.healthy
+    assert one.breaker.settings["failures"] == 2
+
+
+def test_choose_replica_keeps_breaker_settings():
+    config = redirect_config("http://one:1/searchers/database/results", failures=2)
+    backends.sync_backends(config)
+    replica = backends.choose_replica({**config["searchers"]["database"], "circuit_breaker": {"failures": 9}})
+    assert replica.breaker.settings["failures"] == 2
+
+
+def test_stale_clients_are_closed_once_idle(monkeypatch):
+    monkeypatch.setattr(backends, "STALE_CLIENT_CHECK_INTERVAL", 0.01)
+
+    async def test():
+        backends.sync_backends(redirect_config("http://one:1/searchers/database/results",
+                                               "http://two:2/searchers/database/results"))
+        settings = backends.http_settings({}, {})
+        one = backends.get_client("http://one:1/searchers/database/results", settings)
+        two = backends.get_client("http://two:2/searchers/database/results", settings)
+        replica = backends.get_replica("http://two:2/searchers/database/results")
+        started = replica.start()
+
+        backends.sync_backends(redirect_config("http://one:1/searchers/database/results"))
+        assert list(backends._clients) == ["http://one:1"]
+        await asyncio.sleep(0.05)
+        assert not two.is_closed  # Still has a search in flight
+        replica.finish(started, True)
+        await asyncio.sleep(0.05)
+        assert two.is_closed
+        assert not one.is_closed
+        await one.aclose()
+    asyncio.run(test())
+
+
+class Clock:
+    """Stands in for time.monotonic(), so that tests can move time on."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def open_breaker(monkeypatch, **settings) -> tuple:
+    clock = Clock()
+    monkeypatch.setattr(backends.time, "monotonic", clock)
+    breaker = backends.CircuitBreaker()
+    breaker.settings = {**backends.CIRCUIT_BREAKER_DEFAULTS, "failures": 2, "reset_timeout": 30, **settings}
+    for _ in range(2):
+        assert breaker.allow_request()
+        breaker.record_failure()
+    return breaker, clock
+
+
+def test_breaker_opens_after_failures(monkeypatch):
+    breaker, clock = open_breaker(monkeypatch)
+    assert breaker.state == breaker.OPEN
+    assert not breaker.allow_request()
+
+
+def test_breaker_success_resets_failures():
+    breaker = backends.CircuitBreaker()
+    breaker.settings = {**backends.CIRCUIT_BREAKER_DEFAULTS, "failures": 2}
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == breaker.CLOSED
+
+
+def test_breaker_probes_then_closes(monkeypatch):
+    breaker, clock = open_breaker(monkeypatch, half_open_probes=1)
+    clock.now += 30
+    assert breaker.allow_request()
+    assert breaker.state == breaker.HALF_OPEN
+    assert not breaker.allow_request()  # Only one probe at a time
+    breaker.record_success()
+    assert breaker.state == breaker.CLOSED
+    assert breaker.allow_request()
+
+
+def test_breaker_reopens_if_probe_fails(monkeypatch):
+    breaker, clock = open_breaker(monkeypatch)
+    clock.now += 30
+    assert breaker.allow_request()
+    breaker.record_failure()
+    assert breaker.state == breaker.OPEN
+    clock.now += 29
+    assert not breaker.allow_request()
+
+
+def test_abandoned_probe_is_given_back(monkeypatch):
+    breaker, clock = open_breaker(monkeypatch)
+    clock.now += 30
+    assert breaker.allow_request()
+    breaker.record_abandoned()
+    assert breaker.allow_request()
+
+
+def test_choose_replica_skips_open_breakers():
+    config = redirect_config("http://one:1/searchers/database/results", "http://two:2/searchers/database/results",
+                             failures=1)
+    backends.sync_backends(config)
+    one = backends.get_replica("http://one:1/searchers/database/results")
+    one.finish(one.start(), False)
+    searcher = config["searchers"]["database"]
+    assert backends.choose_replica(searcher).url == "http://two:2/searchers/database/results"
+    two = backends.get_replica("http://two:2/searchers/database/results")
+    two.finish(two.start(), False)
+    assert backends.choose_replica(searcher) is None
+
+
+def test_hedge_budget():
+    budget = backends.HedgeBudget()
+    for _ in range(19):
+        budget.deposit(0.05)
+    assert not budget.withdraw()
+    budget.deposit(0.05)
+    assert budget.withdraw()
+    assert not budget.withdraw()
+
+
+def test_hedge_budget_is_capped():
+    budget = backends.HedgeBudget()
+    for _ in range(1000):
+        budget.deposit(0.5)
+    assert sum(budget.withdraw() for _ in range(backends.HEDGE_BURST + 5)) == backends.HEDGE_BURST
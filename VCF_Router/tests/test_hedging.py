@@ -0,0 +1,70 @@
+"""
+Tests of hedged redirects, which send a slow search to a second replica and use whichever answers first.
+
+Run from the VCF_Router folder with `python -m pytest tests`.
+"""
+import asyncio
+
+import httpx
+import pytest
+
+import backends
+import main
+
+SLOW = "http://slow:1/searchers/database/results"
+FAST = "http://fast:2/searchers/database/results"
+
+
+@pytest.fixture(autouse=True)
+def clear_backends():
+    yield
+    backends._replicas.clear()
+    backends._clients.clear()
+    backends._hedge_budgets.clear()
+
+
+def hedged_search(monkeypatch, budget: float, latencies: int = backends.MIN_LATENCY_SAMPLES) -> tuple:
+    """
+    Runs a search of a searcher with a slow replica, which is chosen first and has `latencies` recent searches that
+    took 10ms, and a fast one. Returns the results and the replicas that were sent the search.
+    """
+    config = {"searchers": {"database": {"id": "database", "enabled": True, "redirect": [SLOW, FAST],
+                                         "hedge": {"percentile": 95, "budget": budget}}}}
+    searcher = config["searchers"]["database"]
+    backends.sync_backends(config)
+    slow = backends.get_replica(SLOW)
+    slow.latencies.extend([0.01] * latencies)
+    slow.ewma_latency = 0.01
+    backends.get_replica(FAST).ewma_latency = 0.02
+    requested = []
+
+    async def respond(request):
+        requested.append(request.url.host)
+        await asyncio.sleep(0.5 if request.url.host == "slow" else 0.0)
+        return httpx.Response(200, json={"searchResults": [], "errors": [{"message": request.url.host}]})
+
+    async def search():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(respond)) as client:
+            monkeypatch.setattr(main, "get_client", lambda url, settings: client)
+            return await main.hedged_redirect(config, searcher, {"query": "acme", "maxResults": 10})
+    return asyncio.run(search()), requested
+
+
+def test_slow_search_is_hedged(monkeypatch):
+    results, requested = hedged_search(monkeypatch, budget=1.0)
+    assert results["errors"] == [{"message": "fast"}]
+    assert requested == ["slow", "fast"]
+    assert backends.get_replica(SLOW).in_flight == 0  # The slow search was cancelled
+    assert backends.get_hedge_budget("database").balance == 0
+
+
+def test_no_hedge_without_budget(monkeypatch):
+    results, requested = hedged_search(monkeypatch, budget=0.05)
+    assert results["errors"] == [{"message": "slow"}]
+    assert requested == ["slow"]
+
+
+def test_no_hedge_without_latencies(monkeypatch):
+    results, requested = hedged_search(monkeypatch, budget=1.0, latencies=backends.MIN_LATENCY_SAMPLES - 1)
+    assert results["errors"] == [{"message": "slow"}]
+    assert requested == ["slow"]
@@ -0,0 +1,77 @@
+"""
+Tests of OR queries, which searchers with `split_or: True` run as a separate search for each term.
+
+Run from the VCF_Router folder with `python -m pytest tests`.
+"""
+import asyncio
+
+import pytest
+
+import main
+from conftest import fake_searcher, make_registry
+
+
+@pytest.mark.parametrize("query, terms", [
+    ("acme", ["acme"]),
+    ("Jon Doe OR Widgets Ltd", ["Jon Doe", "Widgets Ltd"]),
+    ('Jon Doe OR "Acme OR Co" OR Widgets Ltd', ["Jon Doe", "Acme OR Co", "Widgets Ltd"]),
+    ('"Acme Ltd" OR Widgets', ["Acme Ltd", "Widgets"]),
+    ('"Acme" "Co" OR Widgets', ['"Acme" "Co"', "Widgets"]),
+    ("Acme OR acme OR ACME", ["Acme"]),
+    ("cats or dogs", ["cats or dogs"]),
+    ("acme OR", ["acme"]),
+    ("OR acme", ["acme"]),
+    ("acme OR OR widgets", ["acme", "widgets"]),
+    ("OR", ["OR"]),
+])
+def test_split_or_query(query, terms):
+    assert main.split_or_query(query) == terms
+
+
+def search(registry, terms: list, max_results: int) -> dict:
+    return asyncio.run(main.or_results(registry, "database", terms, max_results))
+
+
+def test_results_of_each_term_are_merged():
+    calls = []
+    registry = make_registry({"database": {}}, {"database": fake_searcher(calls=calls)})
+    results = search(registry, ["acme", "widgets"], 4)
+    assert sorted(calls) == ["acme", "widgets"]
+    assert [result["title"] for result in results["searchResults"]] == ["acme 0", "acme 1", "acme 2", "acme 3"]
+
+
+def test_entities_found_by_earlier_terms_are_dropped():
+    async def handler(registry, searcher, query, max_results):
+        return {"searchResults": [{"key": key, "title": f"{query} {key}", "source": "database",
+                                   "entities": [{"id": key, "type": "EntityBusiness", "attributes": {}}]}
+                                  for key in {"acme": ["1", "2"], "widgets": ["2", "3"]}[query]]}
+    registry = make_registry({"database": {}}, {"database": handler})
+    results = search(registry, ["acme", "widgets"], 10)
+    assert [result["title"] for result in results["searchResults"]] == ["acme 1", "acme 2", "widgets 3"]
+
+
+def test_errors_are_prefixed_with_term():
+    async def handler(registry, searcher, query, max_results):
+        if query == "widgets":
+            raise RuntimeError("connection reset")
+        return await fake_searcher(error="Some results are missing.")(registry, searcher, query, max_results)
+    registry = make_registry({"database": {}}, {"database": handler})
+    results = search(registry, ["acme", "widgets"], 2)
+    assert [result["title"] for result in results["searchResults"]] == ["acme 0", "acme 1"]
+    assert results["errors"] == [{"message": '"acme": Some results are missing.'},
+                                 {"message": '"widgets": connection reset'}]
+
+
+def test_or_concurrency():
+    running = []
+    most_running = []
+
+    async def handler(registry, searcher, query, max_results):
+        running.append(query)
+        most_running.append(len(running))
+        await asyncio.sleep(0.01)
+        running.remove(query)
+        return {"searchResults": []}
+    registry = make_registry({"database": {"or_concurrency": 2}}, {"database": handler})
+    search(registry, [f"term {i}" for i in range(6)], 10)
+    assert max(most_running) == 2
@@ -0,0 +1,12 @@
+"""
+Makes vcf_shared importable, with the VCF Router's VCF models, which are the broadest of the apps' (each app's vcf.py
+passes its models to use_models() in the same way).
+"""
+import os
+import sys
+
+VCF_SHARED_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, VCF_SHARED_PATH)
+sys.path.insert(0, os.path.join(os.path.dirname(VCF_SHARED_PATH), "VCF_Router"))
+
+import vcf  # noqa: E402,F401
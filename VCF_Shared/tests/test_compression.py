@@ -0,0 +1,151 @@
+"""
+Tests of CompressionMiddleware's choice of encoding, and of which responses it compresses.
+"""
+import gzip
+import json
+
+import pytest
+from fastapi import FastAPI
+from fastapi.responses import Response, StreamingResponse
+from fastapi.testclient import TestClient
+
+import vcf_shared
+from vcf_shared import CompressionMiddleware, DEFAULT_COMPRESSION, choose_encoding
+
+LARGE = {"searchResults": [{"key": str(i), "title": f"Acme Ltd {i}", "source": "Test"} for i in range(100)]}
+SMALL = {"searchResults": []}
+
+app = FastAPI()
+app.add_middleware(CompressionMiddleware)
+
+
+@app.get("/large")
+def get_large():
+    return LARGE
+
+
+@app.get("/small")
+def get_small():
+    return SMALL
+
+
+@app.get("/compressed")
+def get_compressed():
+    # As a passthrough searcher returns an adaptor's compressed response
+    return Response(gzip.compress(json.dumps(LARGE).encode()), media_type="application/json",
+                    headers={"Content-Encoding": "gzip"})
+
+
+@app.get("/image")
+def get_image():
+    return Response(b"\x89PNG" + bytes(4096), media_type="image/png")
+
+
+@app.get("/streamed")
+def get_streamed():
+    def parts():
+        yield b'{"searchResults":['
+        for i in range(100):
+            yield (b"," if i else b"") + json.dumps(LARGE["searchResults"][i]).encode()
+        yield b"]}"
+    return StreamingResponse(parts(), media_type="application/json")
+
+
+@pytest.fixture
+def client():
+    with TestClient(app) as client:
+        yield client
+
+
+def get_raw(client, path: str, accept_encoding: str) -> tuple:
+    """The response's headers and its body as sent, before the test client decompresses it."""
+    with client.stream("GET", path, headers={"Accept-Encoding": accept_encoding}) as response:
+        return response.headers, b"".join(response.iter_raw())
+
+
+@pytest.mark.parametrize("accept_encoding, encoding", [
+    ("gzip", "gzip"),
+    ("deflate, gzip", "gzip"),
+    ("gzip;q=0.5, identity", "gzip"),
+    ("GZIP", "gzip"),
+    ("gzip;q=0", None),
+    ("identity", None),
+    ("deflate", None),
+    ("", None),
+])
+def test_choose_encoding(accept_encoding, encoding):
+    assert choose_encoding(accept_encoding) == encoding
+
+
+def test_choose_brotli():
+    pytest.importorskip("brotli")
+    assert choose_encoding("gzip, br") == "br"
+    assert choose_encoding("br;q=0.9, gzip") == "gzip"
+    assert choose_encoding("gzip;q=0.5, br;q=0.8") == "br"
+
+
+def test_choose_without_brotli(monkeypatch):
+    monkeypatch.setattr(vcf_shared, "_brotli", lambda: None)
+    assert choose_encoding("br") is None
+    assert choose_encoding("br, gzip") == "gzip"
+
+
+def test_gzip(client):
+    headers, body = get_raw(client, "/large", "gzip")
+    assert headers["content-encoding"] == "gzip"
+    assert headers["vary"] == "Accept-Encoding"
+    assert int(headers["content-length"]) == len(body)
+    assert json.loads(gzip.decompress(body)) == LARGE
+
+
+def test_brotli(client):
+    brotli = pytest.importorskip("brotli")
+    headers, body = get_raw(client, "/large", "br, gzip")
+    assert headers["content-encoding"] == "br"
+    assert json.loads(brotli.decompress(body)) == LARGE
+
+
+@pytest.mark.parametrize("accept_encoding", ["identity", ""])
+def test_identity(client, accept_encoding):
+    headers, body = get_raw(client, "/large", accept_encoding)
+    assert "content-encoding" not in headers
+    assert json.loads(body) == LARGE
+
+
+def test_small_responses_are_not_compressed(client):
+    headers, body = get_raw(client, "/small", "gzip")
+    assert "content-encoding" not in headers
+    assert json.loads(body) == SMALL
+
+
+def test_min_size(client, monkeypatch):
+    monkeypatch.setattr(vcf_shared, "compression_settings", lambda: {**DEFAULT_COMPRESSION, "min_size": 1})
+    headers, body = get_raw(client, "/small", "gzip")
+    assert headers["content-encoding"] == "gzip"
+    assert json.loads(gzip.decompress(body)) == SMALL
+
+
+def test_disabled(client, monkeypatch):
+    monkeypatch.setattr(vcf_shared, "compression_settings", lambda: {**DEFAULT_COMPRESSION, "enabled": False})
+    headers, body = get_raw(client, "/large", "gzip")
+    assert "content-encoding" not in headers
+    assert json.loads(body) == LARGE
+
+
+def test_compressed_responses_are_passed_through(client):
+    headers, body = get_raw(client, "/compressed", "gzip")
+    assert headers["content-encoding"] == "gzip"
+    assert json.loads(gzip.decompress(body)) == LARGE  # Compressed only once
+
+
+def test_other_content_types_are_not_compressed(client):
+    headers, body = get_raw(client, "/image", "gzip")
+    assert "content-encoding" not in headers
+    assert body.startswith(b"\x89PNG")
+
+
+def test_streamed_responses_are_compressed(client):
+    headers, body = get_raw(client, "/streamed", "gzip")
+    assert headers["content-encoding"] == "gzip"
+    assert "content-length" not in headers
+    assert json.loads(gzip.decompress(body)) == LARGE
@@ -0,0 +1,127 @@
+"""
+Tests of loading config.yml into the searcher registry, and of reloading it when it changes.
+"""
+import asyncio
+import os
+
+import pytest
+
+import vcf_shared
+from vcf_shared import (ConfigError, configure_cache, get_registry, load_registry, on_registry_loaded,
+                        reload_registry, watch_config)
+
+CONFIG = """
+searchers:
+  first:
+    id: first
+    name: First
+    enabled: True
+  second:
+    id: second
+    name: Second
+    enabled: {second_enabled}
+"""
+
+
+@pytest.fixture(autouse=True)
+def restore_registry(monkeypatch):
+    monkeypatch.setattr(vcf_shared, "_registry", None)
+    monkeypatch.setattr(vcf_shared, "_registry_hooks", [])
+    yield
+    configure_cache({})
+
+
+def write_config(path, text: str):
+    """Writes config.yml, moving its modification time on so that the change is seen however coarse the clock is."""
+    mtime = os.stat(path).st_mtime_ns if os.path.exists(path) else 0
+    path.write_text(text)
+    os.utime(path, ns=(mtime + 10 ** 9, mtime + 10 ** 9))
+
+
+def resolve_handler(version: str):
+    """Resolves each searcher to a handler returning the searcher's id and the given version of config.yml."""
+    return lambda searcher: lambda query, max_results, searcher_id=searcher["id"]: (searcher_id, version)
+
+
+def test_load_registry(tmp_path):
+    path = tmp_path / "config.yml"
+    write_config(path, CONFIG.format(second_enabled=False))
+    registry = load_registry(resolve_handler("v1"), str(path))
+    assert get_registry() is registry
+    assert [searcher.id for searcher in registry.searchers] == ["first"]
+    assert registry.handlers["first"]("acme", 10) == ("first", "v1")
+    assert "second" not in registry.handlers
+    with pytest.raises(TypeError):
+        registry.config["searchers"]["first"]["enabled"] = False  # Read-only
+
+
+@pytest.mark.parametrize("text, message", [
+    ("searchers: [", "while parsing"),
+    ("logging: {}", "has no searchers section"),
+    (CONFIG.format(second_enabled=False).replace("id: second", "id: other"), "must have an id of second"),
+    (CONFIG.format(second_enabled="maybe"), "must be enabled: True or False"),
+])
+def test_invalid_config_keeps_previous_registry(tmp_path, text, message):
+    path = tmp_path / "config.yml"
+    write_config(path, CONFIG.format(second_enabled=False))
+    registry = load_registry(resolve_handler("v1"), str(path))
+
+    write_config(path, text)
+    with pytest.raises(Exception, match=message):
+        load_registry(resolve_handler("v2"), str(path))
+    assert not reload_registry(resolve_handler("v2"), str(path))
+    assert get_registry() is registry
+    assert get_registry().handlers["first"]("acme", 10) == ("first", "v1")
+
+
+def test_searcher_that_cannot_be_loaded_keeps_previous_registry(tmp_path):
+    path = tmp_path / "config.yml"
+    write_config(path, CONFIG.format(second_enabled=False))
+    registry = load_registry(resolve_handler("v1"), str(path))
+
+    def resolve(searcher):
+        if searcher["id"] == "second":
+            raise ImportError("No module named 'second'")
+        return resolve_handler("v2")(searcher)
+    write_config(path, CONFIG.format(second_enabled=True))
+    with pytest.raises(ConfigError, match="Searcher second cannot be loaded"):
+        load_registry(resolve, str(path))
+    assert get_registry() is registry
+
+
+def test_reload_swaps_whole_registry(tmp_path):
+    path = tmp_path / "config.yml"
+    write_config(path, CONFIG.format(second_enabled=False))
+    loaded = []
+    on_registry_loaded(loaded.append)
+    old = load_registry(resolve_handler("v1"), str(path))
+
+    write_config(path, CONFIG.format(second_enabled=True))
+    assert reload_registry(resolve_handler("v2"), str(path))
+    new = get_registry()
+    assert loaded == [old, new]
+    assert new.handlers["second"]("acme", 10) == ("second", "v2")
+    assert new.handlers["first"]("acme", 10) == ("first", "v2")
+    # A search that started with the old registry keeps using it throughout
+    assert old.handlers["first"]("acme", 10) == ("first", "v1")
+    assert "second" not in old.handlers
+
+
+def test_watch_config(tmp_path):
+    path = tmp_path / "config.yml"
+    write_config(path, CONFIG.format(second_enabled=False))
+    old = load_registry(resolve_handler("v1"), str(path))
+
+    async def test():
+        watcher = asyncio.ensure_future(watch_config(resolve_handler("v2"), str(path), interval=0.01))
+        try:
+            write_config(path, "searchers: [")
+            await asyncio.sleep(0.05)
+            assert get_registry() is old  # Not valid, so not used
+
+            write_config(path, CONFIG.format(second_enabled=True))
+            await asyncio.sleep(0.05)
+            assert get_registry().handlers["second"]("acme", 10) == ("second", "v2")
+        finally:
+            watcher.cancel()
+    asyncio.run(test())
@@ -0,0 +1,246 @@
+"""
+Tests of the shared cache over the wire, against RespServer: a minimal server speaking the Redis protocol (RESP), which
+holds its keys in memory and answers the commands SharedCache sends. Needs the redis package, as a shared cache does.
+
+Run from the VCF_Shared folder with `python -m pytest tests`.
+"""
+import asyncio
+import fnmatch
+import time
+import zlib
+
+import pytest
+
+pytest.importorskip("redis")
+
+from vcf_shared import (SharedCache, cached_search, clear_caches, configure_cache, response_cache,  # noqa: E402
+                        search_key, shared_cache)
+
+
+class RespServer:
+    """
+    Serves GET, SET (with PX), PTTL, SCAN (with MATCH) and DEL on a local port. Set `delay` to make it answer slowly,
+    as an overloaded server would.
+    """
+
+    def __init__(self):
+        self.data = {}  # key: (value, expiry time or None)
+        self.commands = []
+        self.delay = 0.0
+        self.server = None
+
+    @property
+    def url(self) -> str:
+        return f"redis://127.0.0.1:{self.server.sockets[0].getsockname()[1]}/0"
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._serve, "127.0.0.1", 0)
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def _serve(self, reader, writer):
+        try:
+            while True:
+                command = await self._read_command(reader)
+                if command is None:
+                    break
+                self.commands.append(command)
+                if self.delay:
+                    await asyncio.sleep(self.delay)
+                writer.write(self._execute(command))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _read_command(reader) -> list:
+        line = await reader.readline()
+        if not line:
+            return None
+        command = []
+        for _ in range(int(line[1:])):
+            length = int((await reader.readline())[1:])
+            command.append((await reader.readexactly(length + 2))[:-2])
+        return command
+
+    def _execute(self, command: list) -> bytes:
+        name = command[0].upper()
+        if name == b"GET":
+            value = self._get(command[1])
+            return b"$-1\r\n" if value is None else self._bulk(value[0])
+        if name == b"SET":
+            options = [option.upper() for option in command[3:]]
+            expires = time.monotonic() + int(command[4 + options.index(b"PX")]) / 1000 if b"PX" in options else None
+            self.data[command[1]] = (command[2], expires)
+            return b"+OK\r\n"
+        if name == b"PTTL":
+            value = self._get(command[1])
+            if value is None:
+                return b":-2\r\n"
+            return b":%d\r\n" % (-1 if value[1] is None else int((value[1] - time.monotonic()) * 1000))
+        if name == b"SCAN":
+            pattern = command[command.index(b"MATCH") + 1].decode() if b"MATCH" in command else "*"
+            keys = [key for key in list(self.data) if self._get(key) and fnmatch.fnmatchcase(key.decode(), pattern)]
+            return b"*2\r\n" + self._bulk(b"0") + b"*%d\r\n" % len(keys) + b"".join(map(self._bulk, keys))
+        if name == b"DEL":
+            return b":%d\r\n" % sum(self.data.pop(key, None) is not None for key in command[1:])
+        return b"-ERR unknown command\r\n"
+
+    def _get(self, key: bytes):
+        value = self.data.get(key)
+        if value is not None and value[1] is not None and value[1] <= time.monotonic():
+            del self.data[key]
+            return None
+        return value
+
+    @staticmethod
+    def _bulk(value: bytes) -> bytes:
+        return b"$%d\r\n%s\r\n" % (len(value), value)
+
+
+def run(test):
+    """Runs a test coroutine with a RespServer, which it is passed."""
+    async def main():
+        server = RespServer()
+        await server.start()
+        try:
+            await test(server)
+        finally:
+            await server.stop()
+    asyncio.run(main())
+
+
+async def wait_for_writes(cache: SharedCache):
+    await asyncio.gather(*cache._writes)
+
+
+@pytest.fixture(autouse=True)
+def reset_caches():
+    yield
+    configure_cache({})
+    response_cache.clear()
+    shared_cache.hits = shared_cache.misses = shared_cache.errors = 0
+    shared_cache._retry_at = 0.0
+
+
+def test_put_and_get():
+    async def test(server):
+        cache = SharedCache()
+        cache.configure({"url": server.url})
+        key = search_key("grid_company", "Acme  Ltd", 50)
+        body = '{"searchResults": []}'
+
+        cache.put_later(key, body, 60)
+        await wait_for_writes(cache)
+        stored, expires = server.data[SharedCache.key(key).encode()]
+        assert zlib.decompress(stored).decode() == body
+        assert expires is not None
+
+        cached, ttl = await cache.get(search_key("grid_company", "Acme Ltd", 50))
+        assert cached == body
+        assert 59 < ttl <= 60
+        assert await cache.get(search_key("grid_company", "Other Ltd", 50)) is None
+        assert (cache.hits, cache.misses, cache.errors) == (1, 1, 0)
+    run(test)
+
+
+def test_results_expire():
+    async def test(server):
+        cache = SharedCache()
+        cache.configure({"url": server.url})
+        key = search_key("grid_company", "Acme", 50)
+        cache.put_later(key, "{}", 0.05)
+        await wait_for_writes(cache)
+        await asyncio.sleep(0.1)
+        assert await cache.get(key) is None
+        assert cache.misses == 1
+    run(test)
+
+
+def test_slow_server_is_skipped():
+    async def test(server):
+        cache = SharedCache()
+        cache.configure({"url": server.url, "timeout": 0.1})
+        server.delay = 1.0
+        key = search_key("grid_company", "Acme", 50)
+
+        started = time.monotonic()
+        assert await cache.get(key) is None
+        assert time.monotonic() - started < 0.5
+        assert cache.errors == 1
+        assert not cache.available()
+
+        # Not tried again until SHARED_CACHE_RETRY_INTERVAL has passed
+        sent = len(server.commands)
+        assert await cache.get(key) is None
+        cache.put_later(key, "{}", 60)
+        assert len(server.commands) == sent
+        assert cache.stats()["available"] is False
+    run(test)
+
+
+def test_unavailable_server_is_skipped():
+    async def test(server):
+        url = server.url
+        await server.stop()
+        cache = SharedCache()
+        cache.configure({"url": url, "timeout": 0.2})
+        assert await cache.get(search_key("grid_company", "Acme", 50)) is None
+        assert cache.errors == 1
+        assert not cache.available()
+        await server.start()  # So that run() can stop it
+    run(test)
+
+
+def test_cached_search_falls_back_to_shared_cache():
+    async def test(server):
+        configure_cache({"cache": {"redis": {"url": server.url}}})
+        calls = []
+
+        async def search():
+            calls.append(1)
+            return {"searchResults": [{"key": "1", "title": "Acme Ltd", "source": "Grid"}]}
+
+        first = await cached_search("grid_company", "Acme", 50, 60, search)
+        await wait_for_writes(shared_cache)
+        # As another app sharing the cache would, with nothing in its own response cache
+        response_cache.clear()
+        second = await cached_search("grid_company", "Acme", 50, 60, search)
+        assert first == second
+        assert len(calls) == 1
+        assert shared_cache.hits == 1
+    run(test)
+
+
+def test_clear_caches():
+    async def test(server):
+        configure_cache({"cache": {"redis": {"url": server.url}}})
+        for searcher_id in ("grid_company", "grid_people"):
+            key = search_key(searcher_id, "Acme", 50)
+            response_cache.put_json(key, "{}", 60)
+            shared_cache.put_later(key, "{}", 60)
+        await wait_for_writes(shared_cache)
+        assert len(server.data) == 2
+
+        await clear_caches("grid_company")
+        assert [key.split(b":")[1] for key in server.data] == [b"grid_people"]
+        assert response_cache.get(search_key("grid_company", "Acme", 50)) is None
+        assert response_cache.get(search_key("grid_people", "Acme", 50)) == {}
+
+        await clear_caches()
+        assert server.data == {}
+        assert response_cache.stats()["entries"] == 0
+    run(test)
+
+
+def test_not_configured():
+    async def test(server):
+        assert not shared_cache.stats()["enabled"]
+        assert await shared_cache.get(search_key("grid_company", "Acme", 50)) is None
+        await clear_caches()
+        assert server.commands == []
+    run(test)
@@ -0,0 +1,100 @@
+"""
+Tests of single_flight(), which has identical searches running at the same time share one search.
+"""
+import asyncio
+
+import pytest
+
+from vcf_shared import single_flight
+
+
+def test_identical_searches_share_one_search():
+    calls = []
+
+    async def search():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {"searchResults": []}
+
+    async def test():
+        results = await asyncio.gather(*[single_flight(("grid_company", "acme", "50"), search) for _ in range(5)])
+        assert all(result is results[0] for result in results)
+        assert len(calls) == 1
+        # Once it has finished, the next search runs again
+        await single_flight(("grid_company", "acme", "50"), search)
+        assert len(calls) == 2
+    asyncio.run(test())
+
+
+def test_different_searches_are_not_shared():
+    calls = []
+
+    async def search():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {}
+
+    async def test():
+        await asyncio.gather(single_flight(("grid_company", "acme", "50"), search),
+                             single_flight(("grid_company", "acme", "10"), search))
+        assert len(calls) == 2
+    asyncio.run(test())
+
+
+def test_errors_are_shared():
+    calls = []
+
+    async def search():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        raise RuntimeError("upstream is down")
+
+    async def test():
+        results = await asyncio.gather(*[single_flight(("grid_company", "acme", "50"), search) for _ in range(3)],
+                                       return_exceptions=True)
+        assert [str(result) for result in results] == ["upstream is down"] * 3
+        assert len(calls) == 1
+    asyncio.run(test())
+
+
+def test_search_continues_while_anyone_waits():
+    cancelled = []
+
+    async def search():
+        try:
+            await asyncio.sleep(0.05)
+        except asyncio.CancelledError:
+            cancelled.append(1)
+            raise
+        return {"searchResults": []}
+
+    async def test():
+        first = asyncio.ensure_future(single_flight(("grid_company", "acme", "50"), search))
+        second = asyncio.ensure_future(single_flight(("grid_company", "acme", "50"), search))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        assert await second == {"searchResults": []}
+        assert cancelled == []
+    asyncio.run(test())
+
+
+def test_search_is_cancelled_when_everyone_stops_waiting():
+    cancelled = []
+
+    async def search():
+        try:
+            await asyncio.sleep(1)
+        except asyncio.CancelledError:
+            cancelled.append(1)
+            raise
+
+    async def test():
+        waiters = [asyncio.ensure_future(single_flight(("grid_company", "acme", "50"), search)) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        for waiter in waiters:
+            waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiters[1]
+        await asyncio.sleep(0.01)
+        assert cancelled == [1]
+    asyncio.run(test())
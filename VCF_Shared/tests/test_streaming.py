@@ -0,0 +1,125 @@
+"""
+Tests of streamed responses (stream_results()) end to end, through a FastAPI app with a search endpoint like the
+adaptors' own.
+"""
+import json
+from typing import Optional
+
+import pytest
+from fastapi import FastAPI, Header, HTTPException, status
+from fastapi.testclient import TestClient
+
+from vcf_shared import (ErrorRecord, ResultRecord, SearchFailed, configure_cache, response_cache, results_response,
+                        set_cache_bypass, stream_results)
+
+TTL = 60
+
+app = FastAPI()
+searches = []  # The query of each search that was run, rather than answered from the cache
+search_options = {}
+
+
+@app.get("/results")
+async def get_results(query: str, maxResults: int = 50, cache: bool = True,
+                      cache_control: Optional[str] = Header(None)):
+    set_cache_bypass(cache_control)
+    results = await stream_results("test", query, maxResults, TTL if cache else None,
+                                   lambda: search(query, maxResults))
+    if isinstance(results, dict) and "error" in results:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=results)
+    return results_response(results)
+
+
+async def search(query: str, max_results: int):
+    searches.append(query)
+    if search_options.get("fail_before"):
+        raise SearchFailed([{"message": "Upstream is down."}])
+    for i in range(max_results):
+        if i == search_options.get("fail_at"):
+            raise RuntimeError("connection reset")
+        if i == search_options.get("error_at"):
+            yield ErrorRecord("Some results are missing.")
+        yield ResultRecord(key=str(i), title=f"{query} {i}", source="Test")
+
+
+@pytest.fixture
+def client():
+    with TestClient(app) as client:
+        yield client
+    configure_cache({})
+    response_cache.clear()
+    searches.clear()
+    search_options.clear()
+
+
+def titles(response) -> list:
+    return [result["title"] for result in json.loads(response.content)["searchResults"]]
+
+
+def test_results_are_streamed_and_cached(client):
+    response = client.get("/results", params={"query": "acme", "maxResults": 3})
+    assert response.status_code == 200
+    assert "content-length" not in response.headers  # Sent as it was built
+    assert titles(response) == ["acme 0", "acme 1", "acme 2"]
+
+    cached = client.get("/results", params={"query": "acme", "maxResults": 3})
+    assert cached.json() == response.json()
+    assert searches == ["acme"]
+
+
+def test_no_cache_header_skips_cache(client):
+    client.get("/results", params={"query": "acme", "maxResults": 3})
+    response = client.get("/results", params={"query": "acme", "maxResults": 3}, headers={"Cache-Control": "no-cache"})
+    assert titles(response) == ["acme 0", "acme 1", "acme 2"]
+    assert searches == ["acme", "acme"]
+
+
+def test_not_cached_without_ttl(client):
+    for _ in range(2):
+        client.get("/results", params={"query": "acme", "maxResults": 3, "cache": False})
+    assert searches == ["acme", "acme"]
+    assert response_cache.stats()["entries"] == 0
+
+
+def test_large_responses_are_not_cached(client):
+    configure_cache({"cache": {"stream_max_bytes": 1000}})
+    response = client.get("/results", params={"query": "acme", "maxResults": 100})
+    assert len(response.content) > 1000
+    assert len(titles(response)) == 100
+    client.get("/results", params={"query": "acme", "maxResults": 100})
+    assert searches == ["acme", "acme"]
+    assert response_cache.stats()["entries"] == 0
+
+
+def test_empty_results_are_cached(client):
+    for _ in range(2):
+        response = client.get("/results", params={"query": "acme", "maxResults": 0})
+        assert response.json() == {"searchResults": []}
+    assert searches == ["acme"]
+
+
+def test_errors_are_sent_after_results(client):
+    search_options["error_at"] = 1
+    for _ in range(2):
+        response = client.get("/results", params={"query": "acme", "maxResults": 3})
+        assert titles(response) == ["acme 0", "acme 1", "acme 2"]
+        assert response.json()["errors"] == [{"message": "Some results are missing."}]
+    # Results with errors are not cached
+    assert searches == ["acme", "acme"]
+
+
+def test_failure_part_way_through(client):
+    search_options["fail_at"] = 2
+    response = client.get("/results", params={"query": "acme", "maxResults": 3})
+    assert response.status_code == 200
+    assert titles(response) == ["acme 0", "acme 1"]
+    [error] = response.json()["errors"]
+    assert "connection reset" in error["message"]
+    assert response_cache.stats()["entries"] == 0
+
+
+def test_failure_before_first_result(client):
+    search_options["fail_before"] = True
+    response = client.get("/results", params={"query": "acme"})
+    assert response.status_code == 422
+    assert response.json() == {"detail": {"error": [{"message": "Upstream is down."}]}}
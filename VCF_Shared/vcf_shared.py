@@ -0,0 +1,2039 @@
+"""
+Functions shared by the VCF router and every Python adaptor: compact result records, entity mappings, caching,
+deadlines, streamed and compressed responses, logging, the event loop watchdog and the searcher registry.
+
+Each app imports this module through its own vcf.py (`from vcf import ...`), which defines the app's VCF models and
+passes them to use_models(), and adds this folder to the module search path. So this folder must be deployed next to
+the app's folder, as it is in a clone of the repository.
+"""
+import asyncio
+import atexit
+import collections
+import contextvars
+import functools
+import hashlib
+import itertools
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import signal
+import sys
+import threading
+import time
+import traceback
+import uuid
+import zlib
+from collections import OrderedDict
+from datetime import datetime
+from decimal import Decimal
+from enum import Enum
+from types import MappingProxyType
+from typing import Any, Callable, List, Mapping, NamedTuple, Optional
+
+import yaml
+from fastapi.responses import Response, StreamingResponse
+from pydantic import BaseModel, ValidationError
+
+
+# ============================ VCF models ============================
+# The VCF models of the app, which differ between apps (see use_models())
+_models = {}
+
+
+def use_models(searcher, attribute, result, search_results):
+    """
+    Sets the VCF models that searchers are parsed with and results are checked against. Each app defines its own
+    models in its vcf.py, which calls this once when it is imported.
+
+    :param searcher: The app's Searcher model
+    :param attribute: The app's Attribute model
+    :param result: The app's Result model
+    :param search_results: The app's SearchResults model
+    """
+    _models.update(Searcher=searcher, Attribute=attribute, Result=result, SearchResults=search_results)
+    # Built when the app starts rather than on its first search
+    model_encoder(search_results)
+
+
+# ============================ Compact results ============================
+_attribute_shapes = {}
+
+
+class CompactRecord:
+    """
+    Base of the compact versions of the VCF models' dicts, which use __slots__ instead of a dict per object and hold
+    their values already checked against the models, so they can be encoded without being checked again. They can
+    be read (and their fields set) like the dicts they replace, e.g. `entity["id"]` or `result.get("title")`, so they
+    can be mixed with dicts in the same results.
+    """
+    __slots__ = ()
+    model = None  # Name of the VCF model the record stands for
+
+    def __getitem__(self, name: str):
+        try:
+            return getattr(self, name)
+        except AttributeError:
+            raise KeyError(name)
+
+    def __setitem__(self, name: str, value):
+        setattr(self, name, value)
+
+    def get(self, name: str, default=None):
+        return getattr(self, name, default)
+
+    def keys(self):
+        """Names of the fields that are set, so that `dict(record)` (as the VCF models do) works."""
+        return self.to_json().keys()
+
+    def __eq__(self, other):
+        if isinstance(other, (CompactRecord, dict)):
+            return self.to_json() == (other.to_json() if isinstance(other, CompactRecord) else other)
+        return NotImplemented
+
+    __hash__ = None
+
+    def checked(self) -> bool:
+        """Whether everything in the record has been checked, so that it can be encoded as it is."""
+        return True
+
+    def to_json(self) -> dict:
+        """
+        The record as the dict it replaces, without None values: its public slots, in the order they are declared.
+        Records whose fields are not all held as they are encoded (e.g. attributes) override it.
+        """
+        json_dict = {}
+        for name in _public_slots(type(self)):
+            value = getattr(self, name, None)
+            if value is not None:
+                json_dict[name] = value
+        return json_dict
+
+
+@functools.lru_cache(maxsize=None)
+def _public_slots(record_type: type) -> tuple:
+    """The names of a record type's slots, base classes' first, leaving out private ones (starting with _)."""
+    return tuple(name for cls in reversed(record_type.__mro__) for name in cls.__dict__.get("__slots__", ())
+                 if not name.startswith("_"))
+
+
+class EntityRecord(CompactRecord):
+    """
+    An entity, as in Entity. Attribute names are checked against Attribute (names it does not have are left out, or
+    raise a ValueError if Attribute forbids them) and values are converted to what Attribute holds, once per set of
+    names. The names are stored once for every entity with the same set of names, and only the values per entity.
+
+    :param id: Id of the entity
+    :type id: str
+    :param type: Type of the entity, e.g. EntityPerson
+    :type type: str
+    :param attributes: Attributes of the entity, by name
+    :type attributes: dict
+    """
+    __slots__ = ("id", "type", "_names", "_values")
+    model = "Entity"
+
+    def __init__(self, id: str, type: str, attributes: dict):
+        self.id = _encode_str(id)
+        self.type = _encode_str(type)
+        self.attributes = attributes
+
+    @property
+    def attributes(self) -> dict:
+        return {name: value for name, value in zip(self._names, self._values) if value is not None}
+
+    @attributes.setter
+    def attributes(self, attributes: dict):
+        names = tuple(attributes)
+        shape = _attribute_shapes.get(names)
+        if shape is None:
+            shape = _attribute_shape(names)
+        self._names, converters = shape
+        self._values = tuple(value if value is None or type(value) is str else convert(value)
+                             for value, convert in zip(map(attributes.get, self._names), converters))
+
+    def to_json(self) -> dict:
+        return {"id": self.id, "type": self.type, "attributes": self.attributes}
+
+
+class RelationshipRecord(CompactRecord):
+    """
+    A relationship "entity" between two entities, as returned by create_relationship(), which only holds the ids and
+    title.
+
+    :param from_id: UUID of "from" entity
+    :type from_id: str
+    :param to_id: UUID of "to" entity
+    :type to_id: str
+    :param title: Description of the relationship OPTIONAL
+    :type title: str
+    """
+    __slots__ = ("id", "from_id", "to_id", "title")
+    model = "Entity"
+    type = "RelationshipRelationship"
+
+    def __init__(self, from_id: str, to_id: str, title: str = ""):
+        self.id = str(uuid.uuid3(uuid.NAMESPACE_DNS, from_id + to_id))
+        self.from_id = from_id
+        self.to_id = to_id
+        self.title = None if title is None else _encode_str(title)
+
+    @property
+    def attributes(self) -> dict:
+        attributes = {"FromId": self.from_id, "ToId": self.to_id, "Direction": "FromTo"}
+        if self.title is not None:
+            attributes["Title"] = self.title
+        return attributes
+
+    def to_json(self) -> dict:
+        return {"id": self.id, "type": self.type, "attributes": self.attributes}
+
+
+class ResultRecord(CompactRecord):
+    """
+    A search result, as in Result. Its entities can be records or dicts, and more can be appended to them.
+
+    :param key: Unique key of the result
+    :type key: str
+    :param title: Title of the result
+    :type title: str
+    :param source: Name of the source of the result
+    :type source: str
+    :param subTitle: Sub-title of the result OPTIONAL
+    :type subTitle: str
+    :param summary: Summary of the result OPTIONAL
+    :type summary: str
+    :param entities: Entities of the result OPTIONAL
+    :type entities: list
+    :param url: Link to the result at its source OPTIONAL
+    :type url: str
+    """
+    __slots__ = ("key", "title", "subTitle", "summary", "source", "entities", "url")
+    model = "Result"
+
+    def __init__(self, key: str, title: str, source: str, subTitle: Optional[str] = None,
+                 summary: Optional[str] = None, entities: Optional[list] = None, url: Optional[str] = None):
+        self.key = _encode_str(key)
+        self.title = _encode_str(title)
+        self.source = _encode_str(source)
+        self.subTitle = None if subTitle is None else _encode_str(subTitle)
+        self.summary = None if summary is None else _encode_str(summary)
+        self.entities = entities
+        self.url = None if url is None else _encode_str(url)
+
+    def checked(self) -> bool:
+        return self.entities is None or all(isinstance(entity, CompactRecord) for entity in self.entities)
+
+
+def record_json(value):
+    """Converts records to dicts for json.dumps() and orjson.dumps(), as their `default`."""
+    if isinstance(value, CompactRecord):
+        return value.to_json()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _attribute_shape(names: tuple) -> tuple:
+    """Returns the interned names of a set of attributes that Attribute has, and the function converting each one."""
+    attribute = _models["Attribute"]
+    fields = {field.alias: field for field in attribute.__fields__.values()}
+    unknown = [name for name in names if name not in fields]
+    if unknown and attribute.__config__.extra == "forbid":
+        raise ValueError(f"Attribute has no {', '.join(unknown)}")
+    kept = tuple(sys.intern(name) for name in names if name in fields)
+    converters = tuple(_encode_str if fields[name].type_ is str else _encode_any for name in kept)
+    _attribute_shapes[names] = _attribute_shapes[kept] = (kept, converters)
+    return kept, converters
+
+
+# ============================ Entity mappings ============================
+class Expr:
+    """
+    A value read from an upstream record, as given to mappings. Mappings compile their values into Python source once,
+    when they are made, so that mapping a record runs the same code as a mapping written out by hand.
+    """
+    __slots__ = ("emit",)
+
+    def __init__(self, emit: Callable):
+        self.emit = emit  # emit(compiler, record) returns the value's source, `record` being the record's variable
+
+
+def field(path: str, default=None, strip: bool = False, strict: Optional[bool] = None) -> Expr:
+    """
+    A field of the record, e.g. "countryCode.countryCodeValue" for record["countryCode"]["countryCodeValue"]. Plain
+    strings given to a mapping as values are fields.
+
+    :param path: Field names, separated by dots
+    :type path: str
+    :param default: Value used instead of a missing or empty value (as in `value or default`), a constant or an Expr
+        OPTIONAL
+    :type default: Any
+    :param strip: Whether to strip the value, which is then "" if it is missing OPTIONAL
+    :type strip: bool
+    :param strict: Whether to read the field with `record[name]`, raising KeyError if it is missing, instead of
+        `record.get(name)`; by default, as the mapping does OPTIONAL
+    :type strict: bool
+    :return: The field
+    :rtype: Expr
+    """
+    names = path.split(".")
+    if strip and default is None:
+        default = ""
+
+    def emit(compiler, record):
+        if compiler.strict if strict is None else strict:
+            source = record + "".join(f"[{name!r}]" for name in names)
+        else:
+            source = record
+            for name in names[:-1]:
+                source = f"({source}.get({name!r}) or _EMPTY)"
+            source = f"{source}.get({names[-1]!r})"
+        if default is not None:
+            source = f"({source} or {compiler.argument(default, record)})"
+        if strip:
+            source = f"{source}.strip()"
+        return source
+    return Expr(emit)
+
+
+def const(value) -> Expr:
+    """A constant value, e.g. a string that is not a field."""
+    return Expr(lambda compiler, record: compiler.constant(value))
+
+
+def join(separator: str, *values, default="") -> Expr:
+    """The values that are not empty, joined with the separator, or the default if they are all empty."""
+    def emit(compiler, record):
+        sources = "".join(f"{compiler.value(value, record)}, " for value in values)
+        return f"({separator!r}.join([_v for _v in ({sources}) if _v]) or {compiler.argument(default, record)})"
+    return Expr(emit)
+
+
+def text(template: str, *values) -> Expr:
+    """The values formatted into the template with str.format(), e.g. text("Id: {}", "id")."""
+    def emit(compiler, record):
+        return f"{template!r}.format({', '.join(compiler.value(value, record) for value in values)})"
+    return Expr(emit)
+
+
+def call(function: Callable, *values, default=None) -> Expr:
+    """
+    The result of calling the function with the values, for values that need more than the other Exprs, or the
+    default (as in field()) if the result is empty.
+    """
+    def emit(compiler, record):
+        source = f"{compiler.bind(function)}({', '.join(compiler.value(value, record) for value in values)})"
+        return source if default is None else f"({source} or {compiler.argument(default, record)})"
+    return Expr(emit)
+
+
+def one_of(value, options) -> Expr:
+    """Whether the value is one of the options."""
+    options = frozenset(options)
+    return Expr(lambda compiler, record: f"({compiler.value(value, record)} in {compiler.bind(options)})")
+
+
+def uuid_of(value) -> Expr:
+    """A UUID made from the value, which is the same every time the value is mapped."""
+    return Expr(lambda compiler, record: f"str(_uuid3(_NAMESPACE_DNS, str({compiler.value(value, record)})))")
+
+
+def new_uuid() -> Expr:
+    """A new random UUID, for records that have nothing to make one from."""
+    return Expr(lambda compiler, record: "str(_uuid4())")
+
+
+def attribute(name: str) -> Expr:
+    """An attribute of the entity being mapped, that was listed before this value, e.g. for an id made from it."""
+    return Expr(lambda compiler, record: compiler.attribute(name))
+
+
+class Cases(NamedTuple):
+    """
+    Mappings to choose from by a value of the record, e.g. an entity's type. Records whose value has no mapping, and
+    no default, are left out.
+
+    :param key: The value to choose by
+    :type key: Expr or str
+    :param mappings: Mapping for each value
+    :type mappings: dict
+    :param default: Mapping for any other value OPTIONAL
+    :type default: EntityMapping
+    """
+    key: Any
+    mappings: dict
+    default: Any = None
+
+
+class Related(NamedTuple):
+    """
+    Entities related to a result's main entity, each with a relationship from the main entity.
+
+    :param path: List of records in the result's record to map, or None to map the result's record itself
+    :type path: Expr or str
+    :param entity: The entity to map each record to
+    :type entity: EntityMapping or Cases
+    :param title: Title of the relationships, a constant or an Expr of each record; by default the entity
+        mapping's OPTIONAL
+    :type title: str or Expr
+    :param where: Only the records for which this is true are mapped OPTIONAL
+    :type where: Expr or str
+    :param limit: Most entities to map OPTIONAL
+    :type limit: int
+    """
+    path: Any
+    entity: Any
+    title: Any = None
+    where: Any = None
+    limit: Optional[int] = None
+
+
+class _MappingCompiler:
+    """Turns the values of a mapping into Python source, binding the objects it refers to in the namespace to run it."""
+
+    def __init__(self, strict: bool):
+        self.strict = strict
+        self.namespace = {"_EMPTY": MappingProxyType({}), "_EntityRecord": EntityRecord,
+                          "_RelationshipRecord": RelationshipRecord, "_ResultRecord": ResultRecord,
+                          "_uuid3": uuid.uuid3, "_uuid4": uuid.uuid4, "_NAMESPACE_DNS": uuid.NAMESPACE_DNS}
+        self.attributes = {}
+
+    def value(self, value, record: str) -> str:
+        if isinstance(value, Expr):
+            return value.emit(self, record)
+        if isinstance(value, str):
+            return field(value).emit(self, record)
+        return self.constant(value)
+
+    def argument(self, value, record: str) -> str:
+        return value.emit(self, record) if isinstance(value, Expr) else self.constant(value)
+
+    def constant(self, value) -> str:
+        if value is None or type(value) in (str, int, bool):
+            return repr(value)
+        return self.bind(value)
+
+    def bind(self, value) -> str:
+        name = f"_c{len(self.namespace)}"
+        self.namespace[name] = value
+        return name
+
+    def attribute(self, name: str) -> str:
+        if name not in self.attributes:
+            raise ValueError(f"Attribute {name} is used before it is mapped")
+        return self.attributes[name]
+
+    def compile(self, source: str, name: str) -> Callable:
+        exec(compile(source, f"<{name} mapping>", "exec"), self.namespace)
+        return self.namespace[name]
+
+
+class EntityMapping:
+    """
+    How to map an upstream record to an entity, compiled into a function when the mapping is made (so mappings are
+    best made once, when their module is imported). Calling the mapping with a record returns an EntityRecord.
+
+    :param type: Type of the entity, e.g. EntityPerson
+    :type type: str
+    :param id: Id of the entity, e.g. uuid_of("id")
+    :type id: Expr or str
+    :param attributes: Value of each attribute, by name; plain strings are fields of the record
+    :type attributes: dict
+    :param title: Title of the relationship to the entity, when it is related to a result's main entity OPTIONAL
+    :type title: str
+    :param strict: Whether fields are read with `record[name]` rather than `record.get(name)` OPTIONAL
+    :type strict: bool
+    """
+
+    def __init__(self, type: str, id, attributes: dict, title: str = "", strict: bool = False):
+        self.type = type
+        self.title = title
+        compiler = _MappingCompiler(strict)
+        lines = ["def entity(r):"]
+        for i, (name, value) in enumerate(attributes.items()):
+            lines.append(f"    a{i} = {compiler.value(value, 'r')}")
+            compiler.attributes[name] = f"a{i}"
+        values = ", ".join(f"{name!r}: {local}" for name, local in compiler.attributes.items())
+        lines.append(f"    return _EntityRecord({compiler.value(id, 'r')}, {type!r}, {{{values}}})")
+        self.code = "\n".join(lines)
+        self.map = compiler.compile(self.code, "entity")
+
+    def __call__(self, record) -> EntityRecord:
+        return self.map(record)
+
+
+class ResultMapping:
+    """
+    How to map an upstream record to a search result: its main entity, the entities related to it and the result's
+    own fields. It is compiled into a function when the mapping is made. Calling the mapping with a record returns a
+    ResultRecord, or None if the main entity's Cases leave the record out.
+
+    :param entity: The result's main entity
+    :type entity: EntityMapping or Cases
+    :param related: Entities related to the main entity, in order OPTIONAL
+    :type related: list
+    :param title: Title of the result OPTIONAL
+    :type title: Expr or str
+    :param source: Name of the source of the result OPTIONAL
+    :type source: Expr or str
+    :param key: Unique key of the result; a new UUID by default OPTIONAL
+    :type key: Expr or str
+    :param subTitle: Sub-title of the result OPTIONAL
+    :type subTitle: Expr or str
+    :param summary: Summary of the result OPTIONAL
+    :type summary: Expr or str
+    :param url: Link to the result at its source OPTIONAL
+    :type url: Expr or str
+    :param strict: Whether fields are read with `record[name]` rather than `record.get(name)` OPTIONAL
+    :type strict: bool
+    """
+
+    def __init__(self, entity, related: tuple = (), title=None, source=None, key=None, subTitle=None, summary=None,
+                 url=None, strict: bool = False):
+        compiler = _MappingCompiler(strict)
+        lines = ["def entities(r):"]
+        lines += self._map_entity(compiler, entity, "main", "r", "return None")
+        lines.append("    entities = [main]")
+        for related_entity in related:
+            lines += self._map_related(compiler, related_entity)
+        lines.append("    return entities")
+        fields = {"key": new_uuid() if key is None else key, "title": title, "source": source,
+                  "subTitle": subTitle, "summary": summary, "url": url}
+        values = ", ".join(f"{name}={compiler.value(value, 'r')}" for name, value in fields.items())
+        lines += ["", "", "def result(r):",
+                  "    entities_ = entities(r)",
+                  "    if entities_ is None:",
+                  "        return None",
+                  f"    return _ResultRecord({values}, entities=entities_)"]
+        self.code = "\n".join(lines)
+        self.map = compiler.compile(self.code, "result")
+        self.entities = compiler.namespace["entities"]
+
+    @staticmethod
+    def _map_entity(compiler: _MappingCompiler, entity, name: str, record: str, skip: str,
+                    indent: str = "    ") -> list:
+        """Source setting `name` to the entity mapped from `record`, and `title` to its mapping's title for Cases."""
+        if isinstance(entity, EntityMapping):
+            return [f"{indent}{name} = {compiler.bind(entity.map)}({record})"]
+        mappings = {value: (mapping.map, mapping.title) for value, mapping in entity.mappings.items()}
+        default = None if entity.default is None else (entity.default.map, entity.default.title)
+        return [f"{indent}mapping = {compiler.bind(mappings)}.get({compiler.value(entity.key, record)}, "
+                f"{compiler.bind(default)})",
+                f"{indent}if mapping is None:",
+                f"{indent}    {skip}",
+                f"{indent}{name}, title = mapping[0]({record}), mapping[1]"]
+
+    def _map_related(self, compiler: _MappingCompiler, related: Related) -> list:
+        items = "(r,)" if related.path is None else f"({compiler.value(related.path, 'r')} or ())"
+        lines = ["    count = 0"] if related.limit is not None else []
+        lines.append(f"    for x in {items}:")
+        if related.where is not None:
+            lines += [f"        if not {compiler.value(related.where, 'x')}:",
+                      "            continue"]
+        lines += self._map_entity(compiler, related.entity, "entity", "x", "continue", "        ")
+        if related.title is not None:
+            title = compiler.argument(related.title, "x")
+        elif isinstance(related.entity, EntityMapping):
+            title = compiler.constant(related.entity.title)
+        else:
+            title = "title"
+        lines += ["        entities.append(entity)",
+                  f"        entities.append(_RelationshipRecord(main.id, entity.id, {title}))"]
+        if related.limit is not None:
+            lines += ["        count += 1",
+                      f"        if count >= {related.limit!r}:",
+                      "            break"]
+        return lines
+
+    def __call__(self, record) -> Optional[ResultRecord]:
+        return self.map(record)
+
+    def many(self, records, limit: Optional[int] = None) -> list:
+        """
+        Maps a batch of records to results, leaving out records that are not mapped.
+
+        :param records: Upstream records
+        :type records: Iterable
+        :param limit: Most results to return OPTIONAL
+        :type limit: int
+        :return: The results
+        :rtype: list
+        """
+        return list(itertools.islice(filter(None, map(self.map, records)), limit))
+
+
+# ============================ Entity de-duplication ============================
+_dedupe_hooks = []
+
+
+def add_dedupe_hook(hook):
+    """
+    Registers a function to be called after the entities of each search's results are de-duplicated, e.g. to record
+    metrics. It is called with the searcher id, the number of entities dropped and the number of bytes of JSON saved.
+
+    :param hook: Function taking (searcher_id, entities_dropped, bytes_saved)
+    :type hook: Callable[[str, int, int], None]
+    """
+    _dedupe_hooks.append(hook)
+
+
+def dedupe_entities(results: dict, searcher_id: Optional[str] = None) -> dict:
+    """
+    Removes repeated entities from search results, in place. Videris imports the entities of each result separately,
+    so an entity repeated across results is kept in each of them, but is shared by all of them (interned) rather than
+    being held in memory once per result. Entities repeated within a result, with the same id and the same attributes,
+    are dropped.
+
+    :param results: Search results, in the form of SearchResults
+    :type results: dict
+    :param searcher_id: Id of the searcher, passed to the hooks added with add_dedupe_hook() OPTIONAL
+    :type searcher_id: str
+    :return: The same search results
+    :rtype: dict
+    """
+    interned = {}
+    dropped = []
+    for result in results.get("searchResults") or []:
+        entities = result.get("entities")
+        if not entities:
+            continue
+        kept = []
+        kept_ids = set()
+        for entity in entities:
+            entity_id = entity.get("id")
+            existing = interned.get(entity_id)
+            if existing is None:
+                interned[entity_id] = entity
+            elif existing is not entity and existing == entity:
+                entity = existing
+            if entity_id in kept_ids and any(other is entity or other == entity for other in kept):
+                dropped.append(entity)
+                continue
+            kept_ids.add(entity_id)
+            kept.append(entity)
+        result["entities"] = kept
+
+    if _dedupe_hooks:
+        # As sent to Videris, without spaces, and with the comma separating each dropped entity from the next
+        bytes_saved = sum(len(json.dumps(entity, separators=(",", ":"), default=record_json)) + 1 for entity in dropped)
+        for hook in _dedupe_hooks:
+            hook(searcher_id, len(dropped), bytes_saved)
+    return results
+
+
+# ============================ Ranking ============================
+# Weight of a match on a result's subTitle, relative to a match on its title
+RANK_SUBTITLE_WEIGHT = 0.5
+
+_ranking_unavailable = False
+
+
+def rank_results(results: dict, queries: List[str], max_results) -> dict:
+    """
+    Sorts search results, in place, by how closely their title (or, with less weight, subTitle) matches the query,
+    best first, and keeps only the best `max_results`.
+
+    :param results: Search results, in the form of SearchResults
+    :type results: dict
+    :param queries: The query, or each term of an OR query (a result is scored on the term it matches best)
+    :type queries: list(str)
+    :param max_results: Maximum number of results to keep
+    :type max_results: int
+    :return: The same search results
+    :rtype: dict
+    """
+    search_results = results.get("searchResults")
+    if search_results:
+        order = rank_order(queries, [result.get("title") for result in search_results],
+                           [result.get("subTitle") for result in search_results], max_results)
+        results["searchResults"] = [search_results[i] for i in order]
+    return results
+
+
+def rank_order(queries: List[str], titles: List[Optional[str]], subtitles: List[Optional[str]], max_results) -> list:
+    """
+    Returns the positions of the best `max_results` of a list of titles (and subTitles), best match to the query first.
+    Titles that match equally well keep their order. Every title is scored in one batch with rapidfuzz, which is only
+    needed if ranking is used; without it, the titles are left in their order.
+    """
+    global _ranking_unavailable
+    try:
+        import numpy
+        from rapidfuzz import fuzz, process, utils
+    except ImportError:
+        if not _ranking_unavailable:
+            _logger.warning("Results are not being ranked, as rapidfuzz is not installed")
+            _ranking_unavailable = True
+        return list(range(min(len(titles), int(max_results))))
+
+    options = {"scorer": fuzz.token_sort_ratio, "processor": utils.default_process, "dtype": numpy.uint8}
+    scores = process.cdist(queries, [title or "" for title in titles], **options).max(axis=0).astype(numpy.float32)
+    subtitles = [subtitle or "" for subtitle in subtitles]
+    if any(subtitles):
+        scores = numpy.maximum(scores, process.cdist(queries, subtitles, **options).max(axis=0) * RANK_SUBTITLE_WEIGHT)
+    return numpy.argsort(-scores, kind="stable")[:int(max_results)].tolist()
+
+
+# ============================ Single-flight ============================
+_in_flight_searches = {}
+_search_waiters = {}
+
+
+async def single_flight(key: tuple, search):
+    """
+    Coalesces identical concurrent searches. The first caller with a given key runs `search()`; callers arriving with
+    the same key while it is still running wait for, and share, its result instead of repeating the upstream calls.
+    The search is only cancelled if every caller waiting for it is cancelled.
+
+    :param key: Identifies the search, e.g. (searcher_id, query, max_results)
+    :type key: tuple
+    :param search: Function returning the awaitable that performs the search
+    :type search: Callable[[], Awaitable[dict]]
+    :return: The result of the search, shared by every caller with the same key
+    :rtype: dict
+    """
+    task = _in_flight_searches.get(key)
+    if task is None:
+        task = asyncio.ensure_future(search())
+        _in_flight_searches[key] = task
+        _search_waiters[task] = 0
+        task.add_done_callback(lambda done: _in_flight_searches.pop(key, None)
+                               if _in_flight_searches.get(key) is done else None)
+
+    _search_waiters[task] += 1
+    try:
+        # Shield the shared task, so that one caller being cancelled does not cancel the search for everyone else.
+        return await asyncio.shield(task)
+    except asyncio.CancelledError:
+        if _search_waiters[task] == 1:
+            task.cancel()
+        raise
+    finally:
+        _search_waiters[task] -= 1
+        if not _search_waiters[task]:
+            del _search_waiters[task]
+
+
+# ============================ Client disconnects ============================
+async def cancel_on_disconnect(request, search):
+    """
+    Runs a search, cancelling it (and so the upstream calls it is waiting on) if the client disconnects before it
+    completes, e.g. because Videris timed out or the analyst abandoned the search.
+
+    :param request: The incoming request
+    :type request: starlette.requests.Request
+    :param search: Awaitable performing the search
+    :type search: Awaitable[dict]
+    :return: The result of the search, or an error if the client disconnected
+    :rtype: dict
+    """
+    async def wait_for_disconnect():
+        while (await request.receive())["type"] != "http.disconnect":
+            pass
+
+    search = asyncio.ensure_future(search)
+    disconnect = asyncio.ensure_future(wait_for_disconnect())
+    try:
+        await asyncio.wait({search, disconnect}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        disconnect.cancel()
+        if not search.done():
+            search.cancel()
+    if not search.done() or search.cancelled():
+        # Nobody is waiting for this response any more, but the handler must still return one
+        return {"errors": [disconnect_error()]}
+    return search.result()
+
+
+def disconnect_error():
+    return {"message": "The search was cancelled because the client disconnected."}
+
+
+# ============================ Deadlines ============================
+# Videris gives up on a search after 100 seconds. Searches aim to finish within this many seconds unless the caller
+# (e.g. the VCF router) sends a shorter time limit in the DEADLINE_HEADER request header.
+DEFAULT_TIME_LIMIT = 95.0
+DEADLINE_HEADER = "X-VCF-Time-Limit"
+
+_deadline = contextvars.ContextVar("deadline", default=None)
+
+
+def set_deadline(time_limit: Optional[float] = None):
+    """
+    Sets the deadline of the current search, which is then available to everything the search calls (including
+    functions run with asyncio.to_thread).
+
+    :param time_limit: Seconds the search has left, normally taken from the DEADLINE_HEADER request header OPTIONAL
+    :type time_limit: float
+    """
+    _deadline.set(time.monotonic() + (DEFAULT_TIME_LIMIT if time_limit is None else time_limit))
+
+
+def time_remaining() -> Optional[float]:
+    """Returns the seconds left before the current search's deadline, or None if it has no deadline."""
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return max(deadline - time.monotonic(), 0.0)
+
+
+def deadline_exceeded(reserve: float = 0.0) -> bool:
+    """
+    Returns True if the current search has no more than `reserve` seconds left. Used to skip optional work (such as
+    enriching results or fetching more pages) so that the results found so far can be returned in time.
+    """
+    remaining = time_remaining()
+    return remaining is not None and remaining <= reserve
+
+
+def deadline_timeout(limit: Optional[float] = None) -> Optional[float]:
+    """Returns the timeout to use for an upstream call: `limit`, shortened to the time left before the deadline."""
+    remaining = time_remaining()
+    if remaining is None:
+        return limit
+    return remaining if limit is None else min(limit, remaining)
+
+
+def deadline_error() -> dict:
+    """The error returned alongside partial results when a search runs out of time."""
+    return {"message": "The search ran out of time, so some results may be missing or incomplete."}
+
+
+# ============================ Response cache ============================
+# Memory used by cached search results, unless config.yml sets `cache: max_bytes`. Searchers are only cached if they
+# set `cache_ttl` (seconds) in config.yml.
+DEFAULT_CACHE_MAX_BYTES = 64 * 1024 * 1024
+# Largest streamed response that is cached. A streamed response is only kept in memory, to cache it, up to this size.
+DEFAULT_STREAM_CACHE_MAX_BYTES = 1024 * 1024
+
+_cache_bypass = contextvars.ContextVar("cache_bypass", default=False)
+
+
+class ResponseCache:
+    """
+    Search results kept in memory for a limited time (TTL), so that repeating a search does not repeat the upstream
+    calls. Results are stored as JSON, which both bounds the memory used (the least recently used results are evicted
+    once the total size goes over `max_bytes`) and stops callers from modifying cached results. Safe to use from
+    synchronous handlers, which FastAPI runs in worker threads.
+    """
+    def __init__(self, max_bytes: int = DEFAULT_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.searcher_stats = {}
+        self._entries = OrderedDict()  # key: (expires, body), least recently used first
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple) -> Optional[dict]:
+        """Returns the cached results for a search, or None if they are not cached or have expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= time.monotonic():
+                self._remove(key)
+                entry = None
+            self._count(key[0], "hits" if entry is not None else "misses")
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+        return json.loads(entry[1])
+
+    def put(self, key: tuple, results: dict, ttl: float):
+        """Caches the results of a search for `ttl` seconds, evicting the least recently used results to make room."""
+        body = results_to_json(results)
+        if body is not None:
+            self.put_json(key, body, ttl)
+
+    def put_json(self, key: tuple, body: str, ttl: float):
+        """Caches the results of a search, already converted to JSON with results_to_json(), for `ttl` seconds."""
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if len(body) > self.max_bytes:
+                return
+            self._entries[key] = (time.monotonic() + ttl, body)
+            self.bytes += len(body)
+            while self.bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def clear(self, searcher_id: Optional[str] = None):
+        """Removes every cached result, or only those of one searcher."""
+        with self._lock:
+            for key in [key for key in self._entries if searcher_id is None or key[0] == searcher_id]:
+                self._remove(key)
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "entries": len(self._entries),
+                "bytes": self.bytes, "max_bytes": self.max_bytes, "searchers": self.searcher_stats}
+
+    def _remove(self, key: tuple):
+        self.bytes -= len(self._entries.pop(key)[1])
+
+    def _count(self, searcher_id: str, counter: str):
+        setattr(self, counter, getattr(self, counter) + 1)
+        stats = self.searcher_stats.setdefault(searcher_id, {"hits": 0, "misses": 0})
+        stats[counter] += 1
+
+
+response_cache = ResponseCache()
+
+
+def results_to_json(results: dict) -> Optional[str]:
+    """Converts search results to JSON for caching, or returns None if they cannot be cached."""
+    try:
+        return json.dumps(results, default=record_json)
+    except (TypeError, ValueError):
+        return None  # Not plain JSON (e.g. it holds dates), so the results could not be returned unchanged from a cache
+
+
+# ============================ Shared cache ============================
+# Prefix of the keys of cached results in the shared cache, which are `vcf:<searcher id>:<hash of the search>`
+SHARED_CACHE_PREFIX = "vcf"
+# Seconds to wait for the shared cache before carrying on without it, unless config.yml sets `cache: redis: timeout`
+DEFAULT_SHARED_CACHE_TIMEOUT = 0.5
+# Seconds the shared cache is skipped for after it fails, so that an unavailable server does not slow down searches
+SHARED_CACHE_RETRY_INTERVAL = 30
+
+
+class SharedCache:
+    """
+    Optional second cache tier, behind each app's own ResponseCache, on a server that speaks the Redis protocol. Every
+    router and adaptor configured with the same server shares it, so results fetched by one of them are returned by
+    all of them. Results are stored as zlib-compressed JSON and expire with the searcher's `cache_ttl`.
+
+    Searches carry on without the shared cache if it fails or is slow: they are treated as cache misses, and the cache
+    is not used again for SHARED_CACHE_RETRY_INTERVAL seconds.
+    """
+    def __init__(self):
+        self.url = None
+        self.timeout = DEFAULT_SHARED_CACHE_TIMEOUT
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self._client = None
+        self._retry_at = 0.0
+        self._writes = set()
+
+    def configure(self, settings: Optional[dict]):
+        """
+        Sets up the shared cache from the `cache: redis` section of an app's config.yml.
+
+        :param settings: `url` of the server, e.g. redis://cache.example.com:6379/0, and `timeout` in seconds OPTIONAL
+        :type settings: dict
+        """
+        settings = settings or {}
+        self.url = settings.get("url")
+        self.timeout = float(settings.get("timeout", DEFAULT_SHARED_CACHE_TIMEOUT))
+        self._client = None
+
+    def available(self) -> bool:
+        return bool(self.url) and time.monotonic() >= self._retry_at
+
+    @staticmethod
+    def key(key: tuple) -> str:
+        """Returns the shared cache's key for a search key from search_key()."""
+        searcher_id, query, max_results = key
+        digest = hashlib.sha256(f"{query}\n{max_results}".encode()).hexdigest()
+        return f"{SHARED_CACHE_PREFIX}:{searcher_id}:{digest}"
+
+    async def get(self, key: tuple) -> Optional[tuple]:
+        """
+        Returns the JSON of a search's cached results and the seconds until they expire, or None if they are not
+        cached or the shared cache is unavailable.
+        """
+        if not self.available():
+            return None
+        shared_key = self.key(key)
+        try:
+            async with self._get_client().pipeline(transaction=False) as pipe:
+                body, ttl = await asyncio.wait_for(pipe.get(shared_key).pttl(shared_key).execute(), self.timeout)
+            if body is not None:
+                body = zlib.decompress(body).decode()
+        except Exception as e:
+            self._failed(e)
+            return None
+        if body is None or ttl <= 0:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return body, ttl / 1000
+
+    def put_later(self, key: tuple, body: str, ttl: float):
+        """Caches the JSON of a search's results for `ttl` seconds, without making the search wait for it."""
+        if self.available():
+            write = asyncio.ensure_future(self._put(key, body, ttl))
+            # Keep a reference, so the write is not garbage collected before it finishes
+            self._writes.add(write)
+            write.add_done_callback(self._writes.discard)
+
+    async def clear(self, searcher_id: Optional[str] = None):
+        """Removes every cached result from the shared cache, or only those of one searcher."""
+        if not self.url:
+            return
+        try:
+            client = self._get_client()
+            keys = [key async for key in client.scan_iter(match=f"{SHARED_CACHE_PREFIX}:{searcher_id or '*'}:*")]
+            if keys:
+                await client.delete(*keys)
+        except Exception as e:
+            self._failed(e)
+
+    def stats(self) -> dict:
+        return {"enabled": bool(self.url), "available": self.available(), "hits": self.hits, "misses": self.misses,
+                "errors": self.errors}
+
+    async def _put(self, key: tuple, body: str, ttl: float):
+        try:
+            await asyncio.wait_for(self._get_client().set(self.key(key), zlib.compress(body.encode()),
+                                                          px=max(int(ttl * 1000), 1)), self.timeout)
+        except Exception as e:
+            self._failed(e)
+
+    def _get_client(self):
+        if self._client is None:
+            import redis.asyncio  # Only needed if a shared cache is configured
+            self._client = redis.asyncio.from_url(self.url, socket_timeout=self.timeout,
+                                                  socket_connect_timeout=self.timeout)
+        return self._client
+
+    def _failed(self, error: Exception):
+        self.errors += 1
+        if time.monotonic() >= self._retry_at:
+            _logger.warning("Shared cache unavailable, retrying in %ss: %r", SHARED_CACHE_RETRY_INTERVAL, error)
+        self._retry_at = time.monotonic() + SHARED_CACHE_RETRY_INTERVAL
+
+
+shared_cache = SharedCache()
+
+
+_stream_cache_max_bytes = DEFAULT_STREAM_CACHE_MAX_BYTES
+
+
+def configure_cache(config: dict):
+    """Sizes the response cache, and sets up the shared cache, from the `cache` section of an app's config.yml."""
+    cache = config.get("cache") or {}
+    global _stream_cache_max_bytes
+    response_cache.max_bytes = int(cache.get("max_bytes", DEFAULT_CACHE_MAX_BYTES))
+    _stream_cache_max_bytes = int(cache.get("stream_max_bytes", DEFAULT_STREAM_CACHE_MAX_BYTES))
+    shared_cache.configure(cache.get("redis"))
+
+
+def cache_stats() -> dict:
+    """Hit and miss counts, and the size, of the response cache and (if one is set up) the shared cache."""
+    return {**response_cache.stats(), "shared": shared_cache.stats()}
+
+
+async def clear_caches(searcher_id: Optional[str] = None):
+    """Removes every cached result, or only those of one searcher, from the response cache and the shared cache."""
+    response_cache.clear(searcher_id)
+    await shared_cache.clear(searcher_id)
+
+
+def search_key(searcher_id: str, query: str, max_results) -> tuple:
+    """
+    Identifies a search for caching and coalescing. Queries differing only in surrounding or repeated whitespace are
+    the same search. Case is kept, as some searches (e.g. wallet addresses) are case-sensitive.
+    """
+    return searcher_id, " ".join(query.split()), str(max_results)
+
+
+def set_cache_bypass(cache_control: Optional[str]):
+    """Skips cached results for the current search if the caller sent a `Cache-Control: no-cache` header."""
+    _cache_bypass.set("no-cache" in (cache_control or "").lower())
+
+
+def cache_bypassed() -> bool:
+    """Returns True if the current search should skip cached results."""
+    return _cache_bypass.get()
+
+
+def cache_headers() -> dict:
+    """Headers that pass a cache bypass on to the adaptors the current search is sent to."""
+    return {"Cache-Control": "no-cache"} if cache_bypassed() else {}
+
+
+async def cached_search(searcher_id: str, query: str, max_results, ttl: Optional[float], search):
+    """
+    Returns a search's cached results if it has any, in the app's own cache or else the shared cache, and otherwise
+    runs `search()` (sharing it with identical searches already in progress), removes repeated entities from its
+    results and caches them for `ttl` seconds. Results with errors are not cached, and neither is anything if `ttl` is
+    not set.
+
+    :param searcher_id: Id of the searcher
+    :type searcher_id: str
+    :param query: Query entered by the analyst
+    :type query: str
+    :param max_results: Maximum number of results requested
+    :type max_results: int
+    :param ttl: Seconds to cache the results for OPTIONAL
+    :type ttl: float
+    :param search: Function returning the awaitable that performs the search
+    :type search: Callable[[], Awaitable[dict]]
+    :return: The results of the search
+    :rtype: dict
+    """
+    key = search_key(searcher_id, query, max_results)
+    if ttl and not cache_bypassed():
+        results = response_cache.get(key)
+        if results is not None:
+            return results
+
+    async def search_and_cache():
+        if ttl and not cache_bypassed():
+            cached = await shared_cache.get(key)
+            if cached is not None:
+                body, remaining = cached
+                response_cache.put_json(key, body, remaining)
+                return json.loads(body)
+
+        results = await search()
+        if isinstance(results, dict):
+            dedupe_entities(results, searcher_id)
+        if ttl and isinstance(results, dict) and not results.get("errors") and not results.get("error"):
+            body = results_to_json(results)
+            if body is not None:
+                response_cache.put_json(key, body, ttl)
+                shared_cache.put_later(key, body, ttl)
+        return results
+
+    return await single_flight(key, search_and_cache)
+
+
+# ============================ Response encoding ============================
+# Set to 1 to check every response against the VCF models (as config.yml's `validate_responses: True` does)
+VALIDATE_RESPONSES_ENV = "VCF_VALIDATE_RESPONSES"
+
+_response_encoders = {}
+
+
+def validate_responses() -> bool:
+    """Whether responses are checked against the VCF models, which is slower and only needed to debug an adaptor."""
+    registry = get_registry()
+    if registry is not None and registry.config.get("validate_responses"):
+        return True
+    return os.environ.get(VALIDATE_RESPONSES_ENV, "").lower() in ("1", "true", "yes")
+
+
+def results_response(results):
+    """
+    Returns search results as a response that is sent without building the VCF models, once encode_results() has
+    checked them. Results that fail its checks, or all results if validate_responses() is on, are returned unchanged
+    for FastAPI to check against the endpoint's response_model, so that invalid results are reported exactly as
+    before.
+
+    :param results: Results of a search
+    :type results: dict
+    :return: The results, encoded as JSON
+    :rtype: fastapi.responses.Response
+    """
+    if not isinstance(results, dict) or validate_responses():
+        return results
+    body = encode_results(results)
+    if body is None:
+        return results
+    return Response(body, media_type="application/json")
+
+
+class InvalidResults(ValueError):
+    """Raised by model encoders when results may not be valid for the model, which only the model itself can tell."""
+
+
+def encode_results(results: dict, model=None) -> Optional[bytes]:
+    """
+    Checks search results against `model` and converts them straight to JSON, as FastAPI would with
+    `response_model_exclude_none=True`, but without building the models. Keys the models do not have, and None values,
+    are left out, and values of text fields are converted to text. Uses orjson if it is installed.
+
+    The checks are cheaper than the models' own (e.g. attribute names are looked up in a set of the names Attribute
+    has): results that pass them are valid, but results that fail them may still be valid if pydantic can convert them.
+
+    :param results: Results of a search
+    :type results: dict
+    :param model: Model the results are returned as, if not the app's SearchResults OPTIONAL
+    :type model: pydantic.BaseModel
+    :return: The results as JSON, or None if they failed the checks or cannot be converted (e.g. they hold values that
+        are not JSON)
+    :rtype: bytes
+    """
+    try:
+        return json_bytes(model_encoder(model or _models["SearchResults"])(results))
+    except (TypeError, ValueError):  # Including InvalidResults
+        return None
+
+
+def json_bytes(value) -> bytes:
+    """
+    Converts a value (which may hold records) to compact JSON, with orjson if it is installed.
+
+    :raises TypeError: If the value holds something that is not JSON
+    :raises ValueError: If the value holds something that is not JSON
+    """
+    try:
+        import orjson
+    except ImportError:
+        return json.dumps(value, ensure_ascii=False, allow_nan=False, separators=(",", ":"),
+                          default=record_json).encode("utf-8")
+    return orjson.dumps(value, default=record_json)
+
+
+def model_encoder(model) -> Callable[[dict], dict]:
+    """
+    Returns a function converting a dict into what `model(**dict).dict(by_alias=True, exclude_none=True)` returns, or
+    raising InvalidResults if the model might reject it. Records (see CompactRecord) are returned as they are, as they
+    were checked when they were made. The function is built once per model.
+    """
+    encoder = _response_encoders.get(model)
+    if encoder is not None:
+        return encoder
+
+    fields = {}
+    names = frozenset(field.alias for field in model.__fields__.values())
+    required = tuple(field.alias for field in model.__fields__.values() if field.required)
+    # Fields that text is not valid for, which are skipped over below
+    not_text = tuple(field.alias for field in model.__fields__.values()
+                     if field.type_ is not str and field.type_ is not Any
+                     or getattr(field.outer_type_, "__origin__", None) is list)
+    forbid_extra = model.__config__.extra == "forbid"
+
+    def encode(value):
+        if isinstance(value, CompactRecord):
+            if value.model != model.__name__:
+                raise InvalidResults(model.__name__)
+            if value.checked():
+                return value  # Checked when the record was made, and encoded by record_json()
+            value = value.to_json()
+        if not isinstance(value, dict):
+            raise InvalidResults(model.__name__)
+        if forbid_extra and not value.keys() <= names:
+            raise InvalidResults(model.__name__)
+        for name in required:
+            if value.get(name) is None:
+                raise InvalidResults(model.__name__)
+        for name in not_text:
+            if type(value.get(name)) is str:
+                raise InvalidResults(model.__name__)
+        # Most values are text, which every field returns unchanged, so the field's function is only called for others
+        return {key: item if type(item) is str else fields[key](item)
+                for key, item in value.items() if item is not None and key in fields}
+
+    # Stored before the fields are filled in, in case a model refers to itself
+    _response_encoders[model] = encode
+    fields.update((field.alias, _field_encoder(field)) for field in model.__fields__.values())
+    return encode
+
+
+def _field_encoder(field) -> Callable:
+    """Returns a function converting a value of a model's field."""
+    if isinstance(field.type_, type) and issubclass(field.type_, BaseModel):
+        encode = model_encoder(field.type_)
+    elif field.type_ is str:
+        encode = _encode_str
+    else:
+        encode = _encode_any
+    if getattr(field.outer_type_, "__origin__", None) is list:
+        return functools.partial(_encode_list, encode)
+    return encode
+
+
+def _encode_list(encode: Callable, value):
+    if not isinstance(value, (list, tuple)):
+        raise InvalidResults("list")
+    return [encode(item) for item in value]
+
+
+def _encode_str(value):
+    # The same conversions as pydantic's str fields
+    if isinstance(value, str):
+        return value.value if isinstance(value, Enum) else value
+    if isinstance(value, (int, float, Decimal)):
+        return str(value)
+    if isinstance(value, (bytes, bytearray)):
+        try:
+            return value.decode()
+        except UnicodeDecodeError:
+            raise InvalidResults("str")
+    raise InvalidResults("str")
+
+
+def _encode_any(value):
+    # Like FastAPI, None values are also left out of dicts in fields that can hold anything
+    if isinstance(value, dict):
+        return {key: _encode_any(item) for key, item in value.items() if item is not None}
+    if isinstance(value, (list, tuple)):
+        return [_encode_any(item) for item in value]
+    if isinstance(value, Decimal):
+        return float(value)
+    return value
+
+
+# ============================ Streamed results ============================
+class ErrorRecord(CompactRecord):
+    """An error, as in Error, yielded by a streamed search among its results."""
+    __slots__ = ("message",)
+    model = "Error"
+
+    def __init__(self, message: str):
+        self.message = _encode_str(message)
+
+
+class SearchFailed(Exception):
+    """Raised by a streamed search, before it yields anything, if it cannot return any results."""
+    def __init__(self, errors: List[dict]):
+        super().__init__(errors)
+        self.errors = errors
+
+
+async def collect_results(stream) -> dict:
+    """
+    Runs a streamed search to the end and returns its results, as a search that is not streamed would.
+
+    :param stream: Async generator yielding the search's results, and an ErrorRecord for each error
+    :type stream: AsyncIterator
+    :return: The results, or the errors under `error` if the search raised SearchFailed
+    :rtype: dict
+    """
+    search_results = []
+    errors = []
+    try:
+        async for item in stream:
+            (errors if isinstance(item, ErrorRecord) else search_results).append(item)
+    except SearchFailed as e:
+        return {"error": e.errors}
+    if errors:
+        return {"searchResults": search_results, "errors": errors}
+    return {"searchResults": search_results}
+
+
+async def stream_results(searcher_id: str, query: str, max_results, ttl: Optional[float], search):
+    """
+    Returns a streamed search's results as a response that sends each result as soon as the search yields it, so the
+    first results reach the client sooner and results do not pile up in memory. Cached results are returned as they
+    are (to be passed to results_response()), and results are cached once the whole search has been sent, if `ttl`
+    is set and the response is no larger than the cache section's `stream_max_bytes`: the response is kept in memory
+    until then, and dropped as soon as it grows past that size. Streamed searches are not shared with identical
+    searches in progress. When validate_responses() is on,
+    the search is collected with collect_results() instead, for FastAPI to check.
+
+    Results are checked like encode_results() checks them. As the response has started by then, a result that is
+    not valid is left out, and pydantic's error for it is added to the errors at the end of the response. Likewise, if
+    the search raises an exception after its first result, the results sent so far are followed by an error, so the
+    response is always whole JSON.
+
+    :param searcher_id: Id of the searcher
+    :type searcher_id: str
+    :param query: Query entered by the analyst
+    :type query: str
+    :param max_results: Maximum number of results requested
+    :type max_results: int
+    :param ttl: Seconds to cache the results for OPTIONAL
+    :type ttl: float
+    :param search: Function returning the search's async generator, which yields its results and an ErrorRecord for
+        each error, or raises SearchFailed before yielding anything
+    :type search: Callable[[], AsyncIterator]
+    :return: The response, or the search's results or errors (under `error`) as a dict
+    :rtype: fastapi.responses.StreamingResponse
+    """
+    key = search_key(searcher_id, query, max_results)
+    if ttl and not cache_bypassed():
+        results = response_cache.get(key)
+        if results is not None:
+            return results
+        cached = await shared_cache.get(key)
+        if cached is not None:
+            body, remaining = cached
+            response_cache.put_json(key, body, remaining)
+            return json.loads(body)
+
+    stream = search()
+    if validate_responses():
+        return await collect_results(stream)
+    try:
+        # Only the first result is waited for here, so that a search that fails outright is still reported as before
+        first = await stream.__anext__()
+    except StopAsyncIteration:
+        results = {"searchResults": []}
+        if ttl:
+            _cache_streamed(key, results_to_json(results), ttl)
+        return results
+    except SearchFailed as e:
+        return {"error": e.errors}
+
+    parts = [] if ttl else None  # The response so far, kept to cache it
+    size = 0
+
+    def sent(part: bytes) -> bytes:
+        nonlocal parts, size
+        if parts is not None:
+            size += len(part)
+            if size > _stream_cache_max_bytes:
+                parts = None  # Too large to cache, so not kept any longer
+            else:
+                parts.append(part)
+        return part
+
+    async def body():
+        errors = []
+        separator = b""
+        try:
+            yield sent(b'{"searchResults":[')
+            item = first
+            while item is not None:
+                if isinstance(item, ErrorRecord):
+                    errors.append(item)
+                else:
+                    dedupe_entities({"searchResults": [item]}, searcher_id)
+                    encoded = _encode_result(item, errors)
+                    if encoded is not None:
+                        yield sent(separator + encoded)
+                        separator = b","
+                item = await stream.__anext__()
+        except StopAsyncIteration:
+            pass
+        except SearchFailed as e:
+            # The response has started, so errors raised part way through are sent after the results already sent
+            errors += [ErrorRecord(error.get("message", "")) for error in e.errors]
+        except Exception as e:
+            _logger.exception("Streamed search of %s failed part way through", searcher_id)
+            errors.append(ErrorRecord(f"The search failed part way through, so some results are missing: {e!r}"))
+        finally:
+            await stream.aclose()
+        if errors:
+            yield sent(b'],"errors":' + json_bytes([error.to_json() for error in errors]) + b"}")
+        else:
+            yield sent(b"]}")
+            if parts is not None:
+                _cache_streamed(key, b"".join(parts).decode("utf-8"), ttl)
+
+    return StreamingResponse(body(), media_type="application/json")
+
+
+def _cache_streamed(key: tuple, body: str, ttl: float):
+    response_cache.put_json(key, body, ttl)
+    shared_cache.put_later(key, body, ttl)
+
+
+def _encode_result(result, errors: list) -> Optional[bytes]:
+    """Converts one result to JSON, or adds pydantic's error for it to `errors` and returns None if it is not valid."""
+    try:
+        return json_bytes(model_encoder(_models["Result"])(result))
+    except (TypeError, ValueError):
+        pass
+    try:
+        # Only pydantic can tell whether the result is valid after all, once it has converted it
+        model = _models["Result"].parse_obj(result.to_json() if isinstance(result, CompactRecord) else result)
+        return json_bytes(model.dict(by_alias=True, exclude_none=True))
+    except ValidationError as e:
+        errors.append(ErrorRecord(f"Result left out: {e}"))
+    except (TypeError, ValueError) as e:
+        errors.append(ErrorRecord(f"Result left out: {e!r}"))
+    return None
+
+
+# ============================ Response compression ============================
+# Settings of config.yml's `compression` section, for any it leaves out
+DEFAULT_COMPRESSION = {"enabled": True, "min_size": 1024, "gzip_level": 6, "brotli_level": 4}
+# Content types that are compressed, by their start
+COMPRESSIBLE_TYPES = (b"application/json", b"text/")
+
+
+class CompressionMiddleware:
+    """
+    Compresses responses with brotli (if the brotli package is installed) or gzip, whichever the client prefers in
+    its Accept-Encoding header, as set in config.yml's `compression` section. Responses smaller than `min_size` bytes,
+    that are not JSON or text, or that are already compressed (e.g. passed through from an adaptor) are sent as they
+    are. Streamed responses are compressed as they are streamed, each part being sent as soon as it is compressed.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        settings = compression_settings()
+        accept_encoding = next((value for name, value in scope["headers"] if name == b"accept-encoding"), b"")
+        encoding = choose_encoding(accept_encoding.decode("latin-1")) if settings["enabled"] else None
+        if encoding is None:
+            return await self.app(scope, receive, send)
+        await self.app(scope, receive, _CompressingSend(send, encoding, settings).send)
+
+
+class _CompressingSend:
+    """Wraps an ASGI `send`, compressing the response body it is given if the response should be compressed."""
+    def __init__(self, send, encoding: str, settings: dict):
+        self._send = send
+        self.encoding = encoding
+        self.settings = settings
+        self.start = None
+        self.compressor = None
+        self.compressing = None  # Decided on the first part of the body
+
+    async def send(self, message: dict):
+        if message["type"] == "http.response.start":
+            self.start = message  # Held back until it is known whether the body is compressed
+            return
+        if message["type"] != "http.response.body" or self.compressing is False:
+            return await self._send(message)
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if self.compressing is None:
+            headers = self.start.get("headers", [])
+            content_type = next((value for name, value in headers if name.lower() == b"content-type"), b"")
+            self.compressing = (not any(name.lower() == b"content-encoding" for name, value in headers)
+                                and content_type.lower().startswith(COMPRESSIBLE_TYPES)
+                                and (more_body or len(body) >= self.settings["min_size"]))
+            if not self.compressing:
+                await self._send(self.start)
+                return await self._send(message)
+            self.compressor = make_compressor(self.encoding, self.settings)
+
+        body = self.compressor(body, more_body)
+        if self.start is not None:
+            headers = [(name, value) for name, value in self.start.get("headers", [])
+                       if name.lower() not in (b"content-length", b"vary")]
+            headers += [(b"content-encoding", self.encoding.encode()), (b"vary", b"Accept-Encoding")]
+            if not more_body:
+                headers.append((b"content-length", str(len(body)).encode()))
+            await self._send({**self.start, "headers": headers})
+            self.start = None
+        await self._send({"type": "http.response.body", "body": body, "more_body": more_body})
+
+
+def compression_settings() -> dict:
+    """The `compression` section of config.yml, with the defaults of any settings it leaves out."""
+    registry = get_registry()
+    settings = registry.config.get("compression") if registry is not None else None
+    return {**DEFAULT_COMPRESSION, **(settings or {})}
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """
+    Returns the content encoding to compress a response with ("br" or "gzip"), as preferred by an Accept-Encoding
+    header, or None if the response should not be compressed. Brotli is only offered if it is installed.
+
+    :param accept_encoding: Accept-Encoding header of the request, e.g. "gzip, br;q=0.9"
+    :type accept_encoding: str
+    :return: Content encoding, or None
+    :rtype: str
+    """
+    supported = ("br", "gzip") if _brotli() is not None else ("gzip",)
+    best = None
+    best_quality = 0.0
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        name = name.strip().lower()
+        if name not in supported:
+            continue
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        # Brotli is listed first, so it is chosen over gzip when both are equally preferred
+        if quality > best_quality or (quality == best_quality and best is not None
+                                      and supported.index(name) < supported.index(best)):
+            best = name
+            best_quality = quality
+    return best
+
+
+def make_compressor(encoding: str, settings: dict) -> Callable[[bytes, bool], bytes]:
+    """Returns a function compressing each part of a body in turn, called with the part and whether more will follow."""
+    if encoding == "br":
+        brotli = _brotli()
+        compressor = brotli.Compressor(quality=settings["brotli_level"])
+
+        def compress(body: bytes, more_body: bool) -> bytes:
+            return compressor.process(body) + (compressor.flush() if more_body else compressor.finish())
+    else:
+        compressor = zlib.compressobj(settings["gzip_level"], zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+        def compress(body: bytes, more_body: bool) -> bytes:
+            return compressor.compress(body) + compressor.flush(zlib.Z_SYNC_FLUSH if more_body else zlib.Z_FINISH)
+    return compress
+
+
+def _brotli():
+    """The brotli module, or None if it is not installed."""
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli
+
+
+# ============================ Logging ============================
+LOGGER_NAME = "vcf"
+LOG_LEVELS = {"DEBUG": logging.DEBUG, "INFO": logging.INFO, "WARNING": logging.WARNING, "ERROR": logging.ERROR}
+DEFAULT_LOGGING = {"level": "INFO", "sample": 1.0, "payloads": False, "format": "json", "queue_size": 10000}
+# Attributes every log record has, which are left out of the fields of structured log lines
+_RECORD_ATTRIBUTES = frozenset(logging.makeLogRecord({}).__dict__) | {"message", "asctime", "searcher", "payload"}
+
+
+class LogSettings(NamedTuple):
+    """
+    The `logging` section of an app's config.yml, parsed and checked.
+
+    :ivar level: Level of the messages logged, for searchers that do not set their own
+    :ivar sample: Fraction of searches whose messages below WARNING are logged, for searchers that do not set their own
+    :ivar payloads: Whether large payloads (e.g. whole API responses) are logged, at DEBUG
+    :ivar format: `json` for a JSON object per line, or `text`
+    :ivar queue_size: Most messages waiting to be written, after which messages are dropped
+    :ivar searchers: (level, sample) of each searcher that sets its own in its `logging` section
+    """
+    level: int
+    sample: float
+    payloads: bool
+    format: str
+    queue_size: int
+    searchers: Mapping
+
+    def for_searcher(self, searcher_id: Optional[str]) -> tuple:
+        return self.searchers.get(searcher_id, (self.level, self.sample))
+
+
+# Searcher of the current search, and whether its messages below WARNING are logged (see set_log_searcher())
+_log_searcher = contextvars.ContextVar("vcf_log_searcher", default=(None, True))
+_logger = logging.getLogger(LOGGER_NAME)
+_log_settings: Optional[LogSettings] = None
+_log_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def get_logger(name: str) -> logging.Logger:
+    """
+    Returns an app's logger, e.g. get_logger("grid"). Messages are filtered, by the searcher of the current search,
+    in the thread logging them, and written by a background thread, so logging never waits on the terminal or file
+    being written to. Pass values as arguments (`logger.debug("Request %s", url)`) rather than formatting them into
+    the message: they are only formatted, on the background thread, if the message is logged.
+    """
+    return logging.getLogger(f"{LOGGER_NAME}.{name}")
+
+
+def log_payload(logger: logging.Logger, message: str, payload):
+    """
+    Logs a large payload (e.g. a whole API response) at DEBUG, only if `payloads: True` is set in the `logging` section
+    of config.yml. The payload is converted to text on the background thread, so it must not be changed afterwards.
+    """
+    if _log_settings is not None and _log_settings.payloads and logger.isEnabledFor(logging.DEBUG):
+        logger.debug(message + ": %s", payload, extra={"payload": True})
+
+
+def set_log_searcher(searcher_id: Optional[str]):
+    """
+    Sets the searcher of the current search, by which its messages are filtered, and decides whether the search is
+    in the searcher's sample, so that a search's messages are logged all together or not at all.
+    """
+    _, sample = (_log_settings or parse_logging({})).for_searcher(searcher_id)
+    _log_searcher.set((searcher_id, sample >= 1 or random.random() < sample))
+
+
+def parse_logging(config: Mapping) -> LogSettings:
+    """
+    Parses the `logging` section of an app's config.yml, and the `logging` sections of its searchers.
+
+    :raises ConfigError: If a level or sample is not valid
+    """
+    settings = {**DEFAULT_LOGGING, **(config.get("logging") or {})}
+    searchers = {}
+    for searcher_id, searcher in (config.get("searchers") or {}).items():
+        if isinstance(searcher, Mapping) and searcher.get("logging"):
+            override = searcher["logging"]
+            searchers[searcher_id] = (_log_level(override.get("level", settings["level"])),
+                                      _log_sample(override.get("sample", settings["sample"])))
+    if settings["format"] not in ("json", "text"):
+        raise ConfigError("logging format must be json or text")
+    return LogSettings(_log_level(settings["level"]), _log_sample(settings["sample"]), bool(settings["payloads"]),
+                       settings["format"], int(settings["queue_size"]), MappingProxyType(searchers))
+
+
+def _log_level(level) -> int:
+    if str(level).upper() not in LOG_LEVELS:
+        raise ConfigError(f"Log level {level} must be one of {', '.join(LOG_LEVELS)}")
+    return LOG_LEVELS[str(level).upper()]
+
+
+def _log_sample(sample) -> float:
+    if not isinstance(sample, (int, float)) or not 0 <= sample <= 1:
+        raise ConfigError(f"Log sample {sample} must be between 0 and 1")
+    return float(sample)
+
+
+def configure_logging(settings: LogSettings):
+    """
+    Applies the logging settings of an app's config.yml. The first call starts the background thread writing log
+    messages to stderr, which writes any messages still waiting when the app exits.
+    """
+    global _log_settings, _log_listener
+    _log_settings = settings
+    # The loggers only create messages at the lowest level any searcher logs at; _SearcherFilter does the rest
+    _logger.setLevel(min([settings.level] + [level for level, _ in settings.searchers.values()]))
+    _logger.propagate = False
+    formatter = JsonLogFormatter() if settings.format == "json" else logging.Formatter(
+        "%(asctime)s %(levelname)s %(name)s [%(searcher)s] %(message)s")
+    if _log_listener is None:
+        handler = logging.StreamHandler(sys.stderr)
+        _log_listener = logging.handlers.QueueListener(queue.Queue(settings.queue_size), handler)
+        _logger.addHandler(_LogQueueHandler(_log_listener.queue))
+        _log_listener.start()
+        atexit.register(_stop_logging)
+    for handler in _log_listener.handlers:
+        handler.setFormatter(formatter)
+
+
+def _stop_logging():
+    """Writes the log messages still waiting, when the app exits."""
+    try:
+        _log_listener.stop()
+    except queue.Full:
+        pass  # The background thread is a daemon thread, so it does not keep the app running
+
+
+def log_stats() -> dict:
+    """Number of log messages dropped because the background thread could not keep up."""
+    return {"dropped": sum(getattr(handler, "dropped", 0) for handler in _logger.handlers)}
+
+
+class _LogQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queues log messages for the background thread without formatting them, dropping them if the queue is full rather
+    than waiting. Messages are filtered here, in the thread logging them, by the current search's searcher.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self.addFilter(_filter_log_record)
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record  # Formatted by the background thread instead
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def _filter_log_record(record: logging.LogRecord) -> bool:
+    searcher_id, sampled = _log_searcher.get()
+    record.searcher = searcher_id
+    if getattr(record, "payload", False) and not (_log_settings and _log_settings.payloads):
+        return False
+    if record.levelno >= logging.WARNING:
+        return True
+    level, _ = _log_settings.for_searcher(searcher_id) if _log_settings else (logging.INFO, 1.0)
+    return sampled and record.levelno >= level
+
+
+class JsonLogFormatter(logging.Formatter):
+    """Formats log messages as a JSON object per line, with the fields passed in `extra` as well as the message."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = {"time": datetime.fromtimestamp(record.created).isoformat(), "level": record.levelname,
+                "logger": record.name, "searcher": getattr(record, "searcher", None), "message": record.getMessage()}
+        line.update((name, value) for name, value in record.__dict__.items() if name not in _RECORD_ATTRIBUTES)
+        if record.exc_info:
+            line["exception"] = self.formatException(record.exc_info)
+        return json.dumps(line, default=str)
+
+
+# ============================ Event loop watchdog ============================
+DEFAULT_WATCHDOG = {"enabled": True, "threshold_ms": 100, "stalls_kept": 20}
+WATCHDOG_INTERVAL = 0.05  # Seconds between the heartbeats the watchdog checks for
+WATCHDOG_LAGS_KEPT = 1200  # Heartbeats whose lag is kept for the lag percentiles (a minute of them)
+WATCHDOG_STACK_LIMIT = 40  # Innermost frames kept of each stack
+
+
+class LoopWatchdog:
+    """
+    Finds code that blocks the event loop, such as a blocking `requests` call in an async function, which holds up
+    every other search in the app while it runs. A heartbeat task on the loop measures how late the loop wakes it up
+    (the loop's lag), and a thread checks that the heartbeat keeps running: if it has not run for `threshold_ms`, the
+    loop is blocked, and the thread records the stack of the loop's thread, which shows the code blocking it.
+    """
+
+    def __init__(self):
+        self.enabled = DEFAULT_WATCHDOG["enabled"]
+        self.threshold_ms = DEFAULT_WATCHDOG["threshold_ms"]
+        self.lags = collections.deque(maxlen=WATCHDOG_LAGS_KEPT)
+        self.stalls = collections.deque(maxlen=DEFAULT_WATCHDOG["stalls_kept"])
+        self.stall_count = 0
+        self.blocked_ms = 0.0
+        self.max_lag_ms = 0.0
+        self._beat = time.monotonic()
+        self._stall: Optional[dict] = None  # The stall in progress, once its stack has been recorded
+        self._loop_thread: Optional[int] = None
+        self._loop = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopped = threading.Event()
+
+    def configure(self, settings: Mapping):
+        """Applies watchdog settings, as returned by parse_watchdog()."""
+        self.enabled = settings["enabled"]
+        self.threshold_ms = settings["threshold_ms"]
+        if self.stalls.maxlen != settings["stalls_kept"]:
+            self.stalls = collections.deque(self.stalls, maxlen=settings["stalls_kept"])
+
+    def start(self):
+        """Starts watching the running event loop. Call from the app's startup event."""
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stopped = stopped = threading.Event()
+        self._task = asyncio.create_task(self._heartbeat())
+        threading.Thread(target=self._watch, args=(stopped,), name="vcf-loop-watchdog", daemon=True).start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _heartbeat(self):
+        while True:
+            started = self._beat = time.monotonic()
+            await asyncio.sleep(WATCHDOG_INTERVAL)
+            lag_ms = max(0.0, (time.monotonic() - started - WATCHDOG_INTERVAL) * 1000)
+            self.lags.append(lag_ms)
+            self.max_lag_ms = max(self.max_lag_ms, lag_ms)
+            stall, self._stall = self._stall, None
+            if stall is not None:
+                stall["blocked_ms"] = round(lag_ms, 1)
+                self.blocked_ms += lag_ms
+                _logger.warning("Event loop blocked for %.0f ms by %s", lag_ms, stall["task"],
+                                extra={"stack": stall["stack"]})
+
+    def _watch(self, stopped: threading.Event):
+        while not stopped.wait(min(WATCHDOG_INTERVAL, self.threshold_ms / 4000)):
+            blocked_ms = (time.monotonic() - self._beat - WATCHDOG_INTERVAL) * 1000
+            if self.enabled and self._stall is None and blocked_ms > self.threshold_ms:
+                self._record_stall()
+
+    def _record_stall(self):
+        """Records the stack of the loop's thread, while it is blocked. Runs on the watchdog's thread."""
+        frame = sys._current_frames().get(self._loop_thread)
+        if frame is None:
+            return
+        stack = traceback.format_list(traceback.extract_stack(frame, limit=WATCHDOG_STACK_LIMIT))
+        task = asyncio.current_task(self._loop)
+        self._stall = {"time": datetime.now().isoformat(), "blocked_ms": None,
+                       "task": task.get_name() if task is not None else None,
+                       "coroutine": getattr(task.get_coro(), "__qualname__", None) if task is not None else None,
+                       "stack": [line.rstrip("\n") for line in stack]}
+        self.stalls.append(self._stall)
+        self.stall_count += 1
+
+    def stats(self, stacks: bool = True) -> dict:
+        """
+        The loop's lag (percentiles over the last minute, and the most since the app started), how many times and for
+        how long in all it was blocked for longer than `threshold_ms`, and the stacks recorded of the last stalls.
+        """
+        lags = sorted(self.lags)
+        stats = {
+            "lag_ms": {"p50": _percentile(lags, 50), "p99": _percentile(lags, 99), "max": round(self.max_lag_ms, 1)},
+            "threshold_ms": self.threshold_ms,
+            "stalls": self.stall_count,
+            "blocked_ms": round(self.blocked_ms, 1),
+        }
+        if stacks:
+            stats["recent_stalls"] = list(self.stalls)[::-1]
+        return stats
+
+
+def _percentile(values: list, percentile: float) -> Optional[float]:
+    if not values:
+        return None
+    return round(values[min(len(values) - 1, int(len(values) * percentile / 100))], 1)
+
+
+def parse_watchdog(config: Mapping) -> dict:
+    """
+    Parses the `watchdog` section of an app's config.yml, filling in DEFAULT_WATCHDOG for anything it leaves out.
+
+    :raises ConfigError: If the section is not valid
+    """
+    settings = {**DEFAULT_WATCHDOG, **(config.get("watchdog") or {})}
+    if not isinstance(settings["enabled"], bool):
+        raise ConfigError("Watchdog must be enabled: True or False")
+    if not isinstance(settings["threshold_ms"], (int, float)) or settings["threshold_ms"] <= 0:
+        raise ConfigError(f"Watchdog threshold_ms {settings['threshold_ms']} must be a positive number")
+    if not isinstance(settings["stalls_kept"], int) or settings["stalls_kept"] < 1:
+        raise ConfigError(f"Watchdog stalls_kept {settings['stalls_kept']} must be at least 1")
+    return {"enabled": settings["enabled"], "threshold_ms": float(settings["threshold_ms"]),
+            "stalls_kept": settings["stalls_kept"]}
+
+
+loop_watchdog = LoopWatchdog()
+
+
+def start_watchdog() -> LoopWatchdog:
+    """Starts the event loop watchdog on the running loop. Call from the app's startup event."""
+    loop_watchdog.start()
+    return loop_watchdog
+
+
+def loop_stats() -> dict:
+    """The event loop's lag, and the stalls the watchdog has found, with the stacks of the code blocking the loop."""
+    return loop_watchdog.stats()
+
+
+# ============================ Searcher registry ============================
+CONFIG_PATH = "config.yml"
+# Seconds between checks of config.yml for changes
+CONFIG_CHECK_INTERVAL = 2.0
+
+
+class ConfigError(ValueError):
+    """Raised when config.yml is not valid."""
+
+
+class Registry(NamedTuple):
+    """
+    config.yml, parsed and validated once. Replaced as a whole (never modified) when config.yml changes, so each search
+    sees one version of it throughout.
+
+    :ivar config: Read-only copy of config.yml
+    :ivar searchers: The enabled searchers, as returned by the /searchers/ endpoint
+    :ivar handlers: Function carrying out the searches of each enabled searcher, by searcher id
+    :ivar mtime: Modification time of config.yml when it was loaded, in nanoseconds
+    """
+    config: Mapping
+    searchers: tuple
+    handlers: Mapping
+    mtime: int
+
+
+_registry: Optional[Registry] = None
+_registry_hooks = []
+
+
+def freeze(value):
+    """Returns a read-only copy of parsed YAML, in which dicts are read-only mappings and lists are tuples."""
+    if isinstance(value, dict):
+        return MappingProxyType({key: freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+def load_registry(resolve_handler: Callable[[Mapping], Optional[Callable]], path: str = CONFIG_PATH) -> Registry:
+    """
+    Parses and validates config.yml, resolves the handler of every enabled searcher and makes the result the current
+    registry. The response cache is also resized, and logging and the event loop watchdog set up, to match the new
+    config, and the functions passed to on_registry_loaded() are called with the new registry.
+
+    :param resolve_handler: Function returning the handler of a searcher (given its section of config.yml), or None
+        if the app dispatches its searches itself. Raises an exception if the searcher cannot be handled.
+    :type resolve_handler: Callable[[Mapping], Optional[Callable]]
+    :param path: Path of config.yml OPTIONAL
+    :type path: str
+    :return: The new registry
+    :rtype: Registry
+    :raises ConfigError: If config.yml is not valid, in which case the current registry is kept
+    """
+    global _registry
+    mtime = os.stat(path).st_mtime_ns
+    with open(path, 'r') as file:
+        config = freeze(yaml.safe_load(file))
+
+    if not isinstance(config, Mapping) or not isinstance(config.get("searchers"), Mapping):
+        raise ConfigError(f"{path} has no searchers section")
+    searchers = []
+    handlers = {}
+    for searcher_id, searcher in config["searchers"].items():
+        if not isinstance(searcher, Mapping) or searcher.get("id") != searcher_id:
+            raise ConfigError(f"Searcher {searcher_id} must have an id of {searcher_id}")
+        if not isinstance(searcher.get("enabled"), bool):
+            raise ConfigError(f"Searcher {searcher_id} must be enabled: True or False")
+        try:
+            public = _models["Searcher"](**{field: searcher[field] for field in _models["Searcher"].__fields__
+                                            if field in searcher})
+        except ValidationError as e:
+            raise ConfigError(f"Searcher {searcher_id} is not valid: {e}")
+        if searcher["enabled"]:
+            searchers.append(public)
+            try:
+                handlers[searcher_id] = resolve_handler(searcher)
+            except Exception as e:
+                raise ConfigError(f"Searcher {searcher_id} cannot be loaded: {e!r}")
+
+    log_settings = parse_logging(config)
+    watchdog_settings = parse_watchdog(config)
+
+    _registry = Registry(config, tuple(searchers), MappingProxyType(handlers), mtime)
+    configure_cache(config)
+    configure_logging(log_settings)
+    loop_watchdog.configure(watchdog_settings)
+    for hook in _registry_hooks:
+        try:
+            hook(_registry)
+        except Exception:
+            _logger.exception("Error applying %s", path)
+    return _registry
+
+
+def on_registry_loaded(hook: Callable[[Registry], None]):
+    """
+    Calls `hook` with the new registry whenever config.yml is loaded (or reloaded) successfully, e.g. so that an app can
+    let go of what the previous config.yml used. Call before start_registry().
+    """
+    _registry_hooks.append(hook)
+
+
+def get_registry() -> Registry:
+    """Returns the current registry. Handlers should call this once per search and use the result throughout."""
+    return _registry
+
+
+def reload_registry(resolve_handler: Callable[[Mapping], Optional[Callable]], path: str = CONFIG_PATH) -> bool:
+    """Reloads config.yml, keeping the current registry if the new config.yml is not valid. Returns True on success."""
+    try:
+        load_registry(resolve_handler, path)
+    except Exception as e:
+        _logger.warning("Not reloading %s: %s", path, e)
+        return False
+    _logger.info("Reloaded %s", path)
+    return True
+
+
+async def watch_config(resolve_handler: Callable[[Mapping], Optional[Callable]], path: str = CONFIG_PATH,
+                       interval: float = CONFIG_CHECK_INTERVAL):
+    """Reloads config.yml whenever it changes, forever. Runs as a background task of the app."""
+    loaded_mtime = _registry.mtime
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            continue
+        if mtime != loaded_mtime:
+            # Not retried until config.yml changes again, if the new version is not valid
+            loaded_mtime = mtime
+            reload_registry(resolve_handler, path)
+
+
+def start_registry(resolve_handler: Callable[[Mapping], Optional[Callable]], path: str = CONFIG_PATH) -> asyncio.Task:
+    """
+    Loads config.yml when the app starts, and arranges for it to be reloaded when it changes or the app is sent
+    SIGHUP (on systems that have it). Call from the app's startup event.
+
+    :param resolve_handler: See load_registry()
+    :type resolve_handler: Callable[[Mapping], Optional[Callable]]
+    :param path: Path of config.yml OPTIONAL
+    :type path: str
+    :return: The background task watching config.yml, to cancel when the app shuts down
+    :rtype: asyncio.Task
+    :raises ConfigError: If config.yml is not valid
+    """
+    load_registry(resolve_handler, path)
+    if hasattr(signal, "SIGHUP"):
+        try:
+            asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, reload_registry, resolve_handler, path)
+        except (NotImplementedError, RuntimeError):
+            pass  # Not the main thread (e.g. under a test client), so rely on watching the file
+    return asyncio.create_task(watch_config(resolve_handler, path))
@@ -0,0 +1,75 @@
+"""
+Measures the size of a search's response, as sent to Videris, when it is compressed with gzip and brotli at several
+levels, and the time taken to compress it (by the app) and decompress it (by Videris).
+
+Uses the sample results in the samples folder, repeated to make up 50 results, with new ids for every entity so that
+the repeats do not make the results look more compressible than they are. From the grid folder, run:
+
+    python benchmarks/compression.py [--results 50] [--repeat 20]
+"""
+import argparse
+import gzip
+import os
+import statistics
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from responses import make_results  # noqa: E402
+from vcf import DEFAULT_COMPRESSION, encode_results, make_compressor  # noqa: E402
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def unique_ids(results: dict) -> dict:
+    """Gives every entity, and the relationships between them, new ids."""
+    for result in results["searchResults"]:
+        ids = {}
+        for entity in result["entities"]:
+            ids.setdefault(entity["id"], str(uuid.uuid4()))
+        for entity in result["entities"]:
+            entity["id"] = ids[entity["id"]]
+            for name in ("FromId", "ToId"):
+                if name in entity["attributes"]:
+                    entity["attributes"][name] = ids.get(entity["attributes"][name], entity["attributes"][name])
+    return results
+
+
+def time_ms(function, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.mean(timings)
+
+
+def main(args):
+    body = encode_results(unique_ids(make_results(args.results)))
+    print(f"{args.results} results, {len(body):,} bytes of JSON, {args.repeat} runs each")
+    levels = [("gzip", "gzip_level", level, gzip.decompress) for level in (1, 6, 9)]
+    if brotli is not None:
+        levels += [("br", "brotli_level", level, brotli.decompress) for level in (0, 4, 6, 11)]
+    else:
+        print("brotli is not installed (pip install brotli), so only gzip is measured")
+    for encoding, setting, level, decompress in levels:
+        settings = {**DEFAULT_COMPRESSION, setting: level}
+        compressed = make_compressor(encoding, settings)(body, False)
+        if decompress(compressed) != body:
+            sys.exit(f"{encoding} level {level} did not decompress to the same body")
+        compress_ms = time_ms(lambda: make_compressor(encoding, settings)(body, False), args.repeat)
+        decompress_ms = time_ms(lambda: decompress(compressed), args.repeat)
+        print(f"{encoding:>4} level {level:>2}: {len(compressed):>10,} bytes ({len(compressed) / len(body):6.1%})  "
+              f"compress {compress_ms:8.2f} ms  decompress {decompress_ms:6.2f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--results", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=20)
+    main(parser.parse_args())
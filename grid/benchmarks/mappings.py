@@ -0,0 +1,485 @@
+"""
+Measures how long mapping Grid API records to search results takes, with the compiled GRID_COMPANY_RESULT and
+GRID_PERSON_RESULT mappings, with the hand-written loops they replaced, and with hand-written mappers that stop at the
+same limits as the mappings (the fair comparison: the old loops built every address, only to keep the first 10).
+
+Uses the sample Grid records in the samples folder, repeated to make up the given number of records. From the grid
+folder, run:
+
+    python benchmarks/mappings.py [--records 50 500] [--repeat 50]
+"""
+import argparse
+import copy
+import json
+import os
+import re
+import statistics
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from grid import (GRID_COMPANY_RESULT, GRID_PERSON_RESULT, GRID_RELATION_TYPES, grid_date_of_birth,  # noqa: E402
+                  grid_event_description, grid_first_name, grid_last_name, grid_nationality, grid_summary)
+from vcf import EntityRecord, RelationshipRecord, ResultRecord, results_to_json  # noqa: E402
+
+SAMPLES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "samples")
+RANDOM_UUID = re.compile(r'"[0-9a-f]{8}-[0-9a-f]{4}-4[0-9a-f]{3}-[0-9a-f]{4}-[0-9a-f]{12}"')
+
+
+# ============================ Sample records ============================
+def make_records(name: str, count: int) -> list:
+    """`count` copies of a sample Grid record, in the shape the Grid API's inquiry endpoint returns them."""
+    with open(os.path.join(SAMPLES, name)) as file:
+        sample = json.load(file)["data"]
+    sample["postAddr"] = [dict(address, countryCode={"countryCodeValue": address.get("countryCode")},
+                               locatorTyp="BIRTH" if i == 0 else None)
+                          for i, address in enumerate(sample["addresses"])]
+    sample["event"] = sample["events"]
+    sample["rels"] = {"rel": sample["relations"]}
+    sample["attribute"] = [{"attCode": "RID" if i % 2 else "RGP", "attVal": attribute["code"]}
+                           for i, attribute in enumerate(sample["attributes"])]
+    records = []
+    for i in range(count):
+        record = copy.deepcopy(sample)
+        record["sysId"] = f"{record['sysId']}-{i}"
+        records.append(record)
+    return records
+
+
+# ============================ Hand-written mappers ============================
+def hand_written_company(company: dict) -> ResultRecord:
+    company_uuid = str(uuid.uuid3(uuid.NAMESPACE_DNS, company['sysId']))
+
+    # Create search result
+    # Address
+    possible_addresses = company.get('postAddr') or []
+    address_entities = []
+    for company_address_index, company_address in enumerate(possible_addresses):
+        street1 = (company_address.get('addr1') or '').strip()
+        city = (company_address.get('city') or '').strip()
+        region = (company_address.get('stateProv') or '').strip()
+        postcode = (company_address.get('postalCode') or '').strip()
+        country = (company_address.get('countryCode', {}).get('countryCodeValue') or '').strip()
+
+        full_address = ', '.join([
+            _fragment for _fragment in [
+                street1, city, region, postcode, country,
+            ] if _fragment
+        ]) or '-'
+
+        address_uuid = str(uuid.uuid3(uuid.NAMESPACE_DNS, str(full_address or (
+            'address-' + str(company_address_index) + '-' + company_uuid))))
+        # Make sure address has a reproducible uuid that's unique (i.e. doesn't depend on null values
+        # in case record is not present).
+        address_entity = EntityRecord(address_uuid, 'EntityAddress', {
+            'Street1': street1,
+            'City': city,
+            'Region': region,
+            'Postcode': postcode,
+            'Country': country,
+        })
+        address_entities.append(address_entity)
+
+    # Riskography
+    riskcographies = []
+    riskids = []
+    for _attr in (company.get('attribute') or []):
+        if _attr.get('attCode') == 'RID' and _attr.get('attVal'):
+            riskids.append(_attr['attVal'])
+        elif _attr.get('attCode') == 'RGP' and _attr.get('attVal'):
+            riskcographies.append(_attr['attVal'])
+    riskids_display = ', '.join(riskids)
+    riskcographies_display = ', '.join(riskcographies)
+
+    # Summary
+    summary_chunks = []
+    if riskids_display:
+        summary_chunks.append('Risk ID: ' + riskids_display)
+    if riskcographies_display:
+        summary_chunks.append('Riskography: ' + riskcographies_display)
+
+    result = ResultRecord(
+        key=str(uuid.uuid4()),
+        title=company['entityName'],
+        subTitle='',
+        summary=' | '.join(summary_chunks),
+        source='Grid API',
+        url=company['rdcURL'],
+        entities=[
+            EntityRecord(company_uuid, 'EntityBusiness', {
+                'Name': company['entityName'] or '',
+                'LocalName': company['entityName'] or '',
+                # 'Description': '',
+                'Worldcompliance': 'True',
+            })
+        ]
+    )
+    count = 0
+    # Relationship: Address
+    for address_entity in address_entities:
+        if count < 10:
+            result.entities.append(address_entity)
+            result.entities.append(RelationshipRecord(company_uuid, address_entity.id, 'Company Address'))
+            count += 1
+        else:
+            break
+
+    count = 0
+    # Relationship: Persons
+    for relation in company.get('rels', {}).get('rel') or []:
+        if count < 10:
+            if relation.get('relTyp') in ('EMPLOYEE', 'ASSOCIATE',):
+                # Construct First Name and Last Name
+                person_name_words = (relation['entityName'] or '').split(' ')
+                relation_entity = EntityRecord(str(uuid.uuid4()), 'EntityPerson', {
+                    'FirstName': (person_name_words[0] if person_name_words else '').strip(),
+                    'LastName': (' '.join(person_name_words[1:]) if person_name_words else '').strip(),
+                    # 'JobTitle': relation.get('relTyp') or '',
+                })
+                result.entities.append(relation_entity)
+                result.entities.append(RelationshipRecord(
+                    company_uuid, relation_entity.id, relation.get('relTyp') or 'Person'))
+                count += 1
+        else:
+            break
+
+    # Relationship: Events
+    count = 0
+    for event in company.get('event') or []:
+        if count < 10:
+            _category_code = event.get('category', {}).get('categoryCode') or ''
+            _category = event.get('category', {}).get('categoryDesc') or ''
+            if _category_code:
+                _category = _category + ' (' + _category_code + ')'
+            _category = _category.strip()
+
+            if event.get('category', {}).get('categoryCode') == 'WLT':
+                event_entity = EntityRecord(str(uuid.uuid4()), 'EntityOrganisation', {
+                    'Name': event.get('source', {}).get('sourceName') or '',
+                    # 'Category': _category,
+                })
+                result.entities.append(event_entity)
+                result.entities.append(RelationshipRecord(company_uuid, event_entity.id, 'Sanctioned by'))
+            else:
+                _description = (event.get('source', {}).get('headline') or '') + \
+                    '\n Category: ' + event.get('subCategory', {}).get('categoryDesc')
+                event_entity = EntityRecord(str(uuid.uuid4()), 'EntityEvent', {
+                    'Title': event.get('eventDesc') or '',
+                    'Date': event.get('eventDt') or '',
+                    'Url': event.get('source', {}).get('sourceURL') or '',
+                    'Description': _description.strip() or '',
+                    # 'Category': _category,
+                })
+                result.entities.append(event_entity)
+                result.entities.append(RelationshipRecord(company_uuid, event_entity.id, ''))
+
+            count += 1
+        else:
+            break
+    return result
+
+
+def hand_written_person(entity: dict) -> ResultRecord:
+    entity_uuid = str(uuid.uuid3(uuid.NAMESPACE_DNS, entity['sysId']))
+
+    # Create search result
+    # Address
+    nationality = ''
+    possible_addresses = entity.get('postAddr') or []
+    address_entities = []
+    for entity_address_index, entity_address in enumerate(possible_addresses):
+        street1 = (entity_address.get('addr1') or '').strip()
+        city = (entity_address.get('city') or '').strip()
+        region = (entity_address.get('stateProv') or '').strip()
+        postcode = (entity_address.get('postalCode') or '').strip()
+        country = (entity_address.get('countryCode', {}).get('countryCodeValue') or '').strip()
+
+        full_address = ', '.join([
+            _fragment for _fragment in [
+                street1, city, region, postcode, country,
+            ] if _fragment
+        ]) or '-'
+
+        address_uuid = str(uuid.uuid3(uuid.NAMESPACE_DNS, str(full_address or (
+            'address-' + str(entity_address_index) + '-' + entity_uuid))))
+        # Make sure address has a reproducible uuid that's unique (i.e. doesn't depend on null values
+        # in case record is not present).
+        address_entity = EntityRecord(address_uuid, 'EntityAddress', {
+            'Street1': street1,
+            'City': city,
+            'Region': region,
+            'Postcode': postcode,
+            'Country': country,
+        })
+        address_entities.append(address_entity)
+
+        if entity_address.get('locatorTyp') == 'BIRTH':
+            nationality = country
+
+    # Construct First Name and Last Name
+    person_name_words = (entity['entityName'] or '').split(' ')
+
+    # Construct Date of Birth
+    possible_dobs = entity.get('birthDt') or []
+    dob = ''
+    for possible_dob in possible_dobs:
+        if possible_dob.strip():
+            dob = possible_dob
+            break
+
+    # Riskography
+    riskcographies = []
+    riskids = []
+    for _attr in (entity.get('attribute') or []):
+        if _attr.get('attCode') == 'RID' and _attr.get('attVal'):
+            riskids.append(_attr['attVal'])
+        elif _attr.get('attCode') == 'RGP' and _attr.get('attVal'):
+            riskcographies.append(_attr['attVal'])
+    riskids_display = ', '.join(riskids)
+    riskcographies_display = ', '.join(riskcographies)
+
+    # Summary
+    summary_chunks = []
+    if riskids_display:
+        summary_chunks.append('Risk ID: ' + riskids_display)
+    if riskcographies_display:
+        summary_chunks.append('Riskography: ' + riskcographies_display)
+
+    result = ResultRecord(
+        key=str(uuid.uuid4()),
+        title=entity['entityName'],
+        subTitle='',
+        summary=' | '.join(summary_chunks),
+        source='Grid API',
+        url=entity['rdcURL'],
+        entities=[
+            EntityRecord(entity_uuid, 'EntityPerson', {
+                'FirstName': (person_name_words[0] if person_name_words else '').strip(),
+                'LastName': (' '.join(person_name_words[1:]) if person_name_words else '').strip(),
+                'Dob': dob or '',
+                'Nationality': nationality,
+                'Compliance': True,
+            })
+        ]
+    )
+
+    # Relationship: Address
+    count = 0
+    for address_entity in address_entities:
+        if count < 10:
+            result.entities.append(address_entity)
+            result.entities.append(RelationshipRecord(entity_uuid, address_entity.id, 'Person Address'))
+            count += 1
+        else:
+            break
+
+    # Relationship: Company
+    count = 0
+    for relation in entity.get('relations') or []:
+        if count < 10:
+            if relation.get('relTyp') in ('EMPLOYEE', 'ASSOCIATE',):
+                relation_entity = EntityRecord(str(uuid.uuid4()), 'EntityBusiness', {
+                    'Name': relation.get('entityName') or '',
+                    # 'LocalName': relation.get('entityName') or '',
+                    # 'JobTitle': relation.get('relTyp') or '',
+                })
+                result.entities.append(relation_entity)
+                result.entities.append(RelationshipRecord(
+                    entity_uuid, relation_entity.id, relation.get('relTyp') or 'Company'))
+                count += 1
+        else:
+            break
+    # Relationship: Events
+    count = 0
+    for event in entity.get('event') or []:
+        if count < 10:
+            _category_code = event.get('category', {}).get('categoryCode') or ''
+            _category = event.get('category', {}).get('categoryDesc') or ''
+            if _category_code:
+                _category = _category + ' (' + _category_code + ')'
+            _category = _category.strip()
+
+            if event.get('category', {}).get('categoryCode') == 'WLT':
+                event_entity = EntityRecord(str(uuid.uuid4()), 'EntityOrganisation', {
+                    'Name': event.get('source', {}).get('sourceName') or '',
+                    # 'Category': _category,
+                })
+                result.entities.append(event_entity)
+                result.entities.append(RelationshipRecord(entity_uuid, event_entity.id, 'Sanctioned by'))
+            else:
+                _description = (event.get('source', {}).get('headline') or '') + \
+                    '\n Category: ' + event.get('subCategory', {}).get('categoryDesc')
+                event_entity = EntityRecord(str(uuid.uuid4()), 'EntityEvent', {
+                    'Title': event.get('eventDesc') or '',
+                    'Date': event.get('eventDt') or '',
+                    'Url': event.get('source', {}).get('sourceURL') or '',
+                    'Description': _description.strip() or '',
+                    # 'Category': _category,
+                })
+                result.entities.append(event_entity)
+                result.entities.append(RelationshipRecord(entity_uuid, event_entity.id, ''))
+
+            count += 1
+
+        else:
+            break
+
+    # Relationship: Attributes
+    count = 0
+    for attribute in entity.get('attributes') or []:
+        if count < 10:
+            if attribute.get('code') != 'URL':
+                attribute_entity = EntityRecord(str(uuid.uuid4()), 'EntityNote', {
+                    'Text': attribute.get('value') or '',
+                })
+                result.entities.append(attribute_entity)
+                result.entities.append(RelationshipRecord(entity_uuid, attribute_entity.id, ''))
+                count += 1
+        else:
+            break
+    return result
+
+
+# ============================ Hand-written mappers with the same limits ============================
+def limited_address(address: dict) -> EntityRecord:
+    street1 = (address.get('addr1') or '').strip()
+    city = (address.get('city') or '').strip()
+    region = (address.get('stateProv') or '').strip()
+    postcode = (address.get('postalCode') or '').strip()
+    country = ((address.get('countryCode') or {}).get('countryCodeValue') or '').strip()
+    full_address = ', '.join(fragment for fragment in (street1, city, region, postcode, country) if fragment) or '-'
+    return EntityRecord(str(uuid.uuid3(uuid.NAMESPACE_DNS, full_address)), 'EntityAddress', {
+        'Street1': street1,
+        'City': city,
+        'Region': region,
+        'Postcode': postcode,
+        'Country': country,
+    })
+
+
+def limited_related(result: ResultRecord, owner_id: str, entity: EntityRecord, title: str):
+    result.entities.append(entity)
+    result.entities.append(RelationshipRecord(owner_id, entity.id, title))
+
+
+def limited_addresses(result: ResultRecord, owner_id: str, addresses: list, title: str):
+    for address in (addresses or [])[:10]:
+        limited_related(result, owner_id, limited_address(address), title)
+
+
+def limited_events(result: ResultRecord, owner_id: str, events: list):
+    for event in (events or [])[:10]:
+        source = event.get('source') or {}
+        if (event.get('category') or {}).get('categoryCode') == 'WLT':
+            limited_related(result, owner_id, EntityRecord(str(uuid.uuid4()), 'EntityOrganisation', {
+                'Name': source.get('sourceName') or '',
+            }), 'Sanctioned by')
+        else:
+            limited_related(result, owner_id, EntityRecord(str(uuid.uuid4()), 'EntityEvent', {
+                'Title': event.get('eventDesc') or '',
+                'Date': event.get('eventDt') or '',
+                'Url': source.get('sourceURL') or '',
+                'Description': grid_event_description(source.get('headline'),
+                                                      (event.get('subCategory') or {}).get('categoryDesc')),
+            }), '')
+
+
+def limited_result(record: dict, entity: EntityRecord) -> ResultRecord:
+    return ResultRecord(key=str(uuid.uuid4()), title=record['entityName'], subTitle='',
+                        summary=grid_summary(record.get('attribute')), source='Grid API', url=record['rdcURL'],
+                        entities=[entity])
+
+
+def limited_company(company: dict) -> ResultRecord:
+    """Maps a company as the hand-written loop did, but stops at the same limits as GRID_COMPANY_RESULT."""
+    company_id = str(uuid.uuid3(uuid.NAMESPACE_DNS, company['sysId']))
+    name = company['entityName'] or ''
+    result = limited_result(company, EntityRecord(company_id, 'EntityBusiness', {
+        'Name': name,
+        'LocalName': name,
+        'Worldcompliance': 'True',
+    }))
+    relations = [relation for relation in ((company.get('rels') or {}).get('rel') or [])
+                 if relation.get('relTyp') in GRID_RELATION_TYPES]
+    limited_addresses(result, company_id, company.get('postAddr'), 'Company Address')
+    for relation in relations[:10]:
+        limited_related(result, company_id, EntityRecord(str(uuid.uuid4()), 'EntityPerson', {
+            'FirstName': grid_first_name(relation.get('entityName')),
+            'LastName': grid_last_name(relation.get('entityName')),
+        }), relation.get('relTyp') or 'Person')
+    limited_events(result, company_id, company.get('event'))
+    return result
+
+
+def limited_person(person: dict) -> ResultRecord:
+    """Maps a person as the hand-written loop did, but stops at the same limits as GRID_PERSON_RESULT."""
+    person_id = str(uuid.uuid3(uuid.NAMESPACE_DNS, person['sysId']))
+    result = limited_result(person, EntityRecord(person_id, 'EntityPerson', {
+        'FirstName': grid_first_name(person['entityName']),
+        'LastName': grid_last_name(person['entityName']),
+        'Dob': grid_date_of_birth(person.get('birthDt')),
+        'Nationality': grid_nationality(person.get('postAddr')),
+        'Compliance': True,
+    }))
+    relations = [relation for relation in (person.get('relations') or [])
+                 if relation.get('relTyp') in GRID_RELATION_TYPES]
+    limited_addresses(result, person_id, person.get('postAddr'), 'Person Address')
+    for relation in relations[:10]:
+        limited_related(result, person_id, EntityRecord(str(uuid.uuid4()), 'EntityBusiness', {
+            'Name': relation.get('entityName') or '',
+        }), relation.get('relTyp') or 'Company')
+    limited_events(result, person_id, person.get('event'))
+    notes = [attribute for attribute in (person.get('attributes') or []) if attribute.get('code') != 'URL']
+    for attribute in notes[:10]:
+        limited_related(result, person_id, EntityRecord(str(uuid.uuid4()), 'EntityNote', {
+            'Text': attribute.get('value') or '',
+        }), '')
+    return result
+
+
+# ============================ Benchmark ============================
+def same_results(first: list, second: list) -> bool:
+    """Whether two lists of results are the same, apart from their random UUIDs (and the relationship ids made from
+    them)."""
+    def normalised(results):
+        return RANDOM_UUID.sub('"-"', results_to_json({"searchResults": results}))
+    relationship_id = re.compile(r'"id": "[^"]*", "type": "RelationshipRelationship"')
+    return relationship_id.sub("", normalised(first)) == relationship_id.sub("", normalised(second))
+
+
+def time_ms(map_records, records: list, repeat: int) -> list:
+    map_records(records)  # Warm up
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        map_records(records)
+        timings.append((time.perf_counter() - started) * 1000)
+    return sorted(timings)
+
+
+def main(args):
+    print(f"{args.repeat} runs each")
+    for name, sample, mapping, hand_written, limited in [
+        ("companies", "grid-result-company.json", GRID_COMPANY_RESULT, hand_written_company, limited_company),
+        ("people", "grid-result-person.json", GRID_PERSON_RESULT, hand_written_person, limited_person),
+    ]:
+        for count in args.records:
+            records = make_records(sample, count)
+            for how, mapper in [("hand-written loop", hand_written), ("limited hand-written mapper", limited)]:
+                if not same_results(mapping.many(records), [mapper(record) for record in records]):
+                    sys.exit(f"The {name} mapping does not return the same results as the {how}")
+            for how, map_records in [("mapping", mapping.many),
+                                     ("hand-written", lambda records: [hand_written(record) for record in records]),
+                                     ("limited", lambda records: [limited(record) for record in records])]:
+                timings = time_ms(map_records, records, args.repeat)
+                print(f"{count:>5} {name:<9} {how:>12}: mean {statistics.mean(timings):8.3f} ms  "
+                      f"p50 {timings[len(timings) // 2]:8.3f} ms  max {timings[-1]:8.3f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--records", type=int, nargs="+", default=[50, 500], help="Records to map")
+    parser.add_argument("--repeat", type=int, default=50)
+    main(parser.parse_args())
@@ -0,0 +1,82 @@
+"""
+Measures how long returning a search's results takes, checked against the SearchResults model as FastAPI does with
+`response_model` (validate_responses on), and checked and encoded straight to JSON by encode_results() (the
+default).
+
+Uses the sample results in the samples folder, repeated to make up 50 results. From the grid folder, run:
+
+    python benchmarks/responses.py [--results 50] [--repeat 200]
+"""
+import argparse
+import asyncio
+import copy
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.responses import JSONResponse  # noqa: E402
+from fastapi.routing import serialize_response  # noqa: E402
+from fastapi.utils import create_response_field  # noqa: E402
+
+from vcf import SearchResults, encode_results  # noqa: E402
+
+SAMPLES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "samples")
+
+
+# ============================ Sample results ============================
+def make_results(count: int) -> dict:
+    """`count` results made up of the sample company and person search results, in turn."""
+    samples = []
+    for name in ["company-search-results.json", "person-search-results.json"]:
+        with open(os.path.join(SAMPLES, name)) as file:
+            samples += json.load(file)["searchResults"]
+    search_results = []
+    for i in range(count):
+        result = copy.deepcopy(samples[i % len(samples)])
+        result["key"] = f"{result['key']}-{i}"
+        search_results.append(result)
+    return {"searchResults": search_results}
+
+
+# ============================ Benchmark ============================
+RESPONSE_FIELD = create_response_field(name="Response_get_results", type_=SearchResults)
+
+
+def validated(results: dict) -> bytes:
+    """What FastAPI does with the endpoint's `response_model=SearchResults, response_model_exclude_none=True`."""
+    content = asyncio.run(serialize_response(field=RESPONSE_FIELD, response_content=results, exclude_none=True))
+    return JSONResponse(content).body
+
+
+def time_ms(encode, results: dict, repeat: int) -> list:
+    encode(results)  # Warm up
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        encode(results)
+        timings.append((time.perf_counter() - started) * 1000)
+    return sorted(timings)
+
+
+def main(args):
+    results = make_results(args.results)
+    entities = sum(len(result.get("entities") or []) for result in results["searchResults"])
+    if json.loads(validated(results)) != json.loads(encode_results(results)):
+        sys.exit("encode_results() does not return the same JSON as FastAPI")
+    print(f"{args.results} results with {entities} entities ({len(encode_results(results)):,} bytes), "
+          f"{args.repeat} runs each")
+    for name, encode in [("validated", validated), ("encode_results", encode_results)]:
+        timings = time_ms(encode, results, args.repeat)
+        print(f"{name:>14}: mean {statistics.mean(timings):8.3f} ms  p50 {timings[len(timings) // 2]:8.3f} ms  "
+              f"max {timings[-1]:8.3f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--results", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=200)
+    main(parser.parse_args())
@@ -7,15 +7,17 @@ E.g.
 
     uvicorn main:app --host 192.168.2.25
 """
+import asyncio
 import json
+import operator
 import os
-import traceback
 import uuid
-from datetime import datetime
 
 import requests
 
-from vcf import create_relationship
+from vcf import (Cases, EntityMapping, ErrorRecord, Related, ResultMapping, SearchFailed, attribute, call,
+                 collect_results, const, deadline_error, deadline_exceeded, deadline_timeout, field, get_logger, join,
+                 log_payload, new_uuid, one_of, uuid_of)
 
 
 GRID_API_USERNAME = os.getenv('GRID_API_USERNAME')
@@ -25,8 +27,7 @@ GRID_TOKEN_FILE_PATH = (os.getenv('GRID_TOKEN_FILE_PATH') or 'grid-token.json')
 GRID_API_BASE_URL = 'https://service.rdc.eu.com/api/grid-service/v2/'
 
 
-def log(*message):
-    print(datetime.now().isoformat(), *message)
+logger = get_logger('grid')
 
 
 # ============================ Grid API Client ===========================
@@ -38,22 +39,23 @@ class GridAPIClient:
     client = None
 
     def login(self):
-        log('Logging in')
+        logger.info('Logging in')
         response = requests.post('https://service.rdc.eu.com/oauth/login', json={
             'userId': self.username,
             'password': self.password,
         }, timeout=5.0)
         if response.ok:
             if response.json()['success']:
-                log('Successfully logged in')
+                logger.info('Successfully logged in')
                 self.token = response.json()['data']['access_token']
                 with open(GRID_TOKEN_FILE_PATH, 'w') as token_file:
                     json.dump(response.json(), token_file)
                 return self.token
-        log('Unable to login:', response.text)
+        logger.warning('Unable to login: %s', response.status_code)
+        log_payload(logger, 'Login response', response.text)
 
     def refetch_token(self):
-        log('Refetching token')
+        logger.info('Refetching token')
         token_info = self.get_token_info()
         response = requests.post('https://service.rdc.eu.com/oauth/token', headers={
             'Content-Type': 'application/json',
@@ -61,18 +63,19 @@ class GridAPIClient:
             'Refresh-Token': token_info.get('data', {}).get('refresh_token'),
         }, timeout=5.0)
         if response.ok:
-            log('Successfully refetched token')
+            logger.info('Successfully refetched token')
             self.token = response.json()['data']['access_token']
             with open(GRID_TOKEN_FILE_PATH, 'w') as token_file:
                 json.dump(response.json(), token_file)
             return self.token
 
         # token refresh failed, try to login again
-        log('Token refetching failed, error response:', response.text)
+        logger.warning('Token refetching failed, error response: %s', response.status_code)
+        log_payload(logger, 'Token response', response.text)
         return self.login()
 
     def get_token_info(self):
-        log('Reading token info from file')
+        logger.debug('Reading token info from file')
         token_info = {}
         try:
             with open(GRID_TOKEN_FILE_PATH, 'r') as token_file:
@@ -81,7 +84,7 @@ class GridAPIClient:
                     raise Exception('Empty token file')
         except:
             # file not present, could be the first call
-            log('Unable to read token info from file, trying to login')
+            logger.info('Unable to read token info from file, trying to login')
             return self.login()
         return token_info
 
@@ -89,7 +92,7 @@ class GridAPIClient:
         return self.get_token_info()['data']['access_token']
 
     def make_client(self):
-        log('Make API client')
+        logger.debug('Make API client')
         self.token = self.get_token()
         self.client = requests.Session()
         self.client.headers = {
@@ -102,28 +105,155 @@ class GridAPIClient:
         return GRID_API_BASE_URL + _url
 
     def make_request(self, method, _url, **kwargs):
-        log('Request:', method, 'Url:', self.url(_url))
+        logger.debug('Request: %s Url: %s', method, self.url(_url))
         response = getattr(self.client, method.lower())(self.url(_url), **kwargs)
         if response.status_code in (401, 403,):
-            log('Got', response.status_code, 'response. Refetching token')
+            logger.info('Got %s response. Refetching token', response.status_code)
             self.refetch_token()
             self.make_client()
             response = getattr(self.client, method.lower())(self.url(_url), **kwargs)
         if not response.ok:
-            log('Got error response', response, ':', response.content)
+            logger.warning('Got error response %s from %s', response.status_code, self.url(_url))
+            log_payload(logger, 'Error response', response.content)
 
         return response
 
 
+# ============================ Grid mappings ============================
+GRID_RELATION_TYPES = ('EMPLOYEE', 'ASSOCIATE',)
+
+
+def grid_summary(attributes):
+    """Summary of a Grid record: its risk ids and riskography, from its attributes."""
+    riskids = []
+    riskcographies = []
+    for _attr in (attributes or []):
+        if _attr.get('attCode') == 'RID' and _attr.get('attVal'):
+            riskids.append(_attr['attVal'])
+        elif _attr.get('attCode') == 'RGP' and _attr.get('attVal'):
+            riskcographies.append(_attr['attVal'])
+
+    summary_chunks = []
+    if riskids:
+        summary_chunks.append('Risk ID: ' + ', '.join(riskids))
+    if riskcographies:
+        summary_chunks.append('Riskography: ' + ', '.join(riskcographies))
+    return ' | '.join(summary_chunks)
+
+
+def grid_first_name(name):
+    return (name or '').split(' ')[0].strip()
+
+
+def grid_last_name(name):
+    return ' '.join((name or '').split(' ')[1:]).strip()
+
+
+def grid_date_of_birth(birth_dates):
+    """The first date of birth that is not blank."""
+    for possible_dob in (birth_dates or []):
+        if possible_dob.strip():
+            return possible_dob
+    return ''
+
+
+def grid_nationality(addresses):
+    """The country of the (last) place of birth among a person's addresses."""
+    nationality = ''
+    for address in (addresses or []):
+        if address.get('locatorTyp') == 'BIRTH':
+            nationality = ((address.get('countryCode') or {}).get('countryCodeValue') or '').strip()
+    return nationality
+
+
+def grid_event_description(headline, category):
+    return ((headline or '') + '\n Category: ' + (category or '')).strip()
+
+
+GRID_ADDRESS = EntityMapping(
+    'EntityAddress',
+    # Make sure address has a reproducible uuid (i.e. doesn't depend on null values in case record is not present)
+    uuid_of(join(', ', attribute('Street1'), attribute('City'), attribute('Region'), attribute('Postcode'),
+                 attribute('Country'), default='-')),
+    {
+        'Street1': field('addr1', strip=True),
+        'City': field('city', strip=True),
+        'Region': field('stateProv', strip=True),
+        'Postcode': field('postalCode', strip=True),
+        'Country': field('countryCode.countryCodeValue', strip=True),
+    },
+)
+
+GRID_EVENTS = Related('event', Cases('category.categoryCode', {
+    'WLT': EntityMapping('EntityOrganisation', new_uuid(), {
+        'Name': field('source.sourceName', default=''),
+    }, title='Sanctioned by'),
+}, default=EntityMapping('EntityEvent', new_uuid(), {
+    'Title': field('eventDesc', default=''),
+    'Date': field('eventDt', default=''),
+    'Url': field('source.sourceURL', default=''),
+    'Description': call(grid_event_description, 'source.headline', 'subCategory.categoryDesc'),
+})), limit=10)
+
+GRID_COMPANY_RESULT = ResultMapping(
+    EntityMapping('EntityBusiness', uuid_of(field('sysId', strict=True)), {
+        'Name': field('entityName', default=''),
+        'LocalName': field('entityName', default=''),
+        'Worldcompliance': const('True'),
+    }),
+    related=[
+        Related('postAddr', GRID_ADDRESS, title='Company Address', limit=10),
+        Related('rels.rel', EntityMapping('EntityPerson', new_uuid(), {
+            'FirstName': call(grid_first_name, 'entityName'),
+            'LastName': call(grid_last_name, 'entityName'),
+        }), title=field('relTyp', default='Person'), where=one_of('relTyp', GRID_RELATION_TYPES), limit=10),
+        GRID_EVENTS,
+    ],
+    title=field('entityName', strict=True),
+    subTitle=const(''),
+    summary=call(grid_summary, 'attribute'),
+    source=const('Grid API'),
+    url=field('rdcURL', strict=True),
+)
+
+GRID_PERSON_RESULT = ResultMapping(
+    EntityMapping('EntityPerson', uuid_of(field('sysId', strict=True)), {
+        'FirstName': call(grid_first_name, 'entityName'),
+        'LastName': call(grid_last_name, 'entityName'),
+        'Dob': call(grid_date_of_birth, 'birthDt'),
+        'Nationality': call(grid_nationality, 'postAddr'),
+        'Compliance': True,
+    }),
+    related=[
+        Related('postAddr', GRID_ADDRESS, title='Person Address', limit=10),
+        Related('relations', EntityMapping('EntityBusiness', new_uuid(), {
+            'Name': field('entityName', default=''),
+        }), title=field('relTyp', default='Company'), where=one_of('relTyp', GRID_RELATION_TYPES), limit=10),
+        GRID_EVENTS,
+        Related('attributes', EntityMapping('EntityNote', new_uuid(), {
+            'Text': field('value', default=''),
+        }), where=call(operator.ne, 'code', const('URL')), limit=10),
+    ],
+    title=field('entityName', strict=True),
+    subTitle=const(''),
+    summary=call(grid_summary, 'attribute'),
+    source=const('Grid API'),
+    url=field('rdcURL', strict=True),
+)
+
+
 # ============================ Grid functions ============================
 async def get_grid_company(query: str, max_results: int = 50):
-    search_results = []
+    return await collect_results(stream_grid_company(query, max_results))
+
 
+async def stream_grid_company(query: str, max_results: int = 50):
+    """Searches the Grid API for companies, yielding each result as soon as it is mapped."""
     try:
         api = GridAPIClient()
-        api.make_client()
-    except:
-        return {'error': [{'message': 'Error establishing a connection with the Grid API.'}]}
+        await asyncio.to_thread(api.make_client)
+    except Exception:
+        raise SearchFailed([{'message': 'Error establishing a connection with the Grid API.'}])
 
     try:
         query = query.strip()
@@ -142,185 +272,46 @@ async def get_grid_company(query: str, max_results: int = 50):
                 },
             },
         }
-        response = api.make_request('post', 'inquiry', json=company_query)
+        response = await asyncio.to_thread(api.make_request, 'post', 'inquiry', json=company_query,
+                                           timeout=deadline_timeout())
         if not response.ok:
-            return {'error': [{'message': 'Error response from Grid API.'}]}
+            raise SearchFailed([{'message': 'Error response from Grid API.'}])
 
         alerts_list = response.json().get('data', {}).get('alerts', [])
         if not alerts_list:
-            return {'searchResults': []}
+            return
 
         company_list = alerts_list[0].get('gridAlertInfo', {}).get('alerts', {}).get('nonReviewedAlertEntity') or []
-    except:
-        traceback.print_exc()
-        return {'error': [{'message': 'Error querying the Grid API.'}]}
+    except SearchFailed:
+        raise
+    except Exception:
+        logger.exception('Error querying the Grid API')
+        raise SearchFailed([{'message': 'Error querying the Grid API.'}])
 
+    returned = 0
     for company in company_list:
-        company_uuid = str(uuid.uuid3(uuid.NAMESPACE_DNS, company['sysId']))
-
-        # Create search result
-        # Address
-        possible_addresses = company.get('postAddr') or []
-        address_entities = []
-        for company_address_index, company_address in enumerate(possible_addresses):
-            street1 = (company_address.get('addr1') or '').strip()
-            city = (company_address.get('city') or '').strip()
-            region = (company_address.get('stateProv') or '').strip()
-            postcode = (company_address.get('postalCode') or '').strip()
-            country = (company_address.get('countryCode', {}).get('countryCodeValue') or '').strip()
-
-            full_address = ', '.join([
-                _fragment for _fragment in [
-                    street1, city, region, postcode, country,
-                ] if _fragment
-            ]) or '-'
-
-            address_uuid = str(uuid.uuid3(uuid.NAMESPACE_DNS, str(full_address or (
-                'address-' + str(company_address_index) + '-' + company_uuid))))
-            # Make sure address has a reproducible uuid that's unique (i.e. doesn't depend on null values
-            # in case record is not present).
-            address_entity = {
-                'id': address_uuid,
-                'type': 'EntityAddress',
-                'attributes': {
-                    'Street1': street1,
-                    'City': city,
-                    'Region': region,
-                    'Postcode': postcode,
-                    'Country': country,
-                }
-            }
-            address_entities.append(address_entity)
-
-        # Riskography
-        riskcographies = []
-        riskids = []
-        for _attr in (company.get('attribute') or []):
-            if _attr.get('attCode') == 'RID' and _attr.get('attVal'):
-                riskids.append(_attr['attVal'])
-            elif _attr.get('attCode') == 'RGP' and _attr.get('attVal'):
-                riskcographies.append(_attr['attVal'])
-        riskids_display = ', '.join(riskids)
-        riskcographies_display = ', '.join(riskcographies)
-
-        # Summary
-        summary_chunks = []
-        if riskids_display:
-            summary_chunks.append('Risk ID: ' + riskids_display)
-        if riskcographies_display:
-            summary_chunks.append('Riskography: ' + riskcographies_display)
-
-        result = {
-            'key': str(uuid.uuid4()),
-            'title': company['entityName'],
-            'subTitle': '',
-            'summary': ' | '.join(summary_chunks),
-            'source': 'Grid API',
-            'url': company['rdcURL'],
-            'entities': [
-                {
-                    'id': company_uuid,
-                    'type': 'EntityBusiness',
-                    'attributes': {
-                        'Name': company['entityName'] or '',
-                        'LocalName': company['entityName'] or '',
-                        # 'Description': '',
-                        'Worldcompliance': 'True',
-                    }
-                }
-            ]
-        }
-        count = 0
-        # Relationship: Address
-        for address_entity in address_entities:
-            if count < 10:
-                result['entities'].append(address_entity)
-                result['entities'].append(create_relationship(company_uuid, address_entity['id'], 'Company Address'))
-                count += 1
-            else:
-                break
-
-        count = 0
-        # Relationship: Persons
-        for relation in company.get('rels', {}).get('rel') or []:
-            if count < 10:
-                if relation.get('relTyp') in ('EMPLOYEE', 'ASSOCIATE',):
-                    # Construct First Name and Last Name
-                    person_name_words = (relation['entityName'] or '').split(' ')
-                    relation_entity = {
-                        'id': str(uuid.uuid4()),
-                        'type': 'EntityPerson',
-                        'attributes': {
-                            'FirstName': (person_name_words[0] if person_name_words else '').strip(),
-                            'LastName': (' '.join(person_name_words[1:]) if person_name_words else '').strip(),
-                            # 'JobTitle': relation.get('relTyp') or '',
-                        }
-                    }
-                    result['entities'].append(relation_entity)
-                    result['entities'].append(create_relationship(
-                        company_uuid, relation_entity['id'], relation.get('relTyp') or 'Person'))
-                    count += 1
-            else:
-                break
-
-        # Relationship: Events
-        count = 0
-        for event in company.get('event') or []:
-            if count < 10:
-                _category_code = event.get('category', {}).get('categoryCode') or ''
-                _category = event.get('category', {}).get('categoryDesc') or ''
-                if _category_code:
-                    _category = _category + ' (' + _category_code + ')'
-                _category = _category.strip()
-
-                if event.get('category', {}).get('categoryCode') == 'WLT':
-                    event_entity = {
-                        'id': str(uuid.uuid4()),
-                        'type': 'EntityOrganisation',
-                        'attributes': {
-                            'Name': event.get('source', {}).get('sourceName') or '',
-                            # 'Category': _category,
-                        }
-                    }
-                    result['entities'].append(event_entity)
-                    result['entities'].append(create_relationship(company_uuid, event_entity['id'], 'Sanctioned by'))
-                else:
-                    _description = (event.get('source', {}).get('headline') or '') + \
-                        '\n Category: ' + event.get('subCategory', {}).get('categoryDesc')
-                    event_entity = {
-                        'id': str(uuid.uuid4()),
-                        'type': 'EntityEvent',
-                        'attributes': {
-                            'Title': event.get('eventDesc') or '',
-                            'Date': event.get('eventDt') or '',
-                            'Url': event.get('source', {}).get('sourceURL') or '',
-                            'Description': _description.strip() or '',
-                            # 'Category': _category,
-                        }
-                    }
-                    result['entities'].append(event_entity)
-                    result['entities'].append(create_relationship(company_uuid, event_entity['id'], ''))
-                    
-                count += 1
-                
-            else:
-                break
-
-        search_results.append(result)
-        if len(search_results) >= max_results:
+        if deadline_exceeded():
+            yield ErrorRecord(deadline_error()['message'])
+            break
+        # Give way to the event loop between records, so a cancelled search stops mapping straight away
+        await asyncio.sleep(0)
+        yield GRID_COMPANY_RESULT(company)
+        returned += 1
+        if returned >= max_results:
             break
-    log(json.dumps({'searchResults': search_results}))
-    return {'searchResults': search_results}
 
 
 async def get_grid_people(query: str, max_results: int = 50):
-    search_results = []
+    return await collect_results(stream_grid_people(query, max_results))
 
+
+async def stream_grid_people(query: str, max_results: int = 50):
+    """Searches the Grid API for people, yielding each result as soon as it is mapped."""
     try:
         api = GridAPIClient()
-        api.make_client()
-    except:
-        return {'error': [{'message': 'Error establishing a connection with the Grid API.'}]}
+        await asyncio.to_thread(api.make_client)
+    except Exception:
+        raise SearchFailed([{'message': 'Error establishing a connection with the Grid API.'}])
 
     try:
         query = query.strip()
@@ -339,204 +330,30 @@ async def get_grid_people(query: str, max_results: int = 50):
                 },
             },
         }
-        response = api.make_request('post', 'inquiry', json=people_query)
+        response = await asyncio.to_thread(api.make_request, 'post', 'inquiry', json=people_query,
+                                           timeout=deadline_timeout())
         if not response.ok:
-            return {'error': [{'message': 'Error response from Grid API.'}]}
+            raise SearchFailed([{'message': 'Error response from Grid API.'}])
 
         alerts_list = response.json().get('data', {}).get('alerts', [])
         if not alerts_list:
-            return {'searchResults': []}
+            return
 
         entities_list = alerts_list[0].get('gridAlertInfo', {}).get('alerts', {}).get('nonReviewedAlertEntity') or []
-    except:
-        traceback.print_exc()
-        return {'error': [{'message': 'Error querying the Grid API.'}]}
+    except SearchFailed:
+        raise
+    except Exception:
+        logger.exception('Error querying the Grid API')
+        raise SearchFailed([{'message': 'Error querying the Grid API.'}])
 
+    returned = 0
     for entity in entities_list:
-        entity_uuid = str(uuid.uuid3(uuid.NAMESPACE_DNS, entity['sysId']))
-
-        # Create search result
-        # Address
-        nationality = ''
-        possible_addresses = entity.get('postAddr') or []
-        address_entities = []
-        for entity_address_index, entity_address in enumerate(possible_addresses):
-            street1 = (entity_address.get('addr1') or '').strip()
-            city = (entity_address.get('city') or '').strip()
-            region = (entity_address.get('stateProv') or '').strip()
-            postcode = (entity_address.get('postalCode') or '').strip()
-            country = (entity_address.get('countryCode', {}).get('countryCodeValue') or '').strip()
-
-            full_address = ', '.join([
-                _fragment for _fragment in [
-                    street1, city, region, postcode, country,
-                ] if _fragment
-            ]) or '-'
-
-            address_uuid = str(uuid.uuid3(uuid.NAMESPACE_DNS, str(full_address or (
-                'address-' + str(entity_address_index) + '-' + entity_uuid))))
-            # Make sure address has a reproducible uuid that's unique (i.e. doesn't depend on null values
-            # in case record is not present).
-            address_entity = {
-                'id': address_uuid,
-                'type': 'EntityAddress',
-                'attributes': {
-                    'Street1': street1,
-                    'City': city,
-                    'Region': region,
-                    'Postcode': postcode,
-                    'Country': country,
-                }
-            }
-            address_entities.append(address_entity)
-
-            if entity_address.get('locatorTyp') == 'BIRTH':
-                nationality = country
-
-        # Construct First Name and Last Name
-        person_name_words = (entity['entityName'] or '').split(' ')
-
-        # Construct Date of Birth
-        possible_dobs = entity.get('birthDt') or []
-        dob = ''
-        for possible_dob in possible_dobs:
-            if possible_dob.strip():
-                dob = possible_dob
-                break
-
-        # Riskography
-        riskcographies = []
-        riskids = []
-        for _attr in (entity.get('attribute') or []):
-            if _attr.get('attCode') == 'RID' and _attr.get('attVal'):
-                riskids.append(_attr['attVal'])
-            elif _attr.get('attCode') == 'RGP' and _attr.get('attVal'):
-                riskcographies.append(_attr['attVal'])
-        riskids_display = ', '.join(riskids)
-        riskcographies_display = ', '.join(riskcographies)
-
-        # Summary
-        summary_chunks = []
-        if riskids_display:
-            summary_chunks.append('Risk ID: ' + riskids_display)
-        if riskcographies_display:
-            summary_chunks.append('Riskography: ' + riskcographies_display)
-
-        result = {
-            'key': str(uuid.uuid4()),
-            'title': entity['entityName'],
-            'subTitle': '',
-            'summary': ' | '.join(summary_chunks),
-            'source': 'Grid API',
-            'url': entity['rdcURL'],
-            'entities': [
-                {
-                    'id': entity_uuid,
-                    'type': 'EntityPerson',
-                    'attributes': {
-                        'FirstName': (person_name_words[0] if person_name_words else '').strip(),
-                        'LastName': (' '.join(person_name_words[1:]) if person_name_words else '').strip(),
-                        'Dob': dob or '',
-                        'Nationality': nationality,
-                        'Compliance': True,
-                    }
-                }
-            ]
-        }
-
-        # Relationship: Address
-        count = 0
-        for address_entity in address_entities:
-            if count < 10:
-                result['entities'].append(address_entity)
-                result['entities'].append(create_relationship(entity_uuid, address_entity['id'], 'Person Address'))
-                count += 1
-            else:
-                break
-
-        # Relationship: Company
-        count = 0
-        for relation in entity.get('relations') or []:
-            if count < 10:
-                if relation.get('relTyp') in ('EMPLOYEE', 'ASSOCIATE',):
-                    relation_entity = {
-                        'id': str(uuid.uuid4()),
-                        'type': 'EntityBusiness',
-                        'attributes': {
-                            'Name': relation.get('entityName') or '',
-                            # 'LocalName': relation.get('entityName') or '',
-                            # 'JobTitle': relation.get('relTyp') or '',
-                        }
-                    }
-                    result['entities'].append(relation_entity)
-                    result['entities'].append(create_relationship(
-                        entity_uuid, relation_entity['id'], relation.get('relTyp') or 'Company'))
-                    count += 1
-            else:
-                break
-        # Relationship: Events
-        count = 0
-        for event in entity.get('event') or []:
-            if count < 10:
-                _category_code = event.get('category', {}).get('categoryCode') or ''
-                _category = event.get('category', {}).get('categoryDesc') or ''
-                if _category_code:
-                    _category = _category + ' (' + _category_code + ')'
-                _category = _category.strip()
-
-                if event.get('category', {}).get('categoryCode') == 'WLT':
-                    event_entity = {
-                        'id': str(uuid.uuid4()),
-                        'type': 'EntityOrganisation',
-                        'attributes': {
-                            'Name': event.get('source', {}).get('sourceName') or '',
-                            # 'Category': _category,
-                        }
-                    }
-                    result['entities'].append(event_entity)
-                    result['entities'].append(create_relationship(entity_uuid, event_entity['id'], 'Sanctioned by'))
-                else:
-                    _description = (event.get('source', {}).get('headline') or '') + \
-                        '\n Category: ' + event.get('subCategory', {}).get('categoryDesc')
-                    event_entity = {
-                        'id': str(uuid.uuid4()),
-                        'type': 'EntityEvent',
-                        'attributes': {
-                            'Title': event.get('eventDesc') or '',
-                            'Date': event.get('eventDt') or '',
-                            'Url': event.get('source', {}).get('sourceURL') or '',
-                            'Description': _description.strip() or '',
-                            # 'Category': _category,
-                        }
-                    }
-                    result['entities'].append(event_entity)
-                    result['entities'].append(create_relationship(entity_uuid, event_entity['id'], ''))
-                    
-                count += 1
-                
-            else:
-                break
-
-        # Relationship: Attributes
-        count = 0
-        for attribute in entity.get('attributes') or []:
-            if count < 10:
-                if attribute.get('code') != 'URL':
-                    attribute_entity = {
-                        'id': str(uuid.uuid4()),
-                        'type': 'EntityNote',
-                        'attributes': {
-                            'Text': attribute.get('value') or '',
-                        }
-                    }
-                    result['entities'].append(attribute_entity)
-                    result['entities'].append(create_relationship(entity_uuid, attribute_entity['id'], ''))
-                    count += 1
-            else:
-                break
-
-        search_results.append(result)
-        if len(search_results) >= max_results:
+        if deadline_exceeded():
+            yield ErrorRecord(deadline_error()['message'])
+            break
+        # Give way to the event loop between records, so a cancelled search stops mapping straight away
+        await asyncio.sleep(0)
+        yield GRID_PERSON_RESULT(entity)
+        returned += 1
+        if returned >= max_results:
             break
-
-    return {'searchResults': search_results}
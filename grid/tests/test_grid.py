@@ -0,0 +1,126 @@
+"""
+Tests of the Grid adaptor's searches, with the Grid API replaced by canned responses.
+
+The golden folder holds, for canned responses made from the samples, the results that the hand-written code the
+mappings replaced returned for them. Values that were random (keys, and the ids of some entities) are replaced by
+placeholders, which stand for the same value wherever it is used.
+
+Run from the grid folder with `python -m pytest tests`.
+"""
+import asyncio
+import json
+import os
+import sys
+
+import pytest
+from fastapi.testclient import TestClient
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+import grid  # noqa: E402
+import main  # noqa: E402
+from vcf import results_to_json  # noqa: E402
+
+GOLDEN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "golden")
+
+
+class FakeResponse:
+    def __init__(self, status_code: int, body=None):
+        self.status_code = status_code
+        self.ok = status_code < 400
+        self.body = body
+
+    def json(self):
+        return self.body
+
+
+@pytest.fixture
+def client(monkeypatch):
+    # config.yml is read from the current folder
+    monkeypatch.chdir(APP_DIR)
+    with TestClient(main.app) as client:
+        yield client
+
+
+@pytest.fixture
+def logged_exceptions(monkeypatch):
+    logged = []
+    monkeypatch.setattr(grid.logger, "exception", lambda message, *args, **kwargs: logged.append(message))
+    return logged
+
+
+def normalised(first, second):
+    """`first`, with the values that are different in `second` (the same search again) replaced by placeholders."""
+    placeholders = {}
+
+    def normalise(a, b):
+        if isinstance(a, dict):
+            assert a.keys() == b.keys()
+            return {name: normalise(a[name], b[name]) for name in a}
+        if isinstance(a, list):
+            assert len(a) == len(b)
+            return [normalise(x, y) for x, y in zip(a, b)]
+        if a != b:
+            return placeholders.setdefault(a, f"<random {len(placeholders) + 1}>")
+        return a
+    return normalise(first, second)
+
+
+def fake_api(monkeypatch, response: FakeResponse):
+    monkeypatch.setattr(grid.GridAPIClient, "make_client", lambda self: None)
+    monkeypatch.setattr(grid.GridAPIClient, "make_request", lambda self, method, url, **kwargs: response)
+
+
+def use_stream(monkeypatch, searcher_id: str, stream: bool):
+    """Sets the searcher's `stream` setting, as config.yml would."""
+    registry = main.get_registry()
+    searchers = dict(registry.config["searchers"])
+    searchers[searcher_id] = {**searchers[searcher_id], "stream": stream}
+    handler = getattr(grid, ("stream_" if stream else "get_") + searcher_id)
+    registry = registry._replace(config={**registry.config, "searchers": searchers},
+                                 handlers={**registry.handlers, searcher_id: handler})
+    monkeypatch.setattr(main, "get_registry", lambda: registry)
+
+
+@pytest.mark.parametrize("searcher_id", ["grid_company", "grid_people"])
+@pytest.mark.parametrize("stream", [False, True])
+def test_error_response(client, monkeypatch, logged_exceptions, searcher_id, stream):
+    fake_api(monkeypatch, FakeResponse(500))
+    use_stream(monkeypatch, searcher_id, stream)
+    response = client.get(f"/searchers/{searcher_id}/results", params={"query": "acme"},
+                          headers={"Cache-Control": "no-cache"})
+    assert response.status_code == 422
+    assert response.json() == {"detail": {"error": [{"message": "Error response from Grid API."}]}}
+    assert logged_exceptions == []
+
+
+@pytest.mark.parametrize("searcher_id", ["grid_company", "grid_people"])
+def test_invalid_response(client, monkeypatch, logged_exceptions, searcher_id):
+    fake_api(monkeypatch, FakeResponse(200, ["not", "an", "object"]))
+    response = client.get(f"/searchers/{searcher_id}/results", params={"query": "acme"},
+                          headers={"Cache-Control": "no-cache"})
+    assert response.status_code == 422
+    assert response.json() == {"detail": {"error": [{"message": "Error querying the Grid API."}]}}
+    assert logged_exceptions == ["Error querying the Grid API"]
+
+
+@pytest.mark.parametrize("searcher_id", ["grid_company", "grid_people"])
+def test_no_alerts(client, monkeypatch, searcher_id):
+    fake_api(monkeypatch, FakeResponse(200, {"data": {"alerts": []}}))
+    response = client.get(f"/searchers/{searcher_id}/results", params={"query": "acme"},
+                          headers={"Cache-Control": "no-cache"})
+    assert response.status_code == 200
+    assert response.json() == {"searchResults": []}
+
+
+@pytest.mark.parametrize("searcher_id", ["grid_company", "grid_people"])
+def test_golden_results(monkeypatch, searcher_id):
+    with open(os.path.join(GOLDEN_DIR, searcher_id + ".json")) as file:
+        golden = json.load(file)
+    fake_api(monkeypatch, FakeResponse(200, golden["response"]))
+    search = getattr(grid, "get_" + searcher_id)
+
+    def results():
+        return json.loads(results_to_json(asyncio.run(search(golden["query"], golden["max_results"]))))
+    assert normalised(results(), results()) == golden["expected"]
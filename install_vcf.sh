@@ -8,6 +8,10 @@
 #
 # Then run the installer by running (specifying the connectors you want to install):
 # ./install_vcf.sh Chainalysis,Gravatar,LittleSis,Cribis,VCF_Router
+#
+# To have the connectors listen on Unix domain sockets (e.g. /run/vcf/littlesis.sock) instead of network ports, so the
+# VCF Router can reach them without going over TCP, set VCF_SOCKET_DIR first. VCF_Router always uses a network port.
+# VCF_SOCKET_DIR=/run/vcf ./install_vcf.sh Chainalysis,Gravatar,LittleSis,Cribis,VCF_Router
 
 # Parse folders parameter
 if [ -z "$1" ]; then
@@ -93,19 +97,29 @@ for folder in "${folders_array[@]}"; do
     # Install Python requirements from VCF/VCF_Router/requirements.txt
     pip install -r requirements.txt
 
-    # Find an unused network port and the machine's IPv4 address
-    port=$(python -c "import socket; s=socket.socket(); s.bind(('', 0)); print(s.getsockname()[1]); s.close()")
+    if [ -n "$VCF_SOCKET_DIR" ] && [ "$folder" != "VCF_Router" ]; then
+        # Listen on a Unix domain socket named after the connector, e.g. /run/vcf/littlesis.sock
+        mkdir -p "$VCF_SOCKET_DIR"
+        address="unix://$VCF_SOCKET_DIR/${folder,,}.sock"
+        bind="--uds $VCF_SOCKET_DIR/${folder,,}.sock"
+    else
+        # Find an unused network port and the machine's IPv4 address
+        port=$(python -c "import socket; s=socket.socket(); s.bind(('', 0)); print(s.getsockname()[1]); s.close()")
+        address="$ip:$port"
+        bind="--host $ip --port $port"
+    fi
 
-    # Start the uvicorn server with the host being the IPv4 address and the port being the unused network port
-    uvicorn main:app --host $ip --port $port &
+    # Start the uvicorn server listening on the socket, or with the host being the IPv4 address and the port being the
+    # unused network port
+    uvicorn main:app $bind &
 
     # Check if cron job already exists
     if crontab -l | grep -q "$(pwd)"; then
         # crontab job exists. update it:
-        (crontab -l | sed "s|.*$(pwd).*|@reboot cd $(pwd) \&\& source venv/bin/activate \&\& uvicorn main:app --host $ip --port $port \&|g") | crontab -
+        (crontab -l | sed "s|.*$(pwd).*|@reboot cd $(pwd) \&\& source venv/bin/activate \&\& uvicorn main:app $bind \&|g") | crontab -
     else
         # Add a cron job to start the server on machine restart
-        (crontab -l 2>/dev/null; echo "@reboot cd $(pwd) && source venv/bin/activate && uvicorn main:app --host $ip --port $port &") | crontab -
-        echo "Uvicorn server started at $ip:$port, added to cron job to start on machine restart, and virtual environment activated."
+        (crontab -l 2>/dev/null; echo "@reboot cd $(pwd) && source venv/bin/activate && uvicorn main:app $bind &") | crontab -
+        echo "Uvicorn server started at $address, added to cron job to start on machine restart, and virtual environment activated."
     fi
 done